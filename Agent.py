@@ -4,208 +4,4159 @@ This module provides the core RAG functionality for document processing and Q&A.
 """
 
 import os
-from typing import List, Dict, Any
+from typing import (
+    TYPE_CHECKING, List, Dict, Any, AsyncIterator, BinaryIO, Callable, Iterable, Iterator,
+    Optional, Tuple, Union
+)
 import logging
 from pathlib import Path
-import pickle
 import tempfile
+import hashlib
+import bisect
+import codecs
+import io
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+import json
+import re
+import asyncio
+import uuid
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    TextLoader,
-    Docx2txtLoader,
-    UnstructuredFileLoader,
-)
-from langchain_ollama import OllamaEmbeddings, ChatOllama
-from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
-from langchain_core.memory import BaseMemory
-from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import BaseMessage
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain.memory import ConversationBufferMemory
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+import numpy as np
+
+# LangChain, the Ollama clients, the document loaders and faiss take over a
+# second to import. Every page imports this module, so they are imported
+# where they are first used instead.
+if TYPE_CHECKING:
+    import faiss
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+    from langchain_core.messages import BaseMessage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Per-KB manifest mapping each document to its content hash and vector IDs
+MANIFEST_FILE = "manifest.json"
+
+# Follow-up questions that lean on the conversation ("what about it?",
+# "and the second one?") and need rewriting into a standalone question
+_FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|him|her|his|"
+    r"former|latter|above|previous|same|one|ones|there)\b"
+    r"|^\s*(and|also|but|so|or|what about|how about|why|then)\b",
+    re.IGNORECASE,
+)
+
+# On-disk KB layout: immutable segment directories, each with a raw FAISS
+# index (opened with mmap), chunk store and BM25 file, listed in the manifest
+SEGMENTS_DIR = "segments"
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.sqlite"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+BM25_FILE = "bm25.npz"
+# Empty, trained index that new segments are cloned from
+TEMPLATE_FILE = "template.faiss"
+# Write-ahead log of ingestion checkpoints inside a KB directory
+WAL_DIR = "wal"
+KB_FORMAT_VERSION = 3
+
+# Read size for uploaded streams; bounds memory per upload
+STREAM_BLOCK_SIZE = 1 << 20
+
+# Non-seekable uploads are spooled to disk past this size
+STREAM_SPOOL_SIZE = 8 << 20
+
+# Leading bytes of a text file used to detect its encoding
+ENCODING_SAMPLE_SIZE = 64 << 10
+
+# Kept chunks list at most this many distinct duplicate locations; the count is exact
+MAX_DUPLICATE_SOURCES = 100
+
+# Query stats timing keys -> telemetry stage names
+_QUERY_STAGES = {
+    "cache": "answer_cache",
+    "condense": "condense",
+    "retrieve": "retrieve",
+    "first_token": "llm_first_token",
+    "answer": "llm_total",
+}
+
+# Lexical tokens: words plus identifiers such as "E-1042", "v2.3.1" or "A/B"
+_TOKEN_PATTERN = re.compile(r"\w+(?:[.\-/]\w+)*")
+
+# FastTextSplitter break points, coarsest first, and the start of the next chunk
+_SPLIT_SEPARATORS = ("\n\n", "\n", " ")
+_NON_SPACE = re.compile(r"\S")
+
+
+@lru_cache(maxsize=None)
+def _tiktoken_encoding(encoding_name: str) -> Any:
+    """Load a tiktoken encoding once per process."""
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+class FastTextSplitter:
+    """Single-pass text splitter, a faster stand-in for RecursiveCharacterTextSplitter.
+
+    Each chunk is cut at the last paragraph break that fits, else the last
+    line break, else the last space, like the recursive splitter's
+    separator order. Break points are searched only within the current
+    window, and each chunk is sliced from the text exactly once.
+    Consecutive chunks overlap by the trailing paragraphs, lines or words
+    (whichever the chunk was cut on) that fit in ``chunk_overlap``. With an
+    ``encoding_name`` (a tiktoken encoding such as "cl100k_base"),
+    ``chunk_size`` and ``chunk_overlap`` count tokens instead of characters.
+    """
+
+    def __init__(
+        self, chunk_size: int = 1000, chunk_overlap: int = 200, encoding_name: Optional[str] = None
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"Chunk overlap ({chunk_overlap}) must be smaller than chunk size ({chunk_size})"
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding_name = encoding_name
+
+    def _token_offsets(self, text: str) -> Optional[List[int]]:
+        """Start offset of every token, or None when lengths are in characters."""
+        if self.encoding_name is None:
+            return None
+        encoding = _tiktoken_encoding(self.encoding_name)
+        return encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))[1]
+
+    def split_text(self, text: str) -> List[str]:
+        """Split text into chunks of at most ``chunk_size`` characters or tokens."""
+        offsets = self._token_offsets(text)
+        end = len(text)
+
+        def advance(position: int, units: int) -> int:
+            # Position reached after ``units`` characters or tokens
+            if offsets is None:
+                return position + units
+            index = bisect.bisect_left(offsets, position) + units
+            return offsets[index] if index < len(offsets) else end
+
+        def retreat(position: int, units: int) -> int:
+            # Position ``units`` characters or tokens before ``position``
+            if offsets is None:
+                return position - units
+            return offsets[max(bisect.bisect_left(offsets, position) - units, 0)]
+
+        chunks = []
+        first = _NON_SPACE.search(text)
+        start = first.start() if first else end
+        while start < end:
+            limit = max(advance(start, self.chunk_size), start + 1)
+            separator = ""
+            if limit >= end:
+                cut = end
+            else:
+                for separator in _SPLIT_SEPARATORS:
+                    cut = text.rfind(separator, start + 1, limit + len(separator))
+                    if cut > start:
+                        break
+                else:
+                    separator, cut = "", limit
+
+            chunk = text[start:cut].strip()
+            if chunk:
+                chunks.append(chunk)
+            if cut >= end:
+                break
+
+            next_start = cut
+            if self.chunk_overlap:
+                overlap_start = retreat(cut, self.chunk_overlap)
+                if not separator:
+                    next_start = max(overlap_start, start + 1)
+                elif overlap_start > start:
+                    found = text.find(separator, overlap_start, cut)
+                    if found >= 0:
+                        next_start = found + len(separator)
+            following = _NON_SPACE.search(text, next_start)
+            start = following.start() if following else end
+        return chunks
+
+    def create_documents(
+        self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> List["Document"]:
+        """Split texts into Documents, copying each text's metadata to its chunks."""
+        from langchain_core.documents import Document
+
+        metadatas = metadatas or [{}] * len(texts)
+        return [
+            Document(page_content=chunk, metadata=dict(metadata))
+            for text, metadata in zip(texts, metadatas)
+            for chunk in self.split_text(text)
+        ]
+
+    def split_documents(self, documents: Iterable["Document"]) -> List["Document"]:
+        """Split Documents, keeping their metadata; same contract as LangChain splitters."""
+        documents = list(documents)
+        return self.create_documents(
+            [doc.page_content for doc in documents], [doc.metadata for doc in documents]
+        )
+
+
+def _build_text_splitter(
+    chunk_size: int,
+    chunk_overlap: int,
+    engine: str = "recursive",
+    encoding_name: Optional[str] = None,
+) -> Any:
+    """Create the text splitter used for chunking documents.
+
+    ``engine`` is "recursive" (LangChain's RecursiveCharacterTextSplitter)
+    or "fast" (FastTextSplitter). With ``encoding_name`` sizes are measured
+    in tiktoken tokens.
+    """
+    if engine == "fast":
+        return FastTextSplitter(chunk_size, chunk_overlap, encoding_name=encoding_name)
+    if engine != "recursive":
+        raise ValueError(f"Unknown text splitter engine: {engine}")
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    if encoding_name is not None:
+        return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=encoding_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len
+    )
+
+
+def iter_document_chunks(
+    file_path: str, text_splitter: "RecursiveCharacterTextSplitter"
+) -> Iterator["Document"]:
+    """Load a document lazily and yield its chunks as pages are parsed.
+
+    PDFs are read one page at a time and text files are decoded and split
+    block by block; other loaders are driven through ``lazy_load``. Each
+    page is split on its own, so memory is bounded by a page rather than
+    the whole document.
+    """
+    from langchain_community.document_loaders import Docx2txtLoader, UnstructuredFileLoader
+
+    # Verify file exists
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    # Select appropriate loader based on file extension
+    ext = Path(file_path).suffix.lower()
+    count = 0
+    if ext == ".pdf":
+        with open(file_path, "rb") as f:
+            for chunk in _iter_pdf_stream_chunks(file_path, f, text_splitter):
+                count += 1
+                yield chunk
+    elif ext == ".txt":
+        with open(file_path, "rb") as f:
+            for chunk in _iter_text_stream_chunks(file_path, f, text_splitter):
+                count += 1
+                yield chunk
+    else:
+        if ext == ".docx":
+            loader = Docx2txtLoader(file_path)
+        else:
+            loader = UnstructuredFileLoader(file_path)
+
+        for page in loader.lazy_load():
+            for chunk in text_splitter.split_documents([page]):
+                count += 1
+                yield chunk
+
+    if not count:
+        raise ValueError(f"No content found in file: {file_path}")
+    logger.info(f"Successfully loaded and split document: {file_path}")
+
+
+def load_and_split_document(
+    file_path: str, text_splitter: "RecursiveCharacterTextSplitter"
+) -> List[Any]:
+    """Load a document with the loader matching its extension and split it into chunks."""
+    try:
+        return list(iter_document_chunks(file_path, text_splitter))
+    except Exception as e:
+        logger.error(f"Error loading document {file_path}: {str(e)}")
+        raise
+
+
+class _TimedSplitter:
+    """Text splitter wrapper that adds up the time spent splitting."""
+
+    def __init__(self, splitter: Any):
+        self.splitter = splitter
+        self.seconds = 0.0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.splitter, name)
+
+    def split_text(self, text: str) -> List[str]:
+        start = time.perf_counter()
+        try:
+            return self.splitter.split_text(text)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def split_documents(self, documents: Iterable["Document"]) -> List["Document"]:
+        start = time.perf_counter()
+        try:
+            return self.splitter.split_documents(documents)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+# Per-process splitter cache for ingestion workers, keyed by _build_text_splitter arguments
+_worker_splitters: Dict[Tuple[Any, ...], Any] = {}
+
+
+def _split_document_worker(
+    file_path: str, splitter_args: Tuple[Any, ...]
+) -> Tuple[List[Any], float, float]:
+    """Process pool entry point: load and split one document.
+
+    Returns (chunks, load milliseconds, split milliseconds).
+    """
+    if splitter_args not in _worker_splitters:
+        _worker_splitters[splitter_args] = _build_text_splitter(*splitter_args)
+    splitter = _TimedSplitter(_worker_splitters[splitter_args])
+    start = time.perf_counter()
+    chunks = load_and_split_document(file_path, splitter)
+    split_ms = splitter.seconds * 1000
+    return chunks, (time.perf_counter() - start) * 1000 - split_ms, split_ms
+
+
+def open_upload(upload: Any) -> Tuple[str, BinaryIO]:
+    """Return (document name, binary stream) for an upload.
+
+    Accepts file-like objects with a ``name`` attribute (such as Streamlit's
+    UploadedFile), ``(name, stream)`` pairs and ``(name, bytes)`` pairs.
+    """
+    if isinstance(upload, tuple):
+        name, stream = upload
+    else:
+        name, stream = getattr(upload, "name", ""), upload
+    if isinstance(stream, (bytes, bytearray, memoryview)):
+        stream = io.BytesIO(stream)
+    return Path(name).name, stream
+
+
+def scan_stream(stream: BinaryIO) -> Tuple[str, BinaryIO]:
+    """Hash a stream block by block and rewind it.
+
+    Returns (sha256, stream positioned at the start). Streams that cannot
+    seek are copied to a spooled temporary file on the way, which is
+    returned in their place.
+    """
+    digest = hashlib.sha256()
+    seekable = getattr(stream, "seekable", lambda: False)()
+    start = stream.tell() if seekable else 0
+    target = stream if seekable else tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_SIZE)
+
+    for block in iter(lambda: stream.read(STREAM_BLOCK_SIZE), b""):
+        digest.update(block)
+        if not seekable:
+            target.write(block)
+    target.seek(start)
+    return digest.hexdigest(), target
+
+
+def detect_encoding(sample: bytes) -> str:
+    """Guess the encoding of a text file from its leading bytes.
+
+    Valid UTF-8 (including plain ASCII) is recognized without a detector;
+    anything else goes to charset-normalizer, or chardet if it is missing.
+    """
+    try:
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the end of the sample is still UTF-8
+        if e.start >= len(sample) - 3 and e.reason == "unexpected end of data":
+            return "utf-8"
+
+    try:
+        from charset_normalizer import from_bytes
+
+        matches = from_bytes(sample)
+        match = matches.best()
+        # Western single-byte code pages are easily confused; cp1252 is by
+        # far the most common of them, so keep it when it reads as well
+        for candidate in matches:
+            if candidate.encoding == "cp1252" and candidate.coherence >= match.coherence:
+                match = candidate
+        encoding = match.encoding if match is not None else None
+    except ImportError:
+        import chardet
+
+        encoding = chardet.detect(sample)["encoding"]
+
+    if not encoding:
+        # Undetectable binary-ish data: cp1252 maps nearly every byte
+        return "cp1252"
+    encoding = codecs.lookup(encoding).name
+    # ASCII samples may be followed by UTF-8 text further into the file
+    return "utf-8" if encoding == "ascii" else encoding
+
+
+def _iter_text_stream_chunks(
+    name: str, stream: BinaryIO, text_splitter: "RecursiveCharacterTextSplitter"
+) -> Iterator["Document"]:
+    """Detect a text stream's encoding, then decode and split it one block at a time.
+
+    The stream is read once: the encoding is guessed from the start of the
+    first block. Bytes that do not decode are replaced rather than aborting
+    the file part way through, and a warning is logged.
+    """
+    from langchain_core.documents import Document
+
+    block = stream.read(STREAM_BLOCK_SIZE)
+    encoding = detect_encoding(block[:ENCODING_SAMPLE_SIZE])
+    metadata = {"source": name, "encoding": encoding}
+    if encoding != "utf-8":
+        logger.info(f"Detected {encoding} encoding: {name}")
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    replaced = False
+    buffer = ""
+    while True:
+        text = decoder.decode(block, final=not block)
+        replaced = replaced or "\ufffd" in text
+        buffer += text
+        if block and len(buffer) < STREAM_BLOCK_SIZE:
+            block = stream.read(STREAM_BLOCK_SIZE)
+            continue
+        texts = text_splitter.split_text(buffer)
+        if block and len(texts) > 1:
+            # The last chunk may continue in the next block: split it again with it
+            tail = buffer.rfind(texts[-1])
+            if tail > 0:
+                buffer = buffer[tail:]
+                texts = texts[:-1]
+            else:
+                buffer = ""
+        else:
+            buffer = ""
+        for chunk_text in texts:
+            yield Document(page_content=chunk_text, metadata=dict(metadata))
+        if not block:
+            break
+        block = stream.read(STREAM_BLOCK_SIZE)
+
+    if replaced:
+        logger.warning(f"Some bytes of {name} are not valid {encoding} and were replaced")
+
+
+def _iter_pdf_stream_chunks(
+    name: str, stream: BinaryIO, text_splitter: "RecursiveCharacterTextSplitter"
+) -> Iterator["Document"]:
+    """Parse and split a PDF stream one page at a time."""
+    from langchain_core.documents import Document
+
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        from PyPDF2 import PdfReader
+
+    reader = PdfReader(stream)
+    for page_number, page in enumerate(reader.pages):
+        text = page.extract_text() or ""
+        # Parsed objects are cached per reader; drop them so memory stays at one page
+        reader.resolved_objects.clear()
+        for chunk_text in text_splitter.split_text(text):
+            yield Document(page_content=chunk_text, metadata={"source": name, "page": page_number})
+
+
+def _iter_temp_file_chunks(
+    name: str, stream: BinaryIO, text_splitter: "RecursiveCharacterTextSplitter"
+) -> Iterator["Document"]:
+    """Split formats whose loaders need a path, via a private temporary file."""
+    fd, temp_path = tempfile.mkstemp(prefix="docubuddy-", suffix=Path(name).suffix.lower())
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(stream, f, STREAM_BLOCK_SIZE)
+        for chunk in iter_document_chunks(temp_path, text_splitter):
+            chunk.metadata["source"] = name
+            yield chunk
+    finally:
+        os.remove(temp_path)
+
+
+def iter_stream_chunks(
+    name: str,
+    stream: BinaryIO,
+    text_splitter: "RecursiveCharacterTextSplitter",
+) -> Iterator["Document"]:
+    """Yield the chunks of an uploaded document as it is read.
+
+    PDFs are parsed page by page and text files are decoded block by block,
+    so only a page or block is held in memory. Other formats go through
+    their path-based loader using a unique temporary file.
+    """
+    ext = Path(name).suffix.lower()
+    if ext == ".pdf":
+        chunks = _iter_pdf_stream_chunks(name, stream, text_splitter)
+    elif ext == ".txt":
+        chunks = _iter_text_stream_chunks(name, stream, text_splitter)
+    else:
+        chunks = _iter_temp_file_chunks(name, stream, text_splitter)
+
+    count = 0
+    for chunk in chunks:
+        count += 1
+        yield chunk
+    if not count:
+        raise ValueError(f"No content found in file: {name}")
+    logger.info(f"Successfully loaded and split document: {name}")
+
+
+def file_content_hash(file_path: str) -> str:
+    """Return the sha256 of a file's bytes, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_faiss_index(index_factory: str, training_vectors: np.ndarray) -> "faiss.Index":
+    """Create an empty FAISS index from a factory string, training it if required.
+
+    ``index_factory`` is any faiss factory description, e.g. "Flat",
+    "HNSW32", "IVF4096,PQ64" or "IVF1024,SQ8". The index uses L2 distance,
+    like the default LangChain FAISS store.
+    """
+    import faiss
+
+    training_vectors = np.ascontiguousarray(training_vectors, dtype=np.float32)
+    index = faiss.index_factory(training_vectors.shape[1], index_factory)
+    if not index.is_trained:
+        index.train(training_vectors)
+    return index
+
+
+def apply_search_params(index: "faiss.Index", search_params: Dict[str, Any]) -> None:
+    """Set query-time parameters such as nprobe or efSearch on an index.
+
+    Parameters that do not apply to the index type are skipped. A
+    SegmentedIndex passes them on to its segments and to its next head.
+    """
+    if isinstance(index, SegmentedIndex):
+        index.search_params = dict(search_params or {})
+        for segment in index.all_segments():
+            apply_search_params(segment.index, index.search_params)
+        return
+    if isinstance(index, NumpyIndex):
+        return
+    import faiss
+
+    parameter_space = faiss.ParameterSpace()
+    for name, value in (search_params or {}).items():
+        try:
+            parameter_space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            logger.debug(f"Search parameter {name} does not apply to this index type")
+
+
+class NumpyIndex:
+    """Exact cosine-similarity index over one contiguous NumPy matrix.
+
+    A lighter alternative to a FAISS flat index for small knowledge bases.
+    It implements the part of the ``faiss.Index`` interface that LangChain's
+    FAISS store and this module use, so it works with the same vector
+    store, retrievers and KB layout; ``index.faiss`` then holds a plain
+    ``.npy`` array, which loads memory-mapped. Vectors are normalized when
+    added and stored as float32, float16 or int8 (each vector scaled so its
+    largest component is 127). A search scores all rows against a batch of
+    queries with one matrix product and picks the top k with
+    ``argpartition``; float16 and int8 rows are widened ``BLOCK_ROWS`` at a
+    time so the float32 copy stays in cache. Widening float16 is slow in
+    NumPy, so int8 is usually both the smaller and the faster option.
+    Distances are squared L2 between unit vectors (2 - 2 * cosine), so
+    scores mean what they do with ``IndexFlatL2``.
+    """
+
+    BLOCK_ROWS = 512
+    QUERY_BATCH = 64
+    DTYPES = ("float32", "float16", "int8")
+    is_trained = True
+
+    def __init__(self, d: int, dtype: str = "float32"):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported vector dtype {dtype}; use one of {self.DTYPES}")
+        self.d = d
+        self.dtype = np.dtype(dtype)
+        self.ntotal = 0
+        self._data = np.zeros((0, d), dtype=self.dtype)
+        # 1 / norm of each stored row (int8 rows are not unit length);
+        # computed on first use after loading
+        self._inv_norms: Optional[np.ndarray] = np.zeros(0, dtype=np.float32)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """The stored rows (a view, possibly memory-mapped)."""
+        return self._data[: self.ntotal]
+
+    def memory_usage(self) -> int:
+        """Bytes of vector data held, including spare capacity."""
+        return self._data.nbytes + (self._inv_norms.nbytes if self._inv_norms is not None else 0)
+
+    @property
+    def inv_norms(self) -> np.ndarray:
+        if self._inv_norms is None:
+            self._inv_norms = self._inverse_norms(self.vectors)
+        return self._inv_norms
+
+    def _encode(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32).reshape(-1, self.d)
+        norms = np.linalg.norm(x, axis=1, keepdims=True)
+        x = x / np.where(norms > 0, norms, 1)
+        if self.dtype == np.int8:
+            peaks = np.abs(x).max(axis=1, keepdims=True)
+            return np.rint(x * (127 / np.where(peaks > 0, peaks, 1))).astype(np.int8)
+        return x.astype(self.dtype)
+
+    def _inverse_norms(self, codes: np.ndarray) -> np.ndarray:
+        if self.dtype != np.int8:
+            return np.ones(len(codes), dtype=np.float32)
+        inv_norms = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.BLOCK_ROWS):
+            block = codes[start : start + self.BLOCK_ROWS].astype(np.float32)
+            norms = np.linalg.norm(block, axis=1)
+            inv_norms[start : start + len(block)] = np.where(norms > 0, 1 / np.maximum(norms, 1e-12), 0)
+        return inv_norms
+
+    def add(self, x: np.ndarray) -> None:
+        """Normalize, quantize and append vectors."""
+        codes = self._encode(x)
+        needed = self.ntotal + len(codes)
+        if needed > len(self._data):
+            # Grow geometrically; a memory-mapped matrix is copied into memory here
+            capacity = max(needed, 2 * len(self._data), 1024)
+            data = np.empty((capacity, self.d), dtype=self.dtype)
+            data[: self.ntotal] = self.vectors
+            inv_norms = np.empty(capacity, dtype=np.float32)
+            inv_norms[: self.ntotal] = self.inv_norms[: self.ntotal]
+            self._data, self._inv_norms = data, inv_norms
+        self._data[self.ntotal : needed] = codes
+        self._inv_norms[self.ntotal : needed] = self._inverse_norms(codes)
+        self.ntotal = needed
+
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (distances, positions) of the k nearest rows for each query row."""
+        queries = np.asarray(x, dtype=np.float32).reshape(-1, self.d)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1)
+
+        distances = np.full((len(queries), k), np.finfo(np.float32).max, dtype=np.float32)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        found = min(k, self.ntotal)
+        if not found:
+            return distances, labels
+        for first in range(0, len(queries), self.QUERY_BATCH):
+            group = queries[first : first + self.QUERY_BATCH]
+            scores = self._scores(group)
+            if found < self.ntotal:
+                top = np.argpartition(-scores, found - 1, axis=0)[:found]
+            else:
+                top = np.broadcast_to(np.arange(found)[:, None], scores.shape)
+            top_scores = np.take_along_axis(scores, top, axis=0)
+            order = np.argsort(-top_scores, axis=0)
+            rows = slice(first, first + len(group))
+            distances[rows, :found] = (2 - 2 * np.take_along_axis(top_scores, order, axis=0)).T
+            labels[rows, :found] = np.take_along_axis(top, order, axis=0).T
+        return distances, labels
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every row to each query, shape (ntotal, queries)."""
+        if self.dtype == np.float32:
+            return self.vectors @ queries.T
+        scores = np.empty((self.ntotal, len(queries)), dtype=np.float32)
+        for start in range(0, self.ntotal, self.BLOCK_ROWS):
+            block = self._data[start : min(start + self.BLOCK_ROWS, self.ntotal)]
+            np.matmul(block.astype(np.float32), queries.T, out=scores[start : start + len(block)])
+        scores *= self.inv_norms[: self.ntotal, None]
+        return scores
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        """Return the stored unit vector at a position, as float32."""
+        return self._data[position].astype(np.float32) * self.inv_norms[position]
+
+    def remove_ids(self, ids: Any) -> int:
+        """Remove rows by position, shifting later rows down like ``IndexFlat``."""
+        ids = np.asarray(ids, dtype=np.int64)
+        keep = np.ones(self.ntotal, dtype=bool)
+        keep[ids[(ids >= 0) & (ids < self.ntotal)]] = False
+        removed = self.ntotal - int(keep.sum())
+        if removed:
+            self._inv_norms = self.inv_norms[: self.ntotal][keep]
+            self._data = self.vectors[keep]
+            self.ntotal = len(self._data)
+        return removed
+
+    def reset(self) -> None:
+        """Remove every row."""
+        self.__init__(self.d, self.dtype.name)
+
+    def save(self, path: str) -> None:
+        """Write the rows as a ``.npy`` array."""
+        with open(path, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors), allow_pickle=False)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "NumpyIndex":
+        """Read an index written by save(), memory-mapping it read-only by default."""
+        data = np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+        index = cls(data.shape[1], data.dtype.name)
+        index._data = data
+        index.ntotal = len(data)
+        index._inv_norms = None
+        return index
+
+
+def read_vector_index(index_path: str, mmap: bool = True) -> Any:
+    """Read a FAISS or NumPy index file, memory-mapping it when the type supports it."""
+    with open(index_path, "rb") as f:
+        is_numpy = f.read(6) == b"\x93NUMPY"
+    if is_numpy:
+        return NumpyIndex.load(index_path, mmap=mmap)
+
+    import faiss
+
+    if mmap:
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            logger.debug(f"Index at {index_path} cannot be memory-mapped, reading it instead")
+    return faiss.read_index(index_path)
+
+
+def _connect_read_only(db_path: str) -> sqlite3.Connection:
+    return sqlite3.connect(
+        f"file:{Path(db_path).resolve().as_posix()}?mode=ro",
+        uri=True,
+        check_same_thread=False,
+    )
+
+
+class SQLiteDocstore:
+    """Docstore backed by the chunks.sqlite files of a knowledge base's segments.
+
+    Chunks are read on demand, so only the documents that queries actually
+    return are ever materialized. ``db_paths`` are ordered newest segment
+    first and a chunk is read from the first file that has it, so a newer
+    segment can hold an updated copy of a chunk that an older one indexes.
+    Additions and deletions are kept in memory until the knowledge base is
+    saved. The class is registered as a LangChain ``Docstore``/``AddableMixin``
+    on first use rather than subclassing them, which would import LangChain
+    with this module.
+    """
+
+    def __init__(self, db_paths: Union[str, List[str]]):
+        from langchain_community.docstore.base import AddableMixin, Docstore
+
+        Docstore.register(SQLiteDocstore)
+        AddableMixin.register(SQLiteDocstore)
+        self.db_paths = [db_paths] if isinstance(db_paths, str) else list(db_paths)
+        self._lock = threading.Lock()
+        self._added: Dict[str, "Document"] = {}
+        self._deleted: set = set()
+        self._conns: List[sqlite3.Connection] = []
+        self.reopen()
+
+    def reopen(self, discard_changes: bool = True) -> None:
+        """(Re)connect to the database files, dropping pending changes unless told not to."""
+        self.close()
+        self._conns = [_connect_read_only(path) for path in self.db_paths]
+        if discard_changes:
+            self._added = {}
+            self._deleted = set()
+
+    def close(self) -> None:
+        """Close the database connections."""
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+
+    def push(self, db_path: str) -> None:
+        """Read a newly saved segment's chunk store first; it holds the pending changes."""
+        conn = _connect_read_only(db_path)
+        with self._lock:
+            self.db_paths.insert(0, db_path)
+            self._conns.insert(0, conn)
+        self._added = {}
+        self._deleted = set()
+
+    def pending(self) -> Dict[str, "Document"]:
+        """Chunks added or updated since the last save."""
+        return dict(self._added)
+
+    def search(self, search: str) -> Union[str, "Document"]:
+        """Return the chunk stored under an ID."""
+        from langchain_core.documents import Document
+
+        if search in self._deleted:
+            return f"ID {search} not found."
+        if search in self._added:
+            return self._added[search]
+
+        row = None
+        with self._lock:
+            for conn in self._conns:
+                row = conn.execute(
+                    "SELECT content, metadata FROM chunks WHERE docstore_id = ?", (search,)
+                ).fetchone()
+                if row is not None:
+                    break
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: Dict[str, "Document"]) -> None:
+        """Stage chunks for the next save."""
+        self._added.update(texts)
+        self._deleted.difference_update(texts)
+
+    def delete(self, ids: List) -> None:
+        """Stage chunk deletions for the next save."""
+        for chunk_id in ids:
+            self._added.pop(chunk_id, None)
+            self._deleted.add(chunk_id)
+
+
+def empty_index_like(index: Any) -> Any:
+    """Return an empty index of the same type, parameters and training as ``index``."""
+    if isinstance(index, NumpyIndex):
+        return NumpyIndex(index.d, index.dtype.name)
+    import faiss
+
+    if isinstance(index, faiss.IndexFlat):
+        return faiss.IndexFlat(index.d, index.metric_type)
+    empty = faiss.clone_index(index)
+    empty.reset()
+    return empty
+
+
+def _segment_vectors(index: Any, rows: np.ndarray) -> np.ndarray:
+    """Read stored vectors back by row; quantized indexes return their decoded approximation."""
+    rows = np.asarray(rows, dtype=np.int64)
+    if isinstance(index, NumpyIndex):
+        return index.vectors[rows].astype(np.float32) * index.inv_norms[rows, None]
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(rows)
+
+
+def _copy_rows(src: Any, dst: Any, rows: np.ndarray) -> None:
+    """Append rows of one index to another of the same type.
+
+    IVF indexes cloned from the same template share their coarse quantizer,
+    so their codes are copied list by list as they are; other types are
+    added from reconstructed vectors, which re-encodes quantized ones.
+    """
+    if not len(rows):
+        return
+    if not isinstance(src, NumpyIndex):
+        import faiss
+
+        if (
+            isinstance(src, faiss.IndexIVF)
+            and isinstance(dst, faiss.IndexIVF)
+            and (src.nlist, src.code_size) == (dst.nlist, dst.code_size)
+        ):
+            # Rows added with add() carry their row number as IVF ID
+            new_ids = np.full(src.ntotal, -1, dtype=np.int64)
+            new_ids[rows] = dst.ntotal + np.arange(len(rows))
+            src_lists, dst_lists = src.invlists, dst.invlists
+            for list_number in range(src.nlist):
+                size = src_lists.list_size(list_number)
+                if not size:
+                    continue
+                ids_ptr = src_lists.get_ids(list_number)
+                codes_ptr = src_lists.get_codes(list_number)
+                ids = new_ids[faiss.rev_swig_ptr(ids_ptr, size)]
+                codes = faiss.rev_swig_ptr(codes_ptr, size * src_lists.code_size).reshape(size, -1)
+                keep = ids >= 0
+                kept_ids = np.ascontiguousarray(ids[keep])
+                kept_codes = np.ascontiguousarray(codes[keep])
+                src_lists.release_ids(list_number, ids_ptr)
+                src_lists.release_codes(list_number, codes_ptr)
+                if len(kept_ids):
+                    dst_lists.add_entries(
+                        list_number, len(kept_ids), faiss.swig_ptr(kept_ids), faiss.swig_ptr(kept_codes)
+                    )
+            dst.ntotal += len(rows)
+            return
+    for start in range(0, len(rows), 4096):
+        dst.add(_segment_vectors(src, rows[start : start + 4096]))
+
+
+class IndexSegment:
+    """One segment of a SegmentedIndex: an index and which of its rows are live.
+
+    ``ids`` holds the chunk ID of each row of a saved segment, None for
+    rows deleted before it was written or since; it is None for the unsaved
+    head segment, whose chunk IDs only the vector store's mapping knows.
+    """
+
+    def __init__(
+        self, index: Any, name: Optional[str] = None, seq: int = 0, ids: Optional[List[Optional[str]]] = None
+    ):
+        self.index = index
+        self.name = name
+        self.seq = seq
+        self.ids = ids
+        if ids is None:
+            self._alive = np.ones(index.ntotal, dtype=bool)
+        else:
+            self._alive = np.fromiter((chunk_id is not None for chunk_id in ids), dtype=bool, count=len(ids))
+        self.rows = len(self._alive)
+        self.live = int(self._alive.sum())
+        self._live_rows: Optional[np.ndarray] = None
+        self._ranks: Optional[np.ndarray] = None
+
+    @property
+    def alive(self) -> np.ndarray:
+        return self._alive[: self.rows]
+
+    def extend(self, count: int) -> None:
+        """Mark ``count`` rows appended to the index as live."""
+        needed = self.rows + count
+        if needed > len(self._alive):
+            # Grow geometrically; ingestion appends one small batch at a time
+            alive = np.zeros(max(needed, 2 * len(self._alive), 1024), dtype=bool)
+            alive[: self.rows] = self.alive
+            self._alive = alive
+        self._alive[self.rows : needed] = True
+        self.rows = needed
+        self.live += count
+        self._live_rows = self._ranks = None
+
+    def kill(self, rows: np.ndarray) -> None:
+        """Mark live rows as deleted."""
+        self._alive[rows] = False
+        self.live -= len(rows)
+        self._live_rows = self._ranks = None
+
+    def live_rows(self) -> np.ndarray:
+        if self._live_rows is None:
+            self._live_rows = np.flatnonzero(self.alive)
+        return self._live_rows
+
+    def ranks(self) -> np.ndarray:
+        """Each row's position among the segment's live rows (meaningful for live rows)."""
+        if self._ranks is None:
+            self._ranks = np.cumsum(self.alive) - 1
+        return self._ranks
+
+
+class SegmentedIndex:
+    """Vector index made of immutable saved segments plus a mutable head segment.
+
+    It implements the part of the ``faiss.Index`` interface that LangChain's
+    FAISS store and this module use. Added vectors go to the head, an
+    in-memory index cloned from ``template``; saving the knowledge base
+    writes the head as one new segment (see ``append_segment``) instead of
+    rewriting the whole index, and saved segments stay memory-mapped.
+    Removed rows are only marked deleted, which works for every index type,
+    including those FAISS cannot remove from (HNSW) or does not renumber
+    (IVF); the chunk IDs of rows removed from saved segments are kept in
+    ``deleted`` until the next save stores them as tombstones.
+
+    Positions number the live rows of all segments in order, oldest first,
+    so removing rows shifts later positions down like ``IndexFlat``. A
+    search queries every segment that has live rows, asking for k plus the
+    segment's deleted rows, and merges the results by distance.
+    """
+
+    is_trained = True
+
+    def __init__(
+        self,
+        segments: List[IndexSegment],
+        template: Any,
+        kb_path: Optional[str] = None,
+        generation: Optional[str] = None,
+        next_seq: int = 1,
+        lineage: Optional[str] = None,
+    ):
+        self.segments = sorted(segments, key=lambda segment: segment.seq)
+        self.template = template
+        self.d = template.d
+        # faiss.METRIC_INNER_PRODUCT (0) ranks larger scores first; L2 and NumpyIndex smaller
+        self.metric_type = getattr(template, "metric_type", 1)
+        self.head: Optional[IndexSegment] = None
+        # KB directory and manifest generation the saved segments were read from;
+        # the lineage only changes when the KB is replaced by a snapshot
+        self.kb_path = kb_path
+        self.generation = generation
+        self.lineage = lineage
+        # Sequence number of the next saved segment; also bounds new tombstones
+        self.next_seq = max([next_seq] + [segment.seq + 1 for segment in self.segments])
+        # Chunk ID -> tombstone bound, for rows removed from saved segments since the last save
+        self.deleted: Dict[str, int] = {}
+        self.search_params: Dict[str, Any] = {}
+        self._starts: Optional[np.ndarray] = None
+
+    def all_segments(self) -> List[IndexSegment]:
+        """Saved segments, oldest first, then the head if there is one."""
+        return self.segments + ([self.head] if self.head is not None else [])
+
+    @property
+    def ntotal(self) -> int:
+        return sum(segment.live for segment in self.all_segments())
+
+    def _offsets(self) -> np.ndarray:
+        """Position of each segment's first live row, plus the total."""
+        if self._starts is None:
+            self._starts = np.cumsum([0] + [segment.live for segment in self.all_segments()])
+        return self._starts
+
+    def _locate(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Map positions to (segment number, row) pairs."""
+        starts = self._offsets()
+        # Segments without live rows share the next segment's start and are skipped
+        numbers = np.searchsorted(starts, positions, side="right") - 1
+        rows = np.empty(len(positions), dtype=np.int64)
+        segments = self.all_segments()
+        for number in np.unique(numbers):
+            selected = numbers == number
+            rows[selected] = segments[number].live_rows()[positions[selected] - starts[number]]
+        return numbers, rows
+
+    def add(self, x: np.ndarray) -> None:
+        """Append vectors to the head segment, creating it on first use."""
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        if self.head is None:
+            index = empty_index_like(self.template)
+            apply_search_params(index, self.search_params)
+            self.head = IndexSegment(index)
+        before = self.head.index.ntotal
+        self.head.index.add(x)
+        self.head.extend(self.head.index.ntotal - before)
+        self._starts = None
+
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (distances, positions) of the k nearest live rows for each query row."""
+        queries = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        descending = self.metric_type == 0
+        fill = -np.inf if descending else np.inf
+        found_distances, found_labels = [], []
+        for segment, start in zip(self.all_segments(), self._offsets()):
+            if not segment.live:
+                continue
+            segment_k = min(segment.rows, k + segment.rows - segment.live)
+            distances, labels = segment.index.search(queries, segment_k)
+            rows = np.where(labels >= 0, labels, 0)
+            valid = (labels >= 0) & segment.alive[rows]
+            found_distances.append(np.where(valid, distances, fill))
+            found_labels.append(np.where(valid, start + segment.ranks()[rows], -1))
+
+        distances = np.full((len(queries), k), fill, dtype=np.float32)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        if not found_distances:
+            return distances, labels
+        merged_distances = np.concatenate(found_distances, axis=1)
+        merged_labels = np.concatenate(found_labels, axis=1)
+        order = np.argsort(-merged_distances if descending else merged_distances, axis=1, kind="stable")[:, :k]
+        distances[:, : order.shape[1]] = np.take_along_axis(merged_distances, order, axis=1)
+        labels[:, : order.shape[1]] = np.take_along_axis(merged_labels, order, axis=1)
+        return distances, labels
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        """Return the stored vector at a position, as float32."""
+        numbers, rows = self._locate(np.array([position], dtype=np.int64))
+        return _segment_vectors(self.all_segments()[numbers[0]].index, rows)[0]
+
+    def remove_ids(self, ids: Any) -> int:
+        """Mark rows deleted by position; later positions shift down."""
+        positions = np.unique(np.asarray(ids, dtype=np.int64))
+        positions = positions[(positions >= 0) & (positions < self.ntotal)]
+        if not len(positions):
+            return 0
+        segments = self.all_segments()
+        numbers, rows = self._locate(positions)
+        for number in np.unique(numbers):
+            segment = segments[number]
+            segment_rows = rows[numbers == number]
+            segment.kill(segment_rows)
+            if segment.ids is not None:
+                for row in segment_rows:
+                    self.deleted[segment.ids[row]] = self.next_seq
+        self._starts = None
+        return len(positions)
+
+    def head_ids(self, index_to_docstore_id: Dict[int, str]) -> List[Optional[str]]:
+        """Chunk ID of each head row, None for deleted rows."""
+        start = int(self._offsets()[-2])
+        ids: List[Optional[str]] = [None] * self.head.rows
+        for rank, row in enumerate(self.head.live_rows()):
+            ids[row] = index_to_docstore_id[start + rank]
+        return ids
+
+    def seal_head(self, index: Any, name: str, seq: int, ids: List[Optional[str]]) -> None:
+        """Replace the head by the saved segment written from it; positions do not change."""
+        self.segments.append(IndexSegment(index, name, seq, ids))
+        self.head = None
+        self._starts = None
+
+    def merged(self) -> Any:
+        """Return one index of the template's type holding every live row, in position order."""
+        index = empty_index_like(self.template)
+        for segment in self.all_segments():
+            _copy_rows(segment.index, index, segment.live_rows())
+        apply_search_params(index, self.search_params)
+        return index
+
+
+def write_index_file(index: Any, path: str) -> None:
+    """Write a FAISS index or NumpyIndex to a file ``read_vector_index`` can open."""
+    if isinstance(index, NumpyIndex):
+        index.save(path)
+    else:
+        import faiss
+
+        faiss.write_index(index, path)
+
+
+def write_segment(
+    segment_dir: str,
+    index: Any,
+    ids: List[Optional[str]],
+    chunk_rows: Iterable[Tuple[str, str, str]],
+    documents: Dict[str, Dict[str, Any]],
+    bm25: Optional["BM25Index"] = None,
+) -> int:
+    """Write one immutable KB segment and fsync it; returns how many chunks it stores.
+
+    ``ids`` gives the chunk ID of each index row, None for rows that are
+    deleted already. ``chunk_rows`` are (chunk ID, text, metadata JSON)
+    tuples; they must include the live rows and may also hold updated
+    copies of chunks older segments index. The first row for an ID wins.
+    ``documents`` are the manifest entries added or changed with this
+    segment. The BM25 file covers the live rows and is built from their
+    text unless ``bm25`` is given.
+    """
+    os.makedirs(segment_dir, exist_ok=True)
+    write_index_file(index, os.path.join(segment_dir, INDEX_FILE))
+    missing = {chunk_id for chunk_id in ids if chunk_id is not None}
+    build_bm25 = bm25 is None
+    if build_bm25:
+        bm25 = BM25Index()
+
+    stored = 0
+    conn = sqlite3.connect(os.path.join(segment_dir, CHUNKS_FILE))
+    try:
+        conn.execute("CREATE TABLE positions (position INTEGER PRIMARY KEY, docstore_id TEXT NOT NULL)")
+        conn.execute(
+            "CREATE TABLE chunks (docstore_id TEXT PRIMARY KEY, content TEXT NOT NULL, "
+            "metadata TEXT NOT NULL)"
+        )
+        conn.execute("CREATE TABLE documents (name TEXT PRIMARY KEY, entry TEXT NOT NULL)")
+        conn.executemany(
+            "INSERT INTO positions VALUES (?, ?)",
+            ((position, chunk_id) for position, chunk_id in enumerate(ids) if chunk_id is not None),
+        )
+        chunk_rows = iter(chunk_rows)
+        while True:
+            batch = list(islice(chunk_rows, 1000))
+            if not batch:
+                break
+            stored += conn.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?, ?)", batch).rowcount
+            for chunk_id, content, _ in batch:
+                if chunk_id in missing:
+                    missing.discard(chunk_id)
+                    if build_bm25:
+                        bm25.add(chunk_id, content)
+        if missing:
+            raise ValueError(f"Chunk {next(iter(missing))} is missing from the docstore")
+        conn.executemany(
+            "INSERT INTO documents VALUES (?, ?)",
+            ((name, json.dumps(entry)) for name, entry in documents.items()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    bm25.save(os.path.join(segment_dir, BM25_FILE))
+    _fsync_tree(segment_dir)
+    _fsync_directory(os.path.dirname(os.path.abspath(segment_dir)))
+    return stored
+
+
+def _store_chunk_rows(vector_store: "FAISS") -> Iterator[Tuple[str, str, str]]:
+    """(chunk ID, text, metadata JSON) of every chunk a vector store indexes, in position order."""
+    from langchain_core.documents import Document
+
+    for _, chunk_id in sorted(vector_store.index_to_docstore_id.items()):
+        doc = vector_store.docstore.search(chunk_id)
+        if not isinstance(doc, Document):
+            raise ValueError(f"Chunk {chunk_id} is missing from the docstore")
+        yield chunk_id, doc.page_content, json.dumps(doc.metadata)
+
+
+def read_manifest(kb_path: str) -> Dict[str, Any]:
+    """Return a KB's manifest, or an empty dict if it has none."""
+    path = os.path.join(kb_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(kb_path: str, manifest: Dict[str, Any]) -> None:
+    """Atomically replace a KB's manifest, which commits the segments it lists."""
+    path = os.path.join(kb_path, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_directory(kb_path)
+
+
+def is_knowledge_base(kb_path: str) -> bool:
+    """True if a directory holds a saved knowledge base, in any format."""
+    return os.path.exists(os.path.join(kb_path, MANIFEST_FILE)) or os.path.exists(
+        os.path.join(kb_path, INDEX_FILE)
+    )
+
+
+_kb_locks: Dict[str, threading.RLock] = {}
+_kb_locks_lock = threading.Lock()
+
+
+def knowledge_base_lock(kb_path: str) -> threading.RLock:
+    """Lock serializing the manifest updates of one KB directory within this process."""
+    key = str(Path(kb_path).resolve())
+    with _kb_locks_lock:
+        return _kb_locks.setdefault(key, threading.RLock())
+
+
+def _segment_entries(manifest: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return sorted(manifest.get("segments", []), key=lambda entry: entry["seq"])
+
+
+def read_vector_store(
+    kb_path: str, embeddings: Any, mmap: bool = True, manifest: Optional[Dict[str, Any]] = None
+) -> "FAISS":
+    """Open the segments of a KB as one FAISS store over a SegmentedIndex.
+
+    Segment indexes are memory-mapped when the index type supports it and
+    chunk texts stay on disk until a query returns them. Rows whose chunk
+    ID has a tombstone newer than their segment are left out.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    if manifest is None:
+        manifest = read_manifest(kb_path)
+    tombstones = manifest.get("deleted_chunks", {})
+    segments = []
+    for entry in _segment_entries(manifest):
+        segment_dir = os.path.join(kb_path, SEGMENTS_DIR, entry["name"])
+        index = read_vector_index(os.path.join(segment_dir, INDEX_FILE), mmap=mmap)
+        ids: List[Optional[str]] = [None] * index.ntotal
+        conn = _connect_read_only(os.path.join(segment_dir, CHUNKS_FILE))
+        try:
+            for position, chunk_id in conn.execute("SELECT position, docstore_id FROM positions"):
+                if tombstones.get(chunk_id, 0) <= entry["seq"]:
+                    ids[position] = chunk_id
+        finally:
+            conn.close()
+        segments.append(IndexSegment(index, entry["name"], entry["seq"], ids))
+
+    template_path = os.path.join(kb_path, TEMPLATE_FILE)
+    if os.path.exists(template_path):
+        template = read_vector_index(template_path, mmap=False)
+    else:
+        template = empty_index_like(segments[0].index)
+    index = SegmentedIndex(
+        segments,
+        template,
+        kb_path=kb_path,
+        generation=manifest.get("generation"),
+        next_seq=manifest.get("next_seq", 1),
+        lineage=manifest.get("lineage"),
+    )
+    docstore = SQLiteDocstore(
+        [os.path.join(kb_path, SEGMENTS_DIR, segment.name, CHUNKS_FILE) for segment in reversed(segments)]
+    )
+    live_ids = (chunk_id for segment in segments for chunk_id in segment.ids if chunk_id is not None)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(live_ids)),
+    )
+
+
+def _read_segment_bm25(segment_dir: str) -> "BM25Index":
+    """Load a segment's BM25 file, building it from the chunk store if it is missing."""
+    path = os.path.join(segment_dir, BM25_FILE)
+    if os.path.exists(path):
+        return BM25Index.load(path)
+    bm25 = BM25Index()
+    conn = _connect_read_only(os.path.join(segment_dir, CHUNKS_FILE))
+    try:
+        for chunk_id, content in conn.execute(
+            "SELECT p.docstore_id, c.content FROM positions p JOIN chunks c USING (docstore_id) "
+            "ORDER BY p.position"
+        ):
+            bm25.add(chunk_id, content)
+    finally:
+        conn.close()
+    return bm25
+
+
+def read_bm25_index(kb_path: str, manifest: Dict[str, Any]) -> "BM25Index":
+    """Combine the BM25 files of a KB's segments, leaving out deleted chunks."""
+    tombstones = manifest.get("deleted_chunks", {})
+    parts = []
+    for entry in _segment_entries(manifest):
+        part = _read_segment_bm25(os.path.join(kb_path, SEGMENTS_DIR, entry["name"]))
+        deleted = set()
+        if tombstones:
+            deleted = {chunk_id for chunk_id in part.doc_ids if tombstones.get(chunk_id, 0) > entry["seq"]}
+        parts.append((part, deleted))
+    return BM25Index.concatenate(parts)
+
+
+def read_documents(kb_path: str, manifest: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return the manifest entries of a KB's documents; newer segments override older ones."""
+    tombstones = manifest.get("deleted_documents", {})
+    documents = {}
+    for entry in _segment_entries(manifest):
+        conn = _connect_read_only(os.path.join(kb_path, SEGMENTS_DIR, entry["name"], CHUNKS_FILE))
+        try:
+            for name, value in conn.execute("SELECT name, entry FROM documents"):
+                if tombstones.get(name, 0) <= entry["seq"]:
+                    documents[name] = json.loads(value)
+        finally:
+            conn.close()
+    return documents
+
+
+def migrate_knowledge_base(kb_path: str, embeddings: Any = None) -> bool:
+    """Convert a KB in an older on-disk format to the segmented layout in place.
+
+    A pickle-based KB (index.faiss + index.pkl) is rewritten as a snapshot.
+    In a format 2 KB the index, chunk store and BM25 file become the first
+    segment; the manifest is replaced last, so an interrupted migration is
+    finished by the next one. Returns False if the KB needs no migration.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    with knowledge_base_lock(kb_path):
+        manifest = read_manifest(kb_path)
+        if manifest.get("format", 0) >= KB_FORMAT_VERSION:
+            return False
+        settings = {
+            "version": 1,
+            "index_factory": manifest.get("index_factory", "Flat"),
+            "search_params": manifest.get("search_params", {}),
+        }
+
+        if os.path.exists(os.path.join(kb_path, LEGACY_DOCSTORE_FILE)):
+            legacy_store = FAISS.load_local(
+                kb_path,
+                embeddings,
+                allow_dangerous_deserialization=True,  # Only for local files we created
+            )
+            write_knowledge_base(
+                kb_path,
+                legacy_store,
+                build_bm25_index(legacy_store),
+                {**settings, "documents": manifest.get("documents", {})},
+            )
+            logger.info(f"Migrated knowledge base at {kb_path} to format {KB_FORMAT_VERSION}")
+            return True
+
+        name = f"{1:08d}-migrated"
+        segment_dir = os.path.join(kb_path, SEGMENTS_DIR, name)
+        if not os.path.exists(os.path.join(kb_path, INDEX_FILE)) and not os.path.exists(segment_dir):
+            return False
+        os.makedirs(segment_dir, exist_ok=True)
+        for filename in (INDEX_FILE, CHUNKS_FILE, BM25_FILE):
+            if os.path.exists(os.path.join(kb_path, filename)):
+                os.replace(os.path.join(kb_path, filename), os.path.join(segment_dir, filename))
+        conn = sqlite3.connect(os.path.join(segment_dir, CHUNKS_FILE))
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, entry TEXT NOT NULL)")
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?)",
+                ((doc_name, json.dumps(entry)) for doc_name, entry in manifest.get("documents", {}).items()),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        index = read_vector_index(os.path.join(segment_dir, INDEX_FILE))
+        write_index_file(empty_index_like(index), os.path.join(kb_path, TEMPLATE_FILE))
+        _fsync_tree(kb_path)
+        write_manifest(
+            kb_path,
+            {
+                **settings,
+                "format": KB_FORMAT_VERSION,
+                "lineage": uuid.uuid4().hex,
+                "generation": uuid.uuid4().hex,
+                "next_seq": 2,
+                "segments": [{"name": name, "seq": 1, "rows": index.ntotal}],
+                "deleted_chunks": {},
+                "deleted_documents": {},
+            },
+        )
+        logger.info(f"Migrated knowledge base at {kb_path} to format {KB_FORMAT_VERSION}")
+        return True
+
+
+def _fsync_tree(path: str) -> None:
+    """Flush every file under a directory, and the directories themselves, to disk."""
+    for root, _, files in os.walk(path):
+        for name in files:
+            fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        _fsync_directory(root)
+
+
+def _fsync_directory(path: str) -> None:
+    """Persist a directory's entries (renames, new files); not supported on Windows."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _staging_paths(kb_path: str, kind: str) -> List[str]:
+    """Temporary ("tmp") or replaced ("old") copies of a KB directory next to it."""
+    parent, name = os.path.split(os.path.abspath(kb_path))
+    if not os.path.isdir(parent):
+        return []
+    prefix = f".{name}.{kind}-"
+    return sorted(
+        (os.path.join(parent, entry) for entry in os.listdir(parent) if entry.startswith(prefix)),
+        key=os.path.getmtime,
+    )
+
+
+class KnowledgeBaseConflict(Exception):
+    """A KB was changed on disk in a way that saving a stale view would overwrite."""
+
+
+def write_knowledge_base(
+    kb_path: str,
+    vector_store: "FAISS",
+    bm25: "BM25Index",
+    manifest: Dict[str, Any],
+    expected_generation: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Atomically replace a KB directory with a single-segment snapshot; returns its manifest.
+
+    The snapshot is written to a temporary sibling directory, manifest
+    last, and fsynced; then the current directory is renamed aside, the new
+    one renamed into place and the old one deleted. A crash leaves either
+    the old or the new snapshot, which ``recover_knowledge_base`` puts back.
+    Where directories cannot be renamed (open files on Windows), the files
+    are moved into the existing directory one by one instead. ``manifest``
+    holds the KB settings and its "documents" entries. A docstore reading
+    the replaced directory is closed; reopen the KB to read the snapshot.
+    If ``expected_generation`` is given ("" for no KB), a KB at ``kb_path``
+    saved at another generation raises KnowledgeBaseConflict instead of
+    being overwritten.
+    """
+    parent, name = os.path.split(os.path.abspath(kb_path))
+    os.makedirs(parent, exist_ok=True)
+    index = vector_store.index
+    if isinstance(index, SegmentedIndex):
+        template = index.template
+        index = index.merged()
+    else:
+        template = empty_index_like(index)
+    ids = [vector_store.index_to_docstore_id[position] for position in range(index.ntotal)]
+
+    with knowledge_base_lock(kb_path):
+        recover_knowledge_base(kb_path)
+        if expected_generation is not None and read_manifest(kb_path).get("generation", "") != expected_generation:
+            message = f"Knowledge base at {kb_path} was saved by someone else since it was loaded"
+            logger.error(message)
+            raise KnowledgeBaseConflict(message)
+        tmp_path = os.path.join(parent, f".{name}.tmp-{uuid.uuid4().hex[:8]}")
+        try:
+            segment_name = f"{1:08d}-{uuid.uuid4().hex[:8]}"
+            write_segment(
+                os.path.join(tmp_path, SEGMENTS_DIR, segment_name),
+                index,
+                ids,
+                _store_chunk_rows(vector_store),
+                manifest.get("documents", {}),
+                bm25,
+            )
+            write_index_file(template, os.path.join(tmp_path, TEMPLATE_FILE))
+            manifest = {key: value for key, value in manifest.items() if key != "documents"}
+            manifest.update(
+                format=KB_FORMAT_VERSION,
+                lineage=uuid.uuid4().hex,
+                generation=uuid.uuid4().hex,
+                next_seq=2,
+                segments=[{"name": segment_name, "seq": 1, "rows": index.ntotal}],
+                deleted_chunks={},
+                deleted_documents={},
+            )
+            write_manifest(tmp_path, manifest)
+            _fsync_tree(tmp_path)
+
+            # A docstore reading the directory being replaced must let go of it first
+            docstore = vector_store.docstore
+            kb_dir = Path(kb_path).resolve()
+            reading_target = isinstance(docstore, SQLiteDocstore) and any(
+                kb_dir in Path(db_path).resolve().parents for db_path in docstore.db_paths
+            )
+            if reading_target:
+                docstore.close()
+            try:
+                _replace_directory(tmp_path, kb_path)
+            except Exception:
+                if reading_target:
+                    docstore.reopen(discard_changes=False)
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    return manifest
+
+
+def _replace_directory(src: str, dst: str) -> None:
+    """Move a fully written KB directory into place of dst."""
+    parent, name = os.path.split(os.path.abspath(dst))
+    if not os.path.exists(dst):
+        os.rename(src, dst)
+        _fsync_directory(parent)
+        return
+
+    old_path = os.path.join(parent, f".{name}.old-{uuid.uuid4().hex[:8]}")
+    try:
+        os.rename(dst, old_path)
+    except OSError:
+        # Files in dst are open; move the new segments in, then the manifest that
+        # lists them. Segments it no longer lists are removed by compaction.
+        segments_dir = os.path.join(dst, SEGMENTS_DIR)
+        os.makedirs(segments_dir, exist_ok=True)
+        for entry in os.listdir(os.path.join(src, SEGMENTS_DIR)):
+            os.replace(os.path.join(src, SEGMENTS_DIR, entry), os.path.join(segments_dir, entry))
+        _fsync_directory(segments_dir)
+        os.replace(os.path.join(src, TEMPLATE_FILE), os.path.join(dst, TEMPLATE_FILE))
+        os.replace(os.path.join(src, MANIFEST_FILE), os.path.join(dst, MANIFEST_FILE))
+        _fsync_directory(dst)
+        for entry in (INDEX_FILE, CHUNKS_FILE, BM25_FILE, LEGACY_DOCSTORE_FILE):
+            try:
+                os.remove(os.path.join(dst, entry))
+            except OSError:
+                pass
+        shutil.rmtree(os.path.join(dst, WAL_DIR), ignore_errors=True)
+        return
+    os.rename(src, dst)
+    _fsync_directory(parent)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def recover_knowledge_base(kb_path: str) -> bool:
+    """Finish or roll back a save interrupted by a crash, and remove leftover copies.
+
+    If the KB directory is missing, the newest complete temporary snapshot
+    (one whose manifest was written) is moved into place, or else the
+    previous snapshot that was being replaced. Returns True if the
+    directory was restored.
+    """
+    restored = False
+    if not os.path.exists(kb_path):
+        for candidate in reversed(_staging_paths(kb_path, "tmp")):
+            try:
+                with open(os.path.join(candidate, MANIFEST_FILE), encoding="utf-8") as f:
+                    json.load(f)
+            except (OSError, ValueError):
+                continue
+            os.rename(candidate, kb_path)
+            restored = True
+            break
+        else:
+            old_paths = _staging_paths(kb_path, "old")
+            if old_paths:
+                os.rename(old_paths[-1], kb_path)
+                restored = True
+        if restored:
+            _fsync_directory(os.path.dirname(os.path.abspath(kb_path)))
+            logger.warning(f"Recovered knowledge base at {kb_path} after an interrupted save")
+
+    if os.path.exists(kb_path):
+        for leftover in _staging_paths(kb_path, "tmp") + _staging_paths(kb_path, "old"):
+            shutil.rmtree(leftover, ignore_errors=True)
+    return restored
+
+
+def append_segment(
+    kb_path: str,
+    vector_store: "FAISS",
+    documents: Dict[str, Dict[str, Any]],
+    removed_documents: List[str],
+    settings: Dict[str, Any],
+    generation: Optional[str] = None,
+) -> Optional[Tuple[Dict[str, Any], bool]]:
+    """Save the changes made to a KB since it was read as one new segment.
+
+    Only the head segment's vectors, the chunks added since the last save
+    and the ``documents`` entries that changed are written, plus
+    tombstones for removed chunks and ``removed_documents``, so the cost
+    follows the size of the change rather than of the KB. The vector store
+    keeps serving queries, with the head replaced by the saved segment.
+
+    ``generation`` is the manifest generation the changes were made
+    against, by default the one the store was read at. If other saves
+    landed since, the segment is rebased onto them: their documents and
+    chunks are kept unless this save removes or replaces them. Returns the
+    manifest and whether it was rebased, in which case the store lacks the
+    other saves' changes and should be reopened. Returns None if the store
+    was not read from ``kb_path``; the caller then writes a full snapshot
+    instead. Raises KnowledgeBaseConflict if the KB was replaced by a
+    snapshot or deleted since it was read.
+    """
+    index, docstore = vector_store.index, vector_store.docstore
+    if not (
+        isinstance(index, SegmentedIndex)
+        and isinstance(docstore, SQLiteDocstore)
+        and index.kb_path is not None
+        and Path(index.kb_path).resolve() == Path(kb_path).resolve()
+    ):
+        return None
+
+    with knowledge_base_lock(kb_path):
+        manifest = read_manifest(kb_path)
+        if manifest.get("format") != KB_FORMAT_VERSION or manifest.get("lineage") != index.lineage:
+            message = f"Knowledge base at {kb_path} was replaced or deleted since it was loaded"
+            logger.error(message)
+            raise KnowledgeBaseConflict(message)
+        rebased = manifest.get("generation") != (generation or index.generation)
+        seq = max(manifest["next_seq"], index.next_seq)
+        deleted = dict(index.deleted)
+        if rebased:
+            # Tombstone the chunks of removed or replaced documents as other saves
+            # left them, but none that a document still uses. Bounds are raised to
+            # the new segment, as compaction may have merged the rows into a newer one.
+            current = read_documents(kb_path, manifest)
+            final = {name: entry for name, entry in current.items() if name not in removed_documents}
+            final.update(documents)
+            referenced = {chunk_id for entry in final.values() for chunk_id in entry["ids"]}
+            for doc_name in set(removed_documents) | set(documents):
+                deleted.update(dict.fromkeys(current.get(doc_name, {}).get("ids", []), seq))
+            deleted = {chunk_id: seq for chunk_id in deleted if chunk_id not in referenced}
+        head = index.head
+        has_rows = head is not None and head.live > 0
+        pending = docstore.pending()
+        name = None
+        if has_rows or pending or documents:
+            name = f"{seq:08d}-{uuid.uuid4().hex[:8]}"
+            segment_index = head.index if has_rows else empty_index_like(index.template)
+            ids = index.head_ids(vector_store.index_to_docstore_id) if has_rows else []
+            write_segment(
+                os.path.join(kb_path, SEGMENTS_DIR, name),
+                segment_index,
+                ids,
+                ((chunk_id, doc.page_content, json.dumps(doc.metadata)) for chunk_id, doc in pending.items()),
+                documents,
+            )
+            manifest["segments"].append({"name": name, "seq": seq, "rows": segment_index.ntotal})
+        if name is not None or deleted or removed_documents:
+            for chunk_id, bound in deleted.items():
+                manifest["deleted_chunks"][chunk_id] = max(manifest["deleted_chunks"].get(chunk_id, 0), bound)
+            for doc_name in removed_documents:
+                manifest["deleted_documents"][doc_name] = seq
+            manifest.update(settings)
+            manifest["generation"] = uuid.uuid4().hex
+            manifest["next_seq"] = seq + 1
+            write_manifest(kb_path, manifest)
+        if name is not None:
+            segment_dir = os.path.join(kb_path, SEGMENTS_DIR, name)
+            if has_rows:
+                sealed = read_vector_index(os.path.join(segment_dir, INDEX_FILE))
+                apply_search_params(sealed, index.search_params)
+                index.seal_head(sealed, name, seq, ids)
+            docstore.push(os.path.join(segment_dir, CHUNKS_FILE))
+        if index.head is not None:
+            # A head whose rows were all deleted again has nothing to keep
+            index.head = None
+            index._starts = None
+        index.deleted = {}
+        index.generation = manifest["generation"]
+        index.next_seq = manifest["next_seq"]
+    return manifest, rebased
+
+
+_compacting: set = set()
+_compacting_lock = threading.Lock()
+
+
+def compact_knowledge_base(kb_path: str, max_segments: int = 8, max_deleted_ratio: float = 0.3) -> int:
+    """Merge segments of a KB and purge deleted rows; returns how many segments were rewritten.
+
+    When there are more than ``max_segments`` segments, the run of adjacent
+    segments with the fewest live rows that brings the count down to half
+    of that is merged into one. Otherwise the segment with the largest
+    share of deleted rows is rewritten, if that share exceeds
+    ``max_deleted_ratio``. The merged segment is written without holding
+    the KB lock and committed by replacing the manifest, so saves and
+    queries carry on meanwhile; if a snapshot replaced the KB by then,
+    nothing is committed. Segments it replaces are deleted by the next
+    compaction, giving processes still reading them time to reload.
+    """
+    key = str(Path(kb_path).resolve())
+    with _compacting_lock:
+        if key in _compacting:
+            return 0
+        _compacting.add(key)
+    try:
+        return _compact_segments(kb_path, max_segments, max_deleted_ratio)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(key)
+
+
+def _compact_segments(kb_path: str, max_segments: int, max_deleted_ratio: float) -> int:
+    segments_dir = os.path.join(kb_path, SEGMENTS_DIR)
+    # Plan under the lock, so a snapshot cannot replace the KB while it is read
+    with knowledge_base_lock(kb_path):
+        manifest = read_manifest(kb_path)
+        if manifest.get("format") != KB_FORMAT_VERSION:
+            return 0
+        lineage = manifest.get("lineage")
+        entries = _segment_entries(manifest)
+        deleted_chunks = manifest["deleted_chunks"]
+        deleted_documents = manifest["deleted_documents"]
+
+        # Live (row, chunk ID) pairs of every segment, and the chunk IDs and
+        # document names it holds, deleted or not
+        live, held = [], []
+        for entry in entries:
+            conn = _connect_read_only(os.path.join(segments_dir, entry["name"], CHUNKS_FILE))
+            try:
+                rows = conn.execute("SELECT position, docstore_id FROM positions ORDER BY position").fetchall()
+                names = {doc_name for doc_name, in conn.execute("SELECT name FROM documents")}
+            finally:
+                conn.close()
+            live.append(
+                [(row, chunk_id) for row, chunk_id in rows if deleted_chunks.get(chunk_id, 0) <= entry["seq"]]
+            )
+            held.append((entry["seq"], {chunk_id for _, chunk_id in rows}, names))
+
+    if len(entries) > max_segments:
+        width = min(len(entries), len(entries) - max_segments // 2 + 1)
+        start = min(
+            range(len(entries) - width + 1),
+            key=lambda first: sum(len(rows) for rows in live[first : first + width]),
+        )
+    else:
+        ratios = [1 - len(rows) / entry["rows"] if entry["rows"] else 0.0 for entry, rows in zip(entries, live)]
+        if not ratios or max(ratios) <= max_deleted_ratio:
+            return 0
+        width, start = 1, ratios.index(max(ratios))
+    window = entries[start : start + width]
+    window_live = live[start : start + width]
+    seq = window[-1]["seq"]
+
+    # Keep the text of chunks still indexed anywhere: the window's own rows and
+    # updated copies of chunks that older segments index
+    wanted = {chunk_id for rows in live for _, chunk_id in rows}
+
+    def chunk_rows() -> Iterator[Tuple[str, str, str]]:
+        for entry in reversed(window):
+            conn = _connect_read_only(os.path.join(segments_dir, entry["name"], CHUNKS_FILE))
+            try:
+                for row in conn.execute("SELECT docstore_id, content, metadata FROM chunks"):
+                    if row[0] in wanted:
+                        yield row
+            finally:
+                conn.close()
+
+    name = f"{seq:08d}-{uuid.uuid4().hex[:8]}"
+    merged_dir = os.path.join(segments_dir, name)
+    try:
+        template_path = os.path.join(kb_path, TEMPLATE_FILE)
+        template = read_vector_index(template_path, mmap=False) if os.path.exists(template_path) else None
+        merged_index = None
+        ids: List[str] = []
+        bm25_parts = []
+        documents: Dict[str, Dict[str, Any]] = {}
+        for entry, rows in zip(window, window_live):
+            segment_dir = os.path.join(segments_dir, entry["name"])
+            segment_index = read_vector_index(os.path.join(segment_dir, INDEX_FILE))
+            if merged_index is None:
+                merged_index = empty_index_like(template if template is not None else segment_index)
+            _copy_rows(segment_index, merged_index, np.array([row for row, _ in rows], dtype=np.int64))
+            ids.extend(chunk_id for _, chunk_id in rows)
+            part = _read_segment_bm25(segment_dir)
+            live_ids = {chunk_id for _, chunk_id in rows}
+            bm25_parts.append((part, {chunk_id for chunk_id in part.doc_ids if chunk_id not in live_ids}))
+            conn = _connect_read_only(os.path.join(segment_dir, CHUNKS_FILE))
+            try:
+                for doc_name, value in conn.execute("SELECT name, entry FROM documents"):
+                    if deleted_documents.get(doc_name, 0) <= entry["seq"]:
+                        documents[doc_name] = json.loads(value)
+            finally:
+                conn.close()
+        stored = write_segment(
+            merged_dir, merged_index, ids, chunk_rows(), documents, BM25Index.concatenate(bm25_parts)
+        )
+    except Exception:
+        shutil.rmtree(merged_dir, ignore_errors=True)
+        if read_manifest(kb_path).get("lineage") != lineage:
+            # A snapshot replaced the KB and its segments while they were merged
+            logger.info(f"Skipped compacting {kb_path}, which was replaced meanwhile")
+            return 0
+        raise
+
+    window_names = [entry["name"] for entry in window]
+    with knowledge_base_lock(kb_path):
+        manifest = read_manifest(kb_path)
+        current = {entry["name"] for entry in manifest.get("segments", [])}
+        if manifest.get("lineage") != lineage or not set(window_names) <= current:
+            # The KB was replaced by a snapshot meanwhile
+            shutil.rmtree(merged_dir, ignore_errors=True)
+            return 0
+        segments = [entry for entry in manifest["segments"] if entry["name"] not in window_names]
+        if ids or documents or stored:
+            segments.append({"name": name, "seq": seq, "rows": merged_index.ntotal})
+        segments.sort(key=lambda entry: entry["seq"])
+        # A tombstone is needed while a segment older than its bound holds what it
+        # deletes. Segments appended since planning are newer than those tombstones.
+        held = [
+            segment_held for segment_held, entry in zip(held, entries) if entry["name"] not in window_names
+        ] + [(seq, set(ids), set(documents))]
+        for number, tombstones, planned in (
+            (1, manifest["deleted_chunks"], deleted_chunks),
+            (2, manifest["deleted_documents"], deleted_documents),
+        ):
+            for tombstone, bound in planned.items():
+                if tombstones.get(tombstone) == bound and not any(
+                    segment_held[0] < bound and tombstone in segment_held[number] for segment_held in held
+                ):
+                    del tombstones[tombstone]
+        retired = manifest.get("retired", [])
+        manifest["segments"] = segments
+        manifest["retired"] = window_names
+        write_manifest(kb_path, manifest)
+
+        keep = {entry["name"] for entry in segments} | set(window_names)
+        for entry in os.listdir(segments_dir):
+            if entry not in keep:
+                shutil.rmtree(os.path.join(segments_dir, entry), ignore_errors=True)
+        if name not in keep:
+            shutil.rmtree(merged_dir, ignore_errors=True)
+    logger.info(
+        f"Compacted {len(window)} segment(s) of {kb_path} into {merged_index.ntotal} rows "
+        f"({len(segments)} segment(s) left, {len(retired)} retired segment(s) removed)"
+    )
+    return len(window)
+
+
+class IngestLog:
+    """Write-ahead log of ingested chunks and documents for one KB directory.
+
+    Ingestion appends each embedded batch (chunk IDs, texts, metadata and
+    vectors) and each fully read document's manifest entry, and flushes
+    them to the current segment file with an fsync every few batches.
+    After a crash, ``RAGSystem.load_knowledge_base`` replays the log on top
+    of the last saved snapshot: documents whose chunks all reached the log
+    are restored, so re-ingesting the same files skips them. Saving the KB
+    removes the log.
+
+    Records are length-prefixed and CRC-checked; replay stops at the first
+    incomplete or corrupt record, which is where a crash cut the log off.
+    Only one RAGSystem in a process writes a KB's log at a time; others do
+    not replay a log that is being written.
+    """
+
+    SEGMENT_BYTES = 64 << 20
+    _HEADER = struct.Struct("<II")
+    _writers: set = set()
+    _writers_lock = threading.Lock()
+
+    def __init__(self, wal_dir: str):
+        self.wal_dir = wal_dir
+        self._pending: List[bytes] = []
+        self._key = str(Path(wal_dir).resolve())
+        self._registered = False
+
+    def segments(self) -> List[str]:
+        """Paths of the segment files, oldest first."""
+        if not os.path.isdir(self.wal_dir):
+            return []
+        return sorted(
+            os.path.join(self.wal_dir, name) for name in os.listdir(self.wal_dir) if name.endswith(".seg")
+        )
+
+    def in_use(self) -> bool:
+        """True if a RAGSystem in this process is writing this log."""
+        with IngestLog._writers_lock:
+            return self._key in IngestLog._writers and not self._registered
+
+    def append_chunks(self, model: str, batch: List[Tuple[str, Any]], vectors: List[List[float]]) -> None:
+        """Buffer an embedded batch of (chunk_id, chunk) pairs."""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        header = {
+            "model": model,
+            "ids": [chunk_id for chunk_id, _ in batch],
+            "texts": [doc.page_content for _, doc in batch],
+            "metadatas": [doc.metadata for _, doc in batch],
+            "shape": list(matrix.shape),
+        }
+        self._buffer(b"C", header, matrix.tobytes())
+
+    def append_document(self, name: str, entry: Dict[str, Any], duplicates: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Buffer a document's manifest entry and the duplicate chunks it pointed elsewhere."""
+        self._buffer(b"D", {"name": name, "entry": entry, "duplicates": duplicates}, b"")
+
+    def _buffer(self, kind: bytes, header: Dict[str, Any], body: bytes) -> None:
+        if not self._registered:
+            with IngestLog._writers_lock:
+                IngestLog._writers.add(self._key)
+            self._registered = True
+        encoded = json.dumps(header).encode("utf-8")
+        payload = kind + struct.pack("<I", len(encoded)) + encoded + body
+        self._pending.append(self._HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+
+    def flush(self) -> int:
+        """Append buffered records to the current segment and fsync it; returns bytes written."""
+        if not self._pending:
+            return 0
+        os.makedirs(self.wal_dir, exist_ok=True)
+        segments = self.segments()
+        if not segments or os.path.getsize(segments[-1]) >= self.SEGMENT_BYTES:
+            number = int(Path(segments[-1]).stem) + 1 if segments else 1
+            segments.append(os.path.join(self.wal_dir, f"{number:08d}.seg"))
+            created = True
+        else:
+            created = False
+        data = b"".join(self._pending)
+        with open(segments[-1], "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if created:
+            _fsync_directory(self.wal_dir)
+        self._pending = []
+        return len(data)
+
+    def replay(self) -> Iterator[Tuple[str, Dict[str, Any], Optional[np.ndarray]]]:
+        """Yield ("chunks" | "document", header, vectors) records in the order they were written."""
+        for segment in self.segments():
+            with open(segment, "rb") as f:
+                data = f.read()
+            offset = 0
+            while offset + self._HEADER.size <= len(data):
+                length, checksum = self._HEADER.unpack_from(data, offset)
+                payload = data[offset + self._HEADER.size : offset + self._HEADER.size + length]
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                offset += self._HEADER.size + length
+                (header_length,) = struct.unpack_from("<I", payload, 1)
+                header = json.loads(payload[5 : 5 + header_length])
+                if payload[:1] == b"C":
+                    vectors = np.frombuffer(payload[5 + header_length :], dtype=np.float32)
+                    yield "chunks", header, vectors.reshape(header["shape"])
+                else:
+                    yield "document", header, None
+            if offset < len(data):
+                logger.warning(f"Ignoring {len(data) - offset} bytes of incomplete log records in {segment}")
+                return
+
+    def clear(self) -> None:
+        """Delete the log once its content is part of a saved snapshot."""
+        self._pending = []
+        shutil.rmtree(self.wal_dir, ignore_errors=True)
+        self.release()
+
+    def release(self) -> None:
+        """Stop being this log's writer, e.g. when the writing RAGSystem is closed."""
+        if self._registered:
+            with IngestLog._writers_lock:
+                IngestLog._writers.discard(self._key)
+            self._registered = False
+
+
+class AnswerCache:
+    """In-memory LRU cache of answers with TTL expiry.
+
+    Entries are grouped by a scope tuple (KB version, model and retrieval
+    settings) and keyed by the normalized question. With a
+    ``similarity_threshold``, a question whose embedding has at least that
+    cosine similarity to a cached question in the same scope is also a hit.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 3600,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Lower-case, collapse whitespace and drop trailing punctuation."""
+        return " ".join(question.lower().split()).rstrip("?.! ")
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for key in [key for key, entry in self._entries.items() if entry["created"] < cutoff]:
+            del self._entries[key]
+
+    def get(
+        self, scope: Tuple, question: str, embedding: Optional[List[float]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Return the cached result for a question, or None."""
+        key = (*scope, self.normalize_question(question))
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None and embedding is not None and self.similarity_threshold:
+                entry = self._nearest(scope, embedding)
+                if entry is not None:
+                    self.semantic_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(entry["key"])
+            return entry["result"]
+
+    def _nearest(self, scope: Tuple, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """Find the most similar cached question in the same scope above the threshold."""
+        candidates = [
+            entry
+            for key, entry in self._entries.items()
+            if key[: len(scope)] == scope and entry["embedding"] is not None
+        ]
+        if not candidates:
+            return None
+
+        matrix = np.array([entry["embedding"] for entry in candidates], dtype=np.float32)
+        query = np.asarray(embedding, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        similarities = matrix @ query / np.maximum(norms, 1e-12)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return candidates[best]
+        return None
+
+    def put(
+        self,
+        scope: Tuple,
+        question: str,
+        result: Dict[str, Any],
+        embedding: Optional[List[float]] = None,
+    ) -> None:
+        """Cache a result, evicting the least recently used entry if full."""
+        key = (*scope, self.normalize_question(question))
+        with self._lock:
+            self._entries[key] = {
+                "key": key,
+                "result": result,
+                "embedding": embedding,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all cached answers."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the number of cached answers."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+class BM25Index:
+    """Compact in-process BM25 inverted index over KB chunks.
+
+    Postings are stored in CSR form: ``offsets[t]:offsets[t + 1]`` slices
+    ``doc_numbers``/``term_freqs`` for term ``t``. Chunks added since the
+    last compaction go to small per-term ``array`` buffers and deletions are
+    tombstoned until the index is saved.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.doc_ids: List[str] = []
+        self.doc_lengths = array("i")
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._doc_numbers = np.zeros(0, dtype=np.int32)
+        self._term_freqs = np.zeros(0, dtype=np.int32)
+        self._pending: Dict[int, Tuple[array, array]] = {}
+        self._deleted: set = set()
+        self._doc_numbers_by_id: Dict[str, int] = {}
+        self._total_length = 0
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Split text into lower-cased word and identifier tokens."""
+        return _TOKEN_PATTERN.findall(text.lower())
+
+    def __len__(self) -> int:
+        return len(self.doc_ids) - len(self._deleted)
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the index, including vocabulary and IDs."""
+        arrays = self._offsets.nbytes + self._doc_numbers.nbytes + self._term_freqs.nbytes
+        pending = sum(
+            numbers.itemsize * len(numbers) * 2 for numbers, _ in self._pending.values()
+        )
+        # Rough per-entry cost of the Python dicts and lists
+        objects = 100 * (len(self.vocab) + 2 * len(self.doc_ids))
+        return arrays + pending + 4 * len(self.doc_lengths) + objects
+
+    def add(self, docstore_id: str, text: str) -> None:
+        """Index one chunk under its docstore ID."""
+        if docstore_id in self._doc_numbers_by_id:
+            self.remove([docstore_id])
+        doc_number = len(self.doc_ids)
+        self.doc_ids.append(docstore_id)
+        self._doc_numbers_by_id[docstore_id] = doc_number
+
+        tokens = self.tokenize(text)
+        self.doc_lengths.append(len(tokens))
+        self._total_length += len(tokens)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            term = self.vocab.setdefault(token, len(self.vocab))
+            if term not in self._pending:
+                self._pending[term] = (array("i"), array("i"))
+            numbers, freqs = self._pending[term]
+            numbers.append(doc_number)
+            freqs.append(count)
+
+    def remove(self, docstore_ids: Iterable[str]) -> None:
+        """Tombstone chunks; they are dropped for good at the next compaction."""
+        for docstore_id in docstore_ids:
+            doc_number = self._doc_numbers_by_id.pop(docstore_id, None)
+            if doc_number is not None:
+                self._deleted.add(doc_number)
+                self._total_length -= self.doc_lengths[doc_number]
+
+    def _postings(self, term: int) -> Tuple[np.ndarray, np.ndarray]:
+        numbers = self._doc_numbers[0:0]
+        freqs = self._term_freqs[0:0]
+        if term + 1 < len(self._offsets):
+            start, end = self._offsets[term], self._offsets[term + 1]
+            numbers, freqs = self._doc_numbers[start:end], self._term_freqs[start:end]
+        if term in self._pending:
+            extra_numbers, extra_freqs = self._pending[term]
+            numbers = np.concatenate([numbers, np.frombuffer(extra_numbers, dtype=np.int32)])
+            freqs = np.concatenate([freqs, np.frombuffer(extra_freqs, dtype=np.int32)])
+        return numbers, freqs
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return up to k (docstore ID, BM25 score) pairs, best first."""
+        live_docs = len(self)
+        if not live_docs:
+            return []
+
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        lengths = np.frombuffer(self.doc_lengths, dtype=np.int32)
+        avg_length = max(self._total_length / live_docs, 1.0)
+        for token in set(self.tokenize(query)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            numbers, freqs = self._postings(term)
+            if self._deleted:
+                live = ~np.isin(numbers, list(self._deleted))
+                numbers, freqs = numbers[live], freqs[live]
+            if not len(numbers):
+                continue
+            idf = np.log(1 + (live_docs - len(numbers) + 0.5) / (len(numbers) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[numbers] / avg_length)
+            scores[numbers] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.doc_ids[i], float(scores[i])) for i in candidates]
+
+    def compact(self) -> None:
+        """Merge pending postings into the CSR arrays and purge deleted chunks."""
+        keep = np.ones(len(self.doc_ids), dtype=bool)
+        keep[list(self._deleted)] = False
+        renumber = np.cumsum(keep, dtype=np.int64) - 1
+
+        offsets = [0]
+        numbers_parts, freqs_parts = [], []
+        for term in range(len(self.vocab)):
+            numbers, freqs = self._postings(term)
+            live = keep[numbers]
+            numbers_parts.append(renumber[numbers[live]].astype(np.int32))
+            freqs_parts.append(freqs[live])
+            offsets.append(offsets[-1] + int(live.sum()))
+
+        self._offsets = np.array(offsets, dtype=np.int64)
+        self._doc_numbers = np.concatenate(numbers_parts) if numbers_parts else self._doc_numbers[:0]
+        self._term_freqs = np.concatenate(freqs_parts) if freqs_parts else self._term_freqs[:0]
+        self.doc_ids = [doc_id for doc_id, kept in zip(self.doc_ids, keep) if kept]
+        self.doc_lengths = array("i", (length for length, kept in zip(self.doc_lengths, keep) if kept))
+        self._doc_numbers_by_id = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        self._pending = {}
+        self._deleted = set()
+
+    def save(self, path: str) -> None:
+        """Compact and write the index as a pickle-free .npz file."""
+        self.compact()
+        terms = sorted(self.vocab, key=self.vocab.get)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            offsets=self._offsets,
+            doc_numbers=self._doc_numbers,
+            term_freqs=self._term_freqs,
+            doc_lengths=np.frombuffer(self.doc_lengths, dtype=np.int32),
+            terms=np.array(terms, dtype=str),
+            doc_ids=np.array(self.doc_ids, dtype=str),
+            params=np.array([self.k1, self.b]),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Read an index written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["params"].tolist()
+            index = cls(k1=k1, b=b)
+            index._offsets = data["offsets"]
+            index._doc_numbers = data["doc_numbers"]
+            index._term_freqs = data["term_freqs"]
+            index.doc_lengths = array("i", data["doc_lengths"].tobytes())
+            index.vocab = {term: i for i, term in enumerate(data["terms"].tolist())}
+            index.doc_ids = data["doc_ids"].tolist()
+        index._doc_numbers_by_id = {doc_id: i for i, doc_id in enumerate(index.doc_ids)}
+        index._total_length = int(sum(index.doc_lengths))
+        return index
+
+    @classmethod
+    def concatenate(cls, parts: List[Tuple["BM25Index", set]]) -> "BM25Index":
+        """Combine the indexes of several KB segments, each with chunk IDs to leave out.
+
+        Parts are consumed. A chunk ID that occurs in several parts keeps
+        its copy from the last one, as ``add`` would.
+        """
+        if len(parts) == 1 and not parts[0][1]:
+            return parts[0][0]
+        index = cls(parts[0][0].k1, parts[0][0].b) if parts else cls()
+        terms, numbers, freqs = [], [], []
+        for part, deleted in parts:
+            part.remove(deleted)
+            if part._pending or part._deleted:
+                part.compact()
+            part_terms = sorted(part.vocab, key=part.vocab.get)
+            remap = np.array([index.vocab.setdefault(term, len(index.vocab)) for term in part_terms], dtype=np.int64)
+            terms.append(np.repeat(remap, np.diff(part._offsets)))
+            numbers.append(part._doc_numbers.astype(np.int64) + len(index.doc_ids))
+            freqs.append(part._term_freqs)
+            index.doc_ids.extend(part.doc_ids)
+            index.doc_lengths.extend(part.doc_lengths)
+        if terms:
+            terms, numbers, freqs = np.concatenate(terms), np.concatenate(numbers), np.concatenate(freqs)
+            order = np.argsort(terms, kind="stable")
+            index._offsets = np.concatenate(
+                [[0], np.cumsum(np.bincount(terms, minlength=len(index.vocab)))]
+            ).astype(np.int64)
+            index._doc_numbers = numbers[order].astype(np.int32)
+            index._term_freqs = freqs[order].astype(np.int32)
+        index._total_length = int(sum(index.doc_lengths))
+        for doc_number, doc_id in enumerate(index.doc_ids):
+            earlier = index._doc_numbers_by_id.get(doc_id)
+            if earlier is not None:
+                index._deleted.add(earlier)
+                index._total_length -= index.doc_lengths[earlier]
+            index._doc_numbers_by_id[doc_id] = doc_number
+        return index
+
+
+@lru_cache(maxsize=1 << 18)
+def _token_hash(token: str) -> int:
+    """Stable 64-bit hash of a token (``hash()`` is salted per process)."""
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def simhash(tokens: List[str]) -> int:
+    """64-bit SimHash of a token sequence, using word bigrams as features."""
+    if not tokens:
+        return 0
+    hashes = np.fromiter(map(_token_hash, tokens), dtype=np.uint64, count=len(tokens))
+    if len(hashes) > 1:
+        hashes = hashes[:-1] * np.uint64(0x9E3779B97F4A7C15) + hashes[1:]
+    # splitmix64 finalizer, so every bit of a bigram hash depends on both words
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94D049BB133111EB)
+    hashes ^= hashes >> np.uint64(31)
+    ones = np.unpackbits(hashes.view(np.uint8)).reshape(len(hashes), 64).sum(axis=0)
+    majority = np.packbits(2 * ones > len(hashes))
+    return int.from_bytes(majority.tobytes(), "big")
+
+
+def chunk_location(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """The source and, where known, page of a chunk."""
+    return {key: metadata[key] for key in ("source", "page") if key in metadata}
+
+
+class ChunkDeduplicator:
+    """Finds chunks that repeat an already indexed chunk, before they are embedded.
+
+    Exact repeats are matched on a hash of the chunk's lower-cased word
+    tokens, so whitespace and punctuation changes do not matter. Near
+    repeats (headers, footers and disclaimers with a different date or page
+    number) are matched by SimHash: fingerprints within ``max_distance``
+    bits match. Each fingerprint is cut into ``max_distance + 1`` bands and
+    filed under every band value; two fingerprints that close must agree on
+    at least one whole band, so only chunks sharing a bucket are compared.
+    Chunks shorter than ``min_tokens`` only match exactly, and
+    ``max_distance=0`` disables near matching.
+    """
+
+    def __init__(self, max_distance: int = 3, min_tokens: int = 8):
+        self.max_distance = max(0, max_distance)
+        self.min_tokens = min_tokens
+        bands = self.max_distance + 1
+        bounds = [64 * i // bands for i in range(bands + 1)]
+        self._bands = [
+            (start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])
+        ]
+        self._exact: Dict[bytes, str] = {}
+        self._buckets: Dict[Tuple[int, int], List[str]] = {}
+        # chunk ID -> (exact key, SimHash or None)
+        self._fingerprints: Dict[str, Tuple[bytes, Optional[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def _bucket_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        return [(start, (fingerprint >> start) & mask) for start, mask in self._bands]
+
+    def find_or_add(self, chunk_id: str, text: str) -> Optional[str]:
+        """Return the ID of the chunk ``text`` repeats, or register it under ``chunk_id``."""
+        tokens = BM25Index.tokenize(text)
+        key = hashlib.blake2b(" ".join(tokens).encode("utf-8"), digest_size=16).digest()
+        match = self._exact.get(key)
+        if match is not None:
+            return match
+
+        fingerprint = None
+        if self.max_distance and len(tokens) >= self.min_tokens:
+            fingerprint = simhash(tokens)
+            for bucket in self._bucket_keys(fingerprint):
+                for candidate in self._buckets.get(bucket, ()):
+                    other = self._fingerprints[candidate][1]
+                    if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                        return candidate
+
+        self._exact[key] = chunk_id
+        self._fingerprints[chunk_id] = (key, fingerprint)
+        if fingerprint is not None:
+            for bucket in self._bucket_keys(fingerprint):
+                self._buckets.setdefault(bucket, []).append(chunk_id)
+        return None
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        """Forget chunks, e.g. because their document was deleted."""
+        for chunk_id in chunk_ids:
+            entry = self._fingerprints.pop(chunk_id, None)
+            if entry is None:
+                continue
+            key, fingerprint = entry
+            if self._exact.get(key) == chunk_id:
+                del self._exact[key]
+            if fingerprint is not None:
+                for bucket in self._bucket_keys(fingerprint):
+                    members = self._buckets[bucket]
+                    members.remove(chunk_id)
+                    if not members:
+                        del self._buckets[bucket]
+
+
+@lru_cache(maxsize=None)
+def _hybrid_retriever_class() -> type:
+    """Define HybridRetriever on first use; it subclasses LangChain's BaseRetriever."""
+    from langchain_core.retrievers import BaseRetriever
+
+    class HybridRetriever(BaseRetriever):
+        """Retriever fusing FAISS and BM25 results with reciprocal-rank fusion.
+
+        Each result list contributes ``weight / (rrf_k + rank)`` per chunk; the
+        two searches run in parallel.
+        """
+
+        vector_store: Any
+        bm25: Any
+        k: int = 3
+        fetch_k: int = 20
+        dense_weight: float = 1.0
+        lexical_weight: float = 1.0
+        rrf_k: int = 60
+
+        def _dense_search(self, query: str) -> List[str]:
+            vector = np.array([self.vector_store.embedding_function.embed_query(query)], dtype=np.float32)
+            _, positions = self.vector_store.index.search(vector, self.fetch_k)
+            mapping = self.vector_store.index_to_docstore_id
+            return [mapping[p] for p in positions[0] if p != -1 and p in mapping]
+
+        def _get_relevant_documents(self, query: str, *, run_manager: Any = None) -> List["Document"]:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                lexical = executor.submit(self.bm25.search, query, self.fetch_k)
+                dense_ids = self._dense_search(query)
+                lexical_ids = [doc_id for doc_id, _ in lexical.result()]
+            return self.fuse(dense_ids, lexical_ids)
+
+        def fuse(self, dense_ids: List[str], lexical_ids: List[str]) -> List["Document"]:
+            """Return the top ``k`` chunks of two ranked ID lists by reciprocal-rank fusion."""
+            from langchain_core.documents import Document
+
+            scores: Dict[str, float] = {}
+            for weight, ranked in ((self.dense_weight, dense_ids), (self.lexical_weight, lexical_ids)):
+                for rank, doc_id in enumerate(ranked, start=1):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight / (self.rrf_k + rank)
+
+            docs = []
+            for doc_id in sorted(scores, key=scores.get, reverse=True)[: self.k]:
+                doc = self.vector_store.docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    docs.append(doc)
+            return docs
+
+    return HybridRetriever
+
+
+def _is_transient_error(error: BaseException) -> bool:
+    """Return True for embedding errors worth retrying (connection drops, timeouts, 429/5xx)."""
+    import httpx
+
+    if isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return isinstance(status_code, int) and (status_code == 429 or status_code >= 500)
+
+
+class EmbeddingCache:
+    """Persistent SQLite cache of embeddings keyed by (embed model, chunk text hash).
+
+    Vectors are stored as float32 blobs. When the cache grows past
+    ``max_entries`` the least recently used rows are evicted.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 500_000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """Return the content hash used as the cache key for a chunk."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Look up embeddings for texts; missing entries are returned as None."""
+        hashes = [self.hash_text(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found],
+                )
+                self._conn.commit()
+
+            results = []
+            for text_hash in hashes:
+                blob = found.get(text_hash)
+                if blob is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(np.frombuffer(blob, dtype=np.float32).tolist())
+            return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """Store embeddings for texts, evicting least recently used rows if over the cap."""
+        now = time.time()
+        rows = [
+            (model, self.hash_text(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    "SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the current number of cached entries."""
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self) -> None:
+        """Remove all cached embeddings and reset the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+
+def build_bm25_index(vector_store: "FAISS") -> BM25Index:
+    """Build the lexical index from the chunks of a vector store."""
+    from langchain_core.documents import Document
+
+    bm25 = BM25Index()
+    for _, docstore_id in sorted(vector_store.index_to_docstore_id.items()):
+        doc = vector_store.docstore.search(docstore_id)
+        if isinstance(doc, Document):
+            bm25.add(docstore_id, doc.page_content)
+    logger.info(f"Built lexical index over {len(bm25)} chunks")
+    return bm25
+
+
+def knowledge_base_version(kb_path: str, manifest: Optional[Dict[str, Any]] = None) -> str:
+    """Identify the content of a KB on disk; it changes whenever the KB is saved again.
+
+    Compaction rewrites segments without changing what the KB holds, so it
+    keeps the version.
+    """
+    if manifest is None:
+        manifest = read_manifest(kb_path)
+    if "generation" in manifest:
+        return f"{Path(kb_path).resolve()}:{manifest['generation']}"
+    stat = os.stat(os.path.join(kb_path, INDEX_FILE))
+    return f"{Path(kb_path).resolve()}:{stat.st_mtime_ns}:{stat.st_ino}"
+
+
+class LoadedKnowledgeBase:
+    """A knowledge base read from disk: vector store, lexical index and manifest."""
+
+    def __init__(
+        self,
+        path: str,
+        vector_store: "FAISS",
+        bm25: BM25Index,
+        manifest: Dict[str, Any],
+        version: str,
+    ):
+        self.path = path
+        self.vector_store = vector_store
+        self.bm25 = bm25
+        self.manifest = manifest
+        self.version = version
+        # Estimated memory cost; chunk texts stay on disk and are not counted
+        self.size_bytes = (
+            sum(
+                os.path.getsize(os.path.join(path, SEGMENTS_DIR, entry["name"], INDEX_FILE))
+                for entry in manifest.get("segments", [])
+            )
+            + bm25.memory_usage()
+            + 100 * len(vector_store.index_to_docstore_id)
+        )
+
+
+def open_knowledge_base(kb_path: str, embeddings: Any, mmap: bool = True) -> LoadedKnowledgeBase:
+    """Read a knowledge base directory, migrating older formats first.
+
+    The returned manifest holds the merged "documents" entries of all segments.
+    """
+    migrate_knowledge_base(kb_path, embeddings)
+    with knowledge_base_lock(kb_path):
+        manifest = read_manifest(kb_path)
+        # Reloading an unchanged KB keeps the same version, so cached answers stay valid
+        version = knowledge_base_version(kb_path, manifest)
+        vector_store = read_vector_store(kb_path, embeddings, mmap=mmap, manifest=manifest)
+        apply_search_params(vector_store.index, manifest.get("search_params", {}))
+        bm25 = read_bm25_index(kb_path, manifest)
+        manifest["documents"] = read_documents(kb_path, manifest)
+    return LoadedKnowledgeBase(kb_path, vector_store, bm25, manifest, version)
+
+
+class Telemetry:
+    """Timing spans and counters from the ingestion and query pipelines.
+
+    Stages are timed with ``span(stage, **attributes)`` or reported with
+    ``record``; counters (chunks, tokens, ...) with ``increment``. Every
+    finished span is passed to the registered hooks as a dict with
+    "stage", "start" (epoch seconds), "duration_ms" and "attributes", so
+    spans can be forwarded to a tracing backend (see
+    ``opentelemetry_hook``). Percentiles are computed over the last
+    ``window`` spans of each stage; counts and totals cover the whole run.
+    """
+
+    def __init__(self, window: int = 2048):
+        self.window = window
+        self._lock = threading.Lock()
+        self._hooks: List[Callable[[Dict[str, Any]], None]] = []
+        self._durations: Dict[str, deque] = {}
+        self._totals: Dict[str, List[float]] = {}  # stage -> [count, total ms]
+        self._counters: Dict[str, float] = {}
+        self.started = time.time()
+
+    def add_hook(self, hook: Callable[[Dict[str, Any]], None]) -> None:
+        """Call ``hook(span)`` for every finished span."""
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[Dict[str, Any]], None]) -> None:
+        with self._lock:
+            self._hooks.remove(hook)
+
+    @contextmanager
+    def span(self, stage: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        """Time the enclosed block; the yielded dict can take more attributes."""
+        start_time = time.time()
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000, start=start_time, **attributes)
+
+    def record(self, stage: str, duration_ms: float, start: Optional[float] = None, **attributes: Any) -> None:
+        """Add a finished span."""
+        with self._lock:
+            if stage not in self._durations:
+                self._durations[stage] = deque(maxlen=self.window)
+                self._totals[stage] = [0, 0.0]
+            self._durations[stage].append(duration_ms)
+            totals = self._totals[stage]
+            totals[0] += 1
+            totals[1] += duration_ms
+            hooks = list(self._hooks)
+        if not hooks:
+            return
+        span = {
+            "stage": stage,
+            "start": start if start is not None else time.time() - duration_ms / 1000,
+            "duration_ms": duration_ms,
+            "attributes": attributes,
+        }
+        for hook in hooks:
+            try:
+                hook(span)
+            except Exception as e:
+                logger.warning(f"Telemetry hook failed: {str(e)}")
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add to a counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return per-stage count, total, mean, p50, p95 and max (ms) plus counters."""
+        with self._lock:
+            durations = {stage: np.array(values) for stage, values in self._durations.items()}
+            totals = {stage: list(values) for stage, values in self._totals.items()}
+            counters = dict(self._counters)
+        stages = {}
+        for stage, values in durations.items():
+            count, total = totals[stage]
+            p50, p95 = np.percentile(values, [50, 95]) if len(values) else (0.0, 0.0)
+            stages[stage] = {
+                "count": int(count),
+                "total_ms": total,
+                "mean_ms": total / count if count else 0.0,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "max_ms": float(values.max()) if len(values) else 0.0,
+            }
+        return {"uptime_s": time.time() - self.started, "stages": stages, "counters": counters}
+
+    def to_prometheus(self, prefix: str = "docubuddy") -> str:
+        """Render the snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        name = f"{prefix}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Duration of RAG pipeline stages (quantiles over recent spans).",
+            f"# TYPE {name} summary",
+        ]
+        for stage, row in sorted(snapshot["stages"].items()):
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms")):
+                lines.append(f'{name}{{stage="{stage}",quantile="{quantile}"}} {row[key] / 1000:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {row["total_ms"] / 1000:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {row["count"]}')
+        for counter, value in sorted(snapshot["counters"].items()):
+            metric = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', counter)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value:g}")
+        lines.append(f"# TYPE {prefix}_uptime_seconds gauge")
+        lines.append(f"{prefix}_uptime_seconds {snapshot['uptime_s']:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Forget all spans and counters; hooks stay registered."""
+        with self._lock:
+            self._durations.clear()
+            self._totals.clear()
+            self._counters.clear()
+            self.started = time.time()
+
+
+def opentelemetry_hook(tracer: Any = None) -> Callable[[Dict[str, Any]], None]:
+    """Return a Telemetry hook that re-emits spans through OpenTelemetry.
+
+    Needs the ``opentelemetry-api`` package; spans go to whatever tracer
+    provider the application configured.
+    """
+    from opentelemetry import trace
+
+    tracer = tracer or trace.get_tracer("docubuddy")
+
+    def hook(span: Dict[str, Any]) -> None:
+        start_ns = int(span["start"] * 1e9)
+        attributes = {
+            key: value
+            for key, value in span["attributes"].items()
+            if isinstance(value, (str, bool, int, float))
+        }
+        otel_span = tracer.start_span(
+            f"docubuddy.{span['stage']}", start_time=start_ns, attributes=attributes
+        )
+        otel_span.end(end_time=start_ns + int(span["duration_ms"] * 1e6))
+
+    return hook
+
+
+def start_metrics_server(telemetry: Telemetry, port: int, host: str = "127.0.0.1") -> Any:
+    """Serve ``/metrics`` (Prometheus text) and ``/metrics.json`` from a daemon thread.
+
+    Returns the HTTP server; call ``shutdown()`` on it to stop serving.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body = telemetry.to_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/metrics.json":
+                body = json.dumps(telemetry.snapshot()).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logger.debug(f"Metrics request: {format % args}")
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="docubuddy-metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def _ollama_embeddings(embed_model: str, base_url: Optional[str] = None) -> Any:
+    """Create an Ollama embeddings client."""
+    from langchain_ollama import OllamaEmbeddings
+
+    return OllamaEmbeddings(model=embed_model, base_url=base_url)
+
+
+def _ollama_chat_model(
+    model_name: str, temperature: float, base_url: Optional[str], callbacks: List[Any]
+) -> Any:
+    """Create an Ollama chat model client."""
+    from langchain.callbacks.manager import CallbackManager
+    from langchain_ollama import ChatOllama
+
+    return ChatOllama(
+        model=model_name,
+        base_url=base_url,
+        callback_manager=CallbackManager(callbacks),
+        temperature=temperature,
+    )
+
+
+def _stdout_callbacks() -> List[Any]:
+    """Callback handlers echoing LLM tokens to the console."""
+    from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+
+    return [StreamingStdOutCallbackHandler()]
+
+
+class SegmentCompactor:
+    """Compacts knowledge bases in a background thread once saves leave them fragmented.
+
+    ``schedule(kb_path)`` queues a KB if it has more than ``max_segments``
+    segments or more tombstones than ``max_deleted_ratio`` of its rows;
+    the worker thread runs ``compact_knowledge_base`` until the KB needs no
+    more compaction, then exits once the queue is empty.
+    """
+
+    def __init__(
+        self, max_segments: int = 8, max_deleted_ratio: float = 0.3, telemetry: Optional["Telemetry"] = None
+    ):
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self.telemetry = telemetry or Telemetry()
+        self._lock = threading.Lock()
+        self._queue: "OrderedDict[str, None]" = OrderedDict()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread: Optional[threading.Thread] = None
+
+    def needs_compaction(self, manifest: Dict[str, Any]) -> bool:
+        segments = manifest.get("segments", [])
+        tombstones = len(manifest.get("deleted_chunks", {}))
+        rows = sum(entry["rows"] for entry in segments)
+        return len(segments) > self.max_segments or tombstones > self.max_deleted_ratio * max(rows, 1)
+
+    def schedule(self, kb_path: str) -> bool:
+        """Queue a KB for compaction if it needs it; returns True if queued."""
+        try:
+            if not self.needs_compaction(read_manifest(kb_path)):
+                return False
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            self._queue[str(Path(kb_path).resolve())] = None
+            self._idle.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="segment-compactor", daemon=True)
+                self._thread.start()
+        return True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued KB is compacted; returns False on timeout."""
+        return self._idle.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._thread = None
+                    self._idle.set()
+                    return
+                kb_path, _ = self._queue.popitem(last=False)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    compacted = compact_knowledge_base(kb_path, self.max_segments, self.max_deleted_ratio)
+                    if not compacted:
+                        break
+                    self.telemetry.record("compact", 1000 * (time.perf_counter() - start), segments=compacted)
+                    self.telemetry.increment("segments_compacted", compacted)
+            except Exception as e:
+                logger.error(f"Error compacting knowledge base {kb_path}: {str(e)}")
+
+
+class SharedResources:
+    """Process-wide resources shared by the per-session RAGSystem instances.
+
+    Holds the Ollama clients, the embedding and answer caches, the segment
+    compactor and loaded knowledge bases. Knowledge bases are reference
+    counted: sessions
+    acquire them for querying and release them when they switch away or
+    need a private, writable copy. Released knowledge bases stay cached, so
+    switching back to one is a dictionary lookup, until the cache exceeds
+    its memory budget; then the least recently used unreferenced ones are
+    unloaded. A knowledge base saved again on disk is reloaded on its next
+    acquire.
+    """
+
+    def __init__(
+        self,
+        embeddings_factory: Optional[Any] = None,
+        llm_factory: Optional[Any] = None,
+        kb_cache_bytes: int = 2 << 30,
+        max_segments: int = 8,
+    ):
+        """``embeddings_factory(embed_model, base_url)`` and
+        ``llm_factory(model_name, temperature, base_url, callbacks)`` replace
+        the Ollama clients, e.g. with fakes for benchmarks. ``kb_cache_bytes``
+        is the memory budget for loaded knowledge bases; saved knowledge
+        bases with more than ``max_segments`` segments are compacted in the
+        background."""
+        self._embeddings_factory = embeddings_factory or _ollama_embeddings
+        self._llm_factory = llm_factory or _ollama_chat_model
+        self._lock = threading.RLock()
+        self._embeddings: Dict[Tuple, Any] = {}
+        self._llms: Dict[Tuple, Any] = {}
+        self._embedding_caches: Dict[str, EmbeddingCache] = {}
+        self._answer_caches: Dict[Tuple, AnswerCache] = {}
+        self.kb_cache_bytes = kb_cache_bytes
+        # Resolved path -> [LoadedKnowledgeBase, reference count], least recently used first
+        self._knowledge_bases: "OrderedDict[str, List[Any]]" = OrderedDict()
+        # Resolved path -> lock held while that knowledge base is being loaded
+        self._kb_loading: Dict[str, threading.Lock] = {}
+        self.kb_cache_hits = 0
+        self.kb_cache_misses = 0
+        self.telemetry = Telemetry()
+        self.compactor = SegmentCompactor(max_segments=max_segments, telemetry=self.telemetry)
+        self.metrics_server = None
+        self._metrics_port: Optional[int] = None
+
+    def serve_metrics(self, port: int, host: str = "127.0.0.1") -> None:
+        """Serve this process's telemetry over HTTP; only the first call starts a server."""
+        with self._lock:
+            if self._metrics_port is not None:
+                return
+            self._metrics_port = port
+            try:
+                self.metrics_server = start_metrics_server(self.telemetry, port, host)
+            except OSError as e:
+                logger.error(f"Could not serve metrics on {host}:{port}: {str(e)}")
+
+    def get_embeddings(self, embed_model: str, base_url: Optional[str] = None) -> Any:
+        """Return the shared embeddings client for a model."""
+        key = (embed_model, base_url)
+        with self._lock:
+            if key not in self._embeddings:
+                self._embeddings[key] = self._embeddings_factory(embed_model, base_url)
+            return self._embeddings[key]
+
+    def get_llm(
+        self,
+        model_name: str,
+        temperature: float,
+        base_url: Optional[str] = None,
+        stream_to_stdout: bool = False,
+    ) -> Any:
+        """Return the shared chat model client for a model and temperature."""
+        key = (model_name, temperature, base_url, stream_to_stdout)
+        with self._lock:
+            if key not in self._llms:
+                callbacks = _stdout_callbacks() if stream_to_stdout else []
+                self._llms[key] = self._llm_factory(model_name, temperature, base_url, callbacks)
+            return self._llms[key]
+
+    def get_embedding_cache(self, db_path: str, max_entries: int) -> EmbeddingCache:
+        """Return the shared embedding cache stored at db_path."""
+        key = str(Path(db_path).resolve())
+        with self._lock:
+            if key not in self._embedding_caches:
+                self._embedding_caches[key] = EmbeddingCache(db_path, max_entries=max_entries)
+            return self._embedding_caches[key]
+
+    def get_answer_cache(
+        self, max_entries: int, ttl_seconds: float, similarity_threshold: Optional[float]
+    ) -> AnswerCache:
+        """Return the answer cache shared by sessions with the same settings."""
+        key = (max_entries, ttl_seconds, similarity_threshold)
+        with self._lock:
+            if key not in self._answer_caches:
+                self._answer_caches[key] = AnswerCache(
+                    max_entries=max_entries,
+                    ttl_seconds=ttl_seconds,
+                    similarity_threshold=similarity_threshold,
+                )
+            return self._answer_caches[key]
+
+    def acquire_knowledge_base(self, kb_path: str, embeddings: Any) -> LoadedKnowledgeBase:
+        """Return the shared, read-only copy of a knowledge base, loading it if needed.
+
+        Loading happens outside the lock guarding the other shared
+        resources, so sessions using them are not held up; concurrent
+        acquires of the same knowledge base wait for one load.
+        """
+        key = str(Path(kb_path).resolve())
+        with self._lock:
+            loading = self._kb_loading.setdefault(key, threading.Lock())
+        with loading:
+            version = knowledge_base_version(kb_path)
+            with self._lock:
+                entry = self._knowledge_bases.get(key)
+                if entry is not None and entry[0].version == version:
+                    self.kb_cache_hits += 1
+                    return self._reference_knowledge_base(key, entry)
+                self.kb_cache_misses += 1
+
+            kb = open_knowledge_base(kb_path, embeddings)
+            if knowledge_base_version(kb_path) != kb.version:
+                # Saved again while loading; the next acquire loads the new version
+                return kb
+            with self._lock:
+                # Sessions holding a copy rebuilt on disk keep it until they reload
+                entry = [kb, 0]
+                self._knowledge_bases[key] = entry
+                return self._reference_knowledge_base(key, entry)
+
+    def _reference_knowledge_base(self, key: str, entry: List[Any]) -> LoadedKnowledgeBase:
+        self._knowledge_bases.move_to_end(key)
+        entry[1] += 1
+        self._evict_knowledge_bases()
+        return entry[0]
+
+    def release_knowledge_base(self, kb: LoadedKnowledgeBase) -> None:
+        """Drop one reference; the knowledge base stays cached while the budget allows."""
+        key = str(Path(kb.path).resolve())
+        with self._lock:
+            entry = self._knowledge_bases.get(key)
+            if entry is None or entry[0] is not kb:
+                return
+            entry[1] = max(0, entry[1] - 1)
+            self._evict_knowledge_bases()
+
+    def is_current(self, kb: LoadedKnowledgeBase) -> bool:
+        """Return False if the knowledge base was saved again or deleted since it was loaded."""
+        try:
+            return knowledge_base_version(kb.path) == kb.version
+        except FileNotFoundError:
+            return False
+
+    def _evict_knowledge_bases(self) -> None:
+        """Unload least recently used, unreferenced knowledge bases until within budget."""
+        total = sum(entry[0].size_bytes for entry in self._knowledge_bases.values())
+        for key in list(self._knowledge_bases):
+            if total <= self.kb_cache_bytes:
+                break
+            kb, references = self._knowledge_bases[key]
+            if references == 0:
+                del self._knowledge_bases[key]
+                total -= kb.size_bytes
+                logger.info(f"Unloaded knowledge base {key} from the cache")
+
+    def invalidate_knowledge_base(self, kb_path: str) -> None:
+        """Forget a knowledge base that was rewritten on disk.
+
+        Sessions still holding the old copy keep using it; the next acquire
+        loads the new version.
+        """
+        with self._lock:
+            self._knowledge_bases.pop(str(Path(kb_path).resolve()), None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the loaded knowledge bases, their reference counts and cache usage."""
+        with self._lock:
+            return {
+                "knowledge_bases": {key: entry[1] for key, entry in self._knowledge_bases.items()},
+                "kb_cache_bytes": sum(
+                    entry[0].size_bytes for entry in self._knowledge_bases.values()
+                ),
+                "kb_cache_budget": self.kb_cache_bytes,
+                "kb_cache_hits": self.kb_cache_hits,
+                "kb_cache_misses": self.kb_cache_misses,
+                "llm_clients": len(self._llms),
+                "embedding_clients": len(self._embeddings),
+            }
+
+
+class IngestCancelled(Exception):
+    """Raised from an ingestion progress callback to stop the ingestion."""
+
+
+class RAGSystem:
+    def __init__(
+        self,
+        model_name: str = "llama3.2",
+        embed_model: str = "nomic-embed-text",
+        ingest_workers: int = 1,
+        ingest_queue_size: Optional[int] = None,
+        embed_batch_size: int = 64,
+        embed_max_inflight: int = 4,
+        embed_max_retries: int = 3,
+        base_url: Optional[str] = None,
+        embed_cache_path: Optional[str] = "embedding_cache/embeddings.sqlite",
+        embed_cache_max_entries: int = 500_000,
+        index_factory: str = "Flat",
+        index_train_size: int = 50_000,
+        search_params: Optional[Dict[str, Any]] = None,
+        stream_to_stdout: bool = False,
+        condense_mode: str = "auto",
+        answer_cache_size: int = 256,
+        answer_cache_ttl: float = 3600,
+        answer_cache_similarity: Optional[float] = None,
+        retrieval_mode: str = "hybrid",
+        retrieval_k: int = 3,
+        hybrid_weights: Tuple[float, float] = (1.0, 1.0),
+        rrf_k: int = 60,
+        resources: Optional[SharedResources] = None,
+        splitter_engine: str = "recursive",
+        chunk_encoding: Optional[str] = None,
+        dedup: str = "exact",
+        vector_backend: str = "faiss",
+        vector_dtype: str = "float32",
+        telemetry: Optional[Telemetry] = None,
+        checkpoint_every: int = 8,
+    ):
+        """Initialize the RAG system with specified models.
+
+        ``ingest_workers`` > 1 parses and splits documents in a process pool;
+        ``ingest_queue_size`` bounds how many files may be in flight at once
+        (defaults to twice the worker count). Chunks are embedded in batches
+        of ``embed_batch_size`` with at most ``embed_max_inflight`` batches
+        outstanding. ``base_url`` points the Ollama clients at another server.
+        Embeddings are cached on disk at ``embed_cache_path`` (None disables
+        the cache). ``index_factory`` selects the FAISS index type for new
+        knowledge bases; trained types (IVF, PQ) are trained on the first
+        ``index_train_size`` vectors. ``search_params`` (e.g. nprobe,
+        efSearch) are applied at query time. ``stream_to_stdout`` echoes LLM
+        tokens to the server console for debugging. ``condense_mode``
+        controls when follow-up questions are rewritten with an extra LLM call:
+        "always" (like ConversationalRetrievalChain), "never", or "auto" to
+        rewrite only questions that refer back to the conversation.
+        Standalone questions asked at temperature 0 are answered from a cache
+        of up to ``answer_cache_size`` entries that expire after
+        ``answer_cache_ttl`` seconds; ``answer_cache_similarity`` enables
+        matching paraphrased questions by embedding cosine similarity.
+        ``retrieval_mode`` is "dense" (FAISS only) or "hybrid" (FAISS + BM25
+        fused by reciprocal rank with ``hybrid_weights`` = (dense, lexical)
+        and constant ``rrf_k``); ``retrieval_k`` chunks are returned.
+        With ``resources``, model clients, caches and loaded knowledge bases
+        are shared with other sessions while chat memory stays per instance.
+        ``splitter_engine`` "fast" chunks with FastTextSplitter instead of
+        LangChain's recursive splitter; with ``chunk_encoding`` (a tiktoken
+        encoding name) chunk sizes count tokens rather than characters.
+        ``dedup`` drops chunks that repeat an indexed chunk before they are
+        embedded: "exact", "off" or "near", which also drops near-identical
+        chunks such as boilerplate but may merge ones that differ only in a
+        number or date.
+        The kept chunk lists the other locations in ``duplicate_sources``.
+        ``vector_backend`` "numpy" stores new knowledge bases in a NumpyIndex
+        (exact cosine search, vectors stored as ``vector_dtype``: "float32",
+        "float16" or "int8") instead of a FAISS index built by
+        ``index_factory``; loaded knowledge bases keep the index they were
+        saved with.
+        Stage timings and counters go to ``telemetry`` (by default the shared
+        resources' instance, or a private one).
+        While ingesting into a knowledge base that has a directory
+        (``kb_path``, set by loading or saving it), embedded chunks are
+        checkpointed to its write-ahead log every ``checkpoint_every``
+        batches (0 disables this), so a crash loses at most those batches.
+        """
+        self.model_name = model_name
+        self.embed_model = embed_model
+        self.ingest_workers = max(1, ingest_workers)
+        self.ingest_queue_size = max(1, ingest_queue_size or 2 * self.ingest_workers)
+        self.chunk_size = 1000
+        self.chunk_overlap = 200
+        self.splitter_engine = splitter_engine
+        self.chunk_encoding = chunk_encoding
+        self.dedup = dedup
+        # Fingerprints of the indexed chunks, built on the first ingestion
+        self._deduplicator: Optional[ChunkDeduplicator] = None
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.embed_max_inflight = max(1, embed_max_inflight)
+        self.embed_max_retries = max(1, embed_max_retries)
+        self.base_url = base_url
+        self.resources = resources
+        if telemetry is None:
+            telemetry = resources.telemetry if resources is not None else Telemetry()
+        self.telemetry = telemetry
+        if not embed_cache_path:
+            self.embedding_cache = None
+        elif resources is not None:
+            self.embedding_cache = resources.get_embedding_cache(
+                embed_cache_path, embed_cache_max_entries
+            )
+        else:
+            self.embedding_cache = EmbeddingCache(
+                embed_cache_path, max_entries=embed_cache_max_entries
+            )
+        self.last_ingest_stats: Dict[str, Any] = {}
+        self.last_batch_stats: Dict[str, Any] = {}
+        # Document name -> {"hash", "ids", "chunks"} for the loaded KB
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        self.index_factory = index_factory
+        self.vector_backend = vector_backend
+        self.vector_dtype = vector_dtype
+        self.index_train_size = max(1, index_train_size)
+        self.search_params: Dict[str, Any] = dict(search_params or {})
+        # Embedded batches held back until a trained index has enough samples
+        self._training_buffer: List[Tuple[List[Tuple[str, Any]], List[List[float]]]] = []
+        # Directory of the loaded or last saved KB, and its write-ahead log while ingesting
+        self.kb_path: Optional[str] = None
+        self.checkpoint_every = max(0, checkpoint_every)
+        self._ingest_log: Optional[IngestLog] = None
+        # Document manifest entries as of the last save or load, to find what changed,
+        # and the manifest generation they were read or saved at
+        self._saved_documents: Dict[str, Dict[str, Any]] = {}
+        self._kb_generation: Optional[str] = None
+        self.compactor = resources.compactor if resources is not None else SegmentCompactor(telemetry=telemetry)
+        # Knowledge base borrowed read-only from the shared resources
+        self._shared_kb: Optional[LoadedKnowledgeBase] = None
+        self.stream_to_stdout = stream_to_stdout
+        self.condense_mode = condense_mode
+        if answer_cache_size <= 0:
+            self.answer_cache = None
+        elif resources is not None:
+            self.answer_cache = resources.get_answer_cache(
+                answer_cache_size, answer_cache_ttl, answer_cache_similarity
+            )
+        else:
+            self.answer_cache = AnswerCache(
+                max_entries=answer_cache_size,
+                ttl_seconds=answer_cache_ttl,
+                similarity_threshold=answer_cache_similarity,
+            )
+        self.retrieval_mode = retrieval_mode
+        self.retrieval_k = retrieval_k
+        self.hybrid_weights = hybrid_weights
+        self.rrf_k = rrf_k
+        self.bm25 = BM25Index()
+        # Changes whenever the indexed content changes; part of the answer cache key
+        self.kb_version = uuid.uuid4().hex
+        self.vector_store = None
+        self.retriever = None
+        self.temperature = 0.0
+
+        # Chat memory, model clients and the text splitter are created on
+        # first use, so pages that never query or ingest stay cheap
+        self._memory = None
+        self._embeddings = None
+        self._llm = None
+        self._text_splitter = None
+
+    @property
+    def memory(self) -> Any:
+        """Conversation memory, created on first use."""
+        if self._memory is None:
+            from langchain_community.chat_message_histories import ChatMessageHistory
+            from langchain.memory import ConversationBufferMemory
+
+            self.chat_history = ChatMessageHistory()
+            self._memory = ConversationBufferMemory(
+                chat_memory=self.chat_history,
+                memory_key="chat_history",
+                output_key="answer",
+                return_messages=True,
+            )
+        return self._memory
+
+    @property
+    def embeddings(self) -> Any:
+        """Embeddings client, created on first use."""
+        if self._embeddings is None:
+            if self.resources is not None:
+                self._embeddings = self.resources.get_embeddings(self.embed_model, self.base_url)
+            else:
+                self._embeddings = _ollama_embeddings(self.embed_model, self.base_url)
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, embeddings: Any) -> None:
+        self._embeddings = embeddings
+
+    @property
+    def llm(self) -> Any:
+        """Chat model client for the current model and temperature, created on first use."""
+        if self._llm is None:
+            self._initialize_llm()
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm: Any) -> None:
+        self._llm = llm
+
+    @property
+    def text_splitter(self) -> "RecursiveCharacterTextSplitter":
+        """Text splitter for chunking documents, created on first use."""
+        if self._text_splitter is None:
+            self._text_splitter = _build_text_splitter(*self._splitter_args())
+        return self._text_splitter
+
+    @text_splitter.setter
+    def text_splitter(self, text_splitter: "RecursiveCharacterTextSplitter") -> None:
+        self._text_splitter = text_splitter
+
+    def _splitter_args(self) -> Tuple[Any, ...]:
+        """Arguments for _build_text_splitter matching the current chunking settings."""
+        return (self.chunk_size, self.chunk_overlap, self.splitter_engine, self.chunk_encoding)
+
+    def ingest_settings(self) -> Dict[str, Any]:
+        """Constructor arguments that reproduce this instance's ingestion behaviour."""
+        return {
+            "embed_model": self.embed_model,
+            "base_url": self.base_url,
+            "ingest_workers": self.ingest_workers,
+            "embed_batch_size": self.embed_batch_size,
+            "embed_max_inflight": self.embed_max_inflight,
+            "embed_cache_path": self.embedding_cache.db_path if self.embedding_cache else None,
+            "embed_cache_max_entries": (
+                self.embedding_cache.max_entries if self.embedding_cache else 500_000
+            ),
+            "index_factory": self.index_factory,
+            "splitter_engine": self.splitter_engine,
+            "chunk_encoding": self.chunk_encoding,
+            "dedup": self.dedup,
+            "vector_backend": self.vector_backend,
+            "vector_dtype": self.vector_dtype,
+            "checkpoint_every": self.checkpoint_every,
+        }
+
+    def _initialize_llm(self):
+        """Initialize or reinitialize the LLM with current settings."""
+        if self.resources is not None:
+            self._llm = self.resources.get_llm(
+                self.model_name, self.temperature, self.base_url, self.stream_to_stdout
+            )
+            return
+
+        callbacks = _stdout_callbacks() if self.stream_to_stdout else []
+        self._llm = _ollama_chat_model(self.model_name, self.temperature, self.base_url, callbacks)
+
+    def _initialize_retriever(self):
+        """Initialize or reinitialize the retriever over the vector store."""
+        if self.retrieval_mode == "hybrid":
+            dense_weight, lexical_weight = self.hybrid_weights
+            self.retriever = _hybrid_retriever_class()(
+                vector_store=self.vector_store,
+                bm25=self.bm25,
+                k=self.retrieval_k,
+                fetch_k=max(20, 4 * self.retrieval_k),
+                dense_weight=dense_weight,
+                lexical_weight=lexical_weight,
+                rrf_k=self.rrf_k,
+            )
+        else:
+            self.retriever = self.vector_store.as_retriever(
+                search_kwargs={"k": self.retrieval_k}
+            )
+
+    def update_model(self, model_name: str):
+        """Update the model and reinitialize components."""
+        self.model_name = model_name
+        self._llm = None
+        logger.info(f"Updated model to {model_name}")
+
+    def update_temperature(self, temperature: float):
+        """Update the temperature setting."""
+        self.temperature = temperature
+        self._llm = None
+        logger.info(f"Updated temperature to {temperature}")
+
+    def load_document(self, file_path: str) -> List[str]:
+        """Load and split a document into chunks."""
+        return load_and_split_document(file_path, self.text_splitter)
+
+    def _iter_document_chunks(self, file_paths: List[str]) -> Iterator[Tuple[str, Any]]:
+        """Yield (file_path, chunks or exception) for each file, in input order.
+
+        With a single worker the chunks are a lazy iterator, so pages are
+        parsed as the embedding stage asks for them. With more than one
+        ingest worker, files are parsed and split in a process pool. At most
+        ``ingest_queue_size`` files are in flight, so the consumer applies
+        backpressure instead of the pool racing ahead.
+        """
+        if self.ingest_workers <= 1 or len(file_paths) <= 1:
+            for file_path in file_paths:
+                splitter = _TimedSplitter(self.text_splitter)
+                chunks = iter_document_chunks(str(file_path), splitter)
+                yield file_path, self._traced_chunks(Path(file_path).name, chunks, splitter)
+            return
+
+        paths = iter(file_paths)
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.ingest_workers) as executor:
+
+            def submit_next() -> None:
+                file_path = next(paths, None)
+                if file_path is not None:
+                    future = executor.submit(
+                        _split_document_worker, str(file_path), self._splitter_args()
+                    )
+                    pending.append((file_path, future))
+
+            for _ in range(self.ingest_queue_size):
+                submit_next()
+
+            while pending:
+                file_path, future = pending.popleft()
+                try:
+                    result, load_ms, split_ms = future.result()
+                    self._record_parse(Path(file_path).name, load_ms, split_ms, len(result))
+                except Exception as e:
+                    result = e
+                submit_next()
+                yield file_path, result
+
+    def _traced_chunks(
+        self, name: str, chunks: Iterator[Any], splitter: _TimedSplitter
+    ) -> Iterator[Any]:
+        """Pass chunks through, recording load and split spans once the source is read."""
+        elapsed = 0.0
+        count = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            count += 1
+            yield chunk
+        split_ms = splitter.seconds * 1000
+        self._record_parse(name, elapsed * 1000 - split_ms, split_ms, count)
+
+    def _record_parse(self, name: str, load_ms: float, split_ms: float, chunks: int) -> None:
+        self.telemetry.record("load", load_ms, source=name, chunks=chunks)
+        self.telemetry.record("split", split_ms, source=name, chunks=chunks)
+
+    def _embed_texts(self, texts: List[str], cache: bool = True) -> List[List[float]]:
+        """Embed one batch of texts, serving cached vectors and retrying transient failures.
+
+        Pass ``cache=False`` for texts that are not document chunks, such as
+        questions, to keep them out of the chunk embedding cache.
+        """
+        if cache and self.embedding_cache is not None:
+            vectors = self.embedding_cache.get_many(self.embed_model, texts)
+        else:
+            vectors = [None] * len(texts)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self.telemetry.increment("embed_cache_hits", len(texts) - len(missing))
+        if missing:
+            from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_exponential
+
+            missing_texts = [texts[i] for i in missing]
+            retrying = Retrying(
+                stop=stop_after_attempt(self.embed_max_retries),
+                wait=wait_exponential(multiplier=0.5, max=8),
+                retry=retry_if_exception(_is_transient_error),
+                reraise=True,
+            )
+            with self.telemetry.span("embed", texts=len(missing_texts)):
+                embedded = retrying(self.embeddings.embed_documents, missing_texts)
+            self.telemetry.increment("embedded_texts", len(missing_texts))
+            if cache and self.embedding_cache is not None:
+                self.embedding_cache.put_many(self.embed_model, missing_texts, embedded)
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return vectors
+
+    def _add_embedded_batch(
+        self, batch: List[Tuple[str, Any]], vectors: List[List[float]]
+    ) -> None:
+        """Add an already-embedded batch of (chunk_id, chunk) pairs to the vector store."""
+        from langchain_community.vectorstores import FAISS
+
+        self._ensure_writable_index()
+        if self.vector_store is None and self.vector_backend == "numpy":
+            from langchain_community.docstore.in_memory import InMemoryDocstore
+
+            self.vector_store = FAISS(
+                embedding_function=self.embeddings,
+                index=NumpyIndex(len(vectors[0]), self.vector_dtype),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+            )
+        elif self.vector_store is None and self.index_factory != "Flat":
+            # Trained index types need a sample of vectors before anything
+            # can be added, so hold batches back until the sample is complete.
+            self._training_buffer.append((batch, vectors))
+            if sum(len(b) for b, _ in self._training_buffer) >= self.index_train_size:
+                self._build_trained_store()
+            return
+
+        ids = [chunk_id for chunk_id, _ in batch]
+        text_embeddings = [(doc.page_content, vector) for (_, doc), vector in zip(batch, vectors)]
+        metadatas = [doc.metadata for _, doc in batch]
+        if self.vector_store is None:
+            self.vector_store = FAISS.from_embeddings(
+                text_embeddings, self.embeddings, metadatas=metadatas, ids=ids
+            )
+        else:
+            self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+    def _build_trained_store(self) -> None:
+        """Create the vector store from buffered batches using ``index_factory``."""
+        buffered, self._training_buffer = self._training_buffer, []
+        if not buffered:
+            return
+
+        training_vectors = np.array(
+            [vector for _, vectors in buffered for vector in vectors], dtype=np.float32
+        )
+        try:
+            index = build_faiss_index(self.index_factory, training_vectors)
+        except RuntimeError as e:
+            # Typically too few training points for the requested number of
+            # clusters; an exact index is the safe choice for small corpora.
+            logger.warning(
+                f"Could not build {self.index_factory} index from "
+                f"{len(training_vectors)} vectors ({e}); falling back to Flat"
+            )
+            index = build_faiss_index("Flat", training_vectors)
+            self.index_factory = "Flat"
+        apply_search_params(index, self.search_params)
+
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+
+        self.vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+        )
+        for batch, vectors in buffered:
+            self._add_embedded_batch(batch, vectors)
+        logger.info(f"Built {self.index_factory} index from {len(training_vectors)} vectors")
+
+    def _embed_and_index(
+        self, chunks: Iterable[Tuple[str, Any]], log: Optional[IngestLog] = None
+    ) -> int:
+        """Embed a stream of (chunk_id, chunk) pairs in batches and index them as batches finish.
+
+        Up to ``embed_max_inflight`` batches are embedded concurrently; pulling
+        the next batch from ``chunks`` waits for the oldest one to be indexed,
+        so memory stays bounded regardless of corpus size. Batches are added in
+        submission order, keeping the index identical to a serial run.
+        Indexed batches are appended to ``log``, which is flushed every
+        ``checkpoint_every`` batches and when the stream ends or fails.
+        """
+        chunks = iter(chunks)
+        pending = deque()
+        indexed = 0
+        batches = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.embed_max_inflight) as executor:
+                while True:
+                    batch = list(islice(chunks, self.embed_batch_size))
+                    if batch:
+                        texts = [doc.page_content for _, doc in batch]
+                        pending.append((batch, executor.submit(self._embed_texts, texts)))
+                    if pending and (not batch or len(pending) >= self.embed_max_inflight):
+                        done_batch, future = pending.popleft()
+                        vectors = future.result()
+                        with self.telemetry.span("index_add", chunks=len(done_batch)):
+                            self._add_embedded_batch(done_batch, vectors)
+                            for chunk_id, doc in done_batch:
+                                self.bm25.add(chunk_id, doc.page_content)
+                        indexed += len(done_batch)
+                        if log is not None:
+                            log.append_chunks(self.embed_model, done_batch, vectors)
+                            batches += 1
+                            if batches % self.checkpoint_every == 0:
+                                self._checkpoint(log)
+                    if not batch and not pending:
+                        # Corpus smaller than the training sample: train on what we have
+                        self._build_trained_store()
+                        return indexed
+        finally:
+            if log is not None:
+                self._checkpoint(log)
 
-class RAGSystem:
-    def __init__(
-        self, model_name: str = "llama3.2", embed_model: str = "nomic-embed-text"
-    ):
-        """Initialize the RAG system with specified models."""
-        self.model_name = model_name
-        self.embed_model = embed_model
-        self.vector_store = None
-        self.conversation_chain = None
-        self.temperature = 0.0
+    def _checkpoint(self, log: IngestLog) -> None:
+        """Flush the write-ahead log; a failed flush is logged rather than failing ingestion."""
+        try:
+            with self.telemetry.span("checkpoint") as span:
+                span["bytes"] = log.flush()
+        except OSError as e:
+            logger.warning(f"Could not write ingestion checkpoint to {log.wal_dir}: {str(e)}")
 
-        # Initialize chat history and memory
-        self.chat_history = ChatMessageHistory()
-        self.memory = ConversationBufferMemory(
-            chat_memory=self.chat_history,
-            memory_key="chat_history",
-            output_key="answer",
-            return_messages=True,
-        )
+    def _get_ingest_log(self) -> Optional[IngestLog]:
+        """Return the write-ahead log of the KB directory being ingested into, if checkpointing."""
+        if not self.checkpoint_every or not self.kb_path:
+            return None
+        wal_dir = os.path.join(self.kb_path, WAL_DIR)
+        if self._ingest_log is None or self._ingest_log.wal_dir != wal_dir:
+            self._release_ingest_log()
+            log = IngestLog(wal_dir)
+            if log.in_use():
+                logger.warning(f"{wal_dir} is being written by another session; not checkpointing")
+                return None
+            self._ingest_log = log
+        return self._ingest_log
 
-        # Initialize embeddings
-        self.embeddings = OllamaEmbeddings(model=self.embed_model)
+    def _release_ingest_log(self) -> None:
+        if self._ingest_log is not None:
+            self._ingest_log.release()
+            self._ingest_log = None
 
-        # Initialize LLM
-        self._initialize_llm()
+    def _plan_ingestion(
+        self, sources: List[Tuple[Any, str, str]]
+    ) -> Tuple[List[Tuple[Any, str, str]], List[str], List[Any]]:
+        """Compare (source, document name, content hash) entries against the manifest.
 
-        # Initialize text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, length_function=len
-        )
+        Returns (entries to ingest, names of documents being replaced,
+        sources skipped as unchanged or duplicate content). An empty hash
+        marks a source that could not be read; it is left to the loader to
+        report the error.
+        """
+        to_ingest, replaced, skipped = [], [], []
+        known_hashes = {entry["hash"]: name for name, entry in self.manifest.items()}
+        for source, name, content_hash in sources:
+            if not content_hash:
+                to_ingest.append((source, name, content_hash))
+                continue
 
-    def _initialize_llm(self):
-        """Initialize or reinitialize the LLM with current settings."""
-        callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
-        self.llm = ChatOllama(
-            model=self.model_name,
-            callback_manager=callback_manager,
-            temperature=self.temperature,
-        )
+            if content_hash in known_hashes:
+                logger.info(
+                    f"Skipping {name}: same content as indexed document "
+                    f"'{known_hashes[content_hash]}'"
+                )
+                skipped.append(source)
+                continue
 
-        # Reinitialize conversation chain if it exists
-        if self.vector_store is not None:
-            self._initialize_conversation_chain()
-
-    def _initialize_conversation_chain(self):
-        """Initialize or reinitialize the conversation chain."""
-        self.conversation_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=self.vector_store.as_retriever(search_kwargs={"k": 3}),
-            memory=self.memory,
-            return_source_documents=True,
-            return_generated_question=False,
-        )
+            if name in self.manifest:
+                replaced.append(name)
+            known_hashes[content_hash] = name
+            to_ingest.append((source, name, content_hash))
+        return to_ingest, replaced, skipped
 
-    def update_model(self, model_name: str):
-        """Update the model and reinitialize components."""
-        self.model_name = model_name
-        self._initialize_llm()
-        logger.info(f"Updated model to {model_name}")
+    def process_documents(
+        self,
+        file_paths: List[str],
+        kb_name: str = None,
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        """Process multiple documents and create/update vector store.
 
-    def update_temperature(self, temperature: float):
-        """Update the temperature setting."""
-        self.temperature = temperature
-        self._initialize_llm()
-        logger.info(f"Updated temperature to {temperature}")
+        Files whose content is already indexed are skipped; a file whose name
+        matches an indexed document but whose content changed replaces that
+        document's vectors. ``progress`` is called with an event dict per
+        chunk read and per finished file (see ``_ingest``); raising
+        IngestCancelled from it stops the ingestion.
+        """
+        if not file_paths:
+            raise ValueError("No files provided for processing")
 
-    def load_document(self, file_path: str) -> List[str]:
-        """Load and split a document into chunks."""
         try:
-            # Verify file exists
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"File not found: {file_path}")
+            sources = []
+            for file_path in file_paths:
+                try:
+                    content_hash = file_content_hash(file_path)
+                except OSError:
+                    # Let the loader report missing or unreadable files
+                    content_hash = ""
+                sources.append((file_path, Path(file_path).name, content_hash))
 
-            # Select appropriate loader based on file extension
-            ext = Path(file_path).suffix.lower()
-            try:
-                if ext == ".pdf":
-                    loader = PyPDFLoader(file_path)
-                elif ext == ".txt":
-                    loader = TextLoader(file_path, encoding='utf-8')
-                elif ext == ".docx":
-                    loader = Docx2txtLoader(file_path)
-                else:
-                    loader = UnstructuredFileLoader(file_path)
-
-                # Load and split the document
-                documents = loader.load()
-                if not documents:
-                    raise ValueError(f"No content found in file: {file_path}")
-
-                chunks = self.text_splitter.split_documents(documents)
-                if not chunks:
-                    raise ValueError(f"Document was split but no chunks were created: {file_path}")
-
-                logger.info(f"Successfully loaded and split document: {file_path}")
-                return chunks
-
-            except UnicodeDecodeError:
-                # Try different encodings if UTF-8 fails
-                encodings = ['latin-1', 'cp1252', 'iso-8859-1']
-                for encoding in encodings:
-                    try:
-                        loader = TextLoader(file_path, encoding=encoding)
-                        documents = loader.load()
-                        if documents:
-                            chunks = self.text_splitter.split_documents(documents)
-                            logger.info(f"Successfully loaded document with {encoding} encoding: {file_path}")
-                            return chunks
-                    except UnicodeDecodeError:
-                        continue
-
-                raise ValueError(f"Could not decode file with any supported encoding: {file_path}")
+            to_ingest, replaced, skipped = self._plan_ingestion(sources)
+            ingest_paths = [file_path for file_path, _, _ in to_ingest]
+            self._ingest(
+                to_ingest, replaced, skipped, self._iter_document_chunks(ingest_paths), progress
+            )
 
         except Exception as e:
-            logger.error(f"Error loading document {file_path}: {str(e)}")
+            logger.error(f"Error in document processing: {str(e)}")
             raise
 
-    def process_documents(self, file_paths: List[str], kb_name: str = None) -> None:
-        """Process multiple documents and create/update vector store."""
-        if not file_paths:
+    def process_streams(
+        self,
+        uploads: List[Any],
+        kb_name: str = None,
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        """Process uploaded files without saving them to a shared directory first.
+
+        ``uploads`` are file-like objects with a ``name`` (such as Streamlit
+        uploads) or ``(name, stream)`` / ``(name, bytes)`` pairs. Each stream
+        is read once to hash it and once to chunk it, in blocks: PDFs page by
+        page and text files incrementally, while other formats are copied to a
+        unique temporary file for their loader. Chunks are embedded as they
+        are produced, so memory per upload stays bounded. ``progress`` works
+        as in ``process_documents``.
+        """
+        if not uploads:
             raise ValueError("No files provided for processing")
 
+        spooled = []
         try:
-            all_chunks = []
-            failed_files = []
+            sources = []
+            for upload in uploads:
+                name, stream = open_upload(upload)
+                content_hash, readable = scan_stream(stream)
+                if readable is not stream:
+                    spooled.append(readable)
+                sources.append(((name, readable), name, content_hash))
 
-            for file_path in file_paths:
+            to_ingest, replaced, skipped = self._plan_ingestion(sources)
+
+            def iter_results() -> Iterator[Tuple[Any, Iterator[Any]]]:
+                for source, _, _ in to_ingest:
+                    name, stream = source
+                    splitter = _TimedSplitter(self.text_splitter)
+                    chunks = iter_stream_chunks(name, stream, splitter)
+                    yield source, self._traced_chunks(name, chunks, splitter)
+
+            self._ingest(to_ingest, replaced, skipped, iter_results(), progress)
+
+        except Exception as e:
+            logger.error(f"Error in document processing: {str(e)}")
+            raise
+        finally:
+            for stream in spooled:
+                stream.close()
+
+    def _ingest(
+        self,
+        to_ingest: List[Tuple[Any, str, str]],
+        replaced: List[str],
+        skipped: List[Any],
+        results: Iterator[Tuple[Any, Any]],
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        """Embed and index planned sources and update the manifest.
+
+        ``results`` yields (source, chunks) in ``to_ingest`` order, where
+        chunks is a list, a lazy iterator or the exception raised while
+        loading the source. A source whose iterator fails part way is
+        counted as failed and its already indexed chunks are removed again.
+        Chunks the deduplicator matches are not embedded; the document's
+        manifest entry refers to the representative chunk instead.
+
+        ``progress`` receives {"name", "status", "chunks", "error"} events:
+        "reading" after each chunk read from a source, then "read" or
+        "failed" once the source is finished. IngestCancelled raised from it
+        propagates to the caller; the instance should then be discarded, as
+        chunks already embedded are not rolled back.
+        """
+        failed_files = []
+        cache_before = self.get_embedding_cache_stats()
+        if not to_ingest:
+            logger.info("All provided documents are already indexed")
+            self.last_ingest_stats = {"files": 0, "skipped_files": len(skipped), "chunks": 0}
+            return
+
+        file_info = {source: (name, content_hash) for source, name, content_hash in to_ingest}
+        new_entries: Dict[str, Dict[str, Any]] = {}
+        partial_ids: List[str] = []
+        deduplicator = self._get_deduplicator()
+        log = self._get_ingest_log()
+        # Representative chunk ID -> locations of the chunks that repeat it
+        duplicates: Dict[str, List[Dict[str, Any]]] = {}
+
+        def report(name: str, status: str, chunks: int = 0, error: Optional[str] = None) -> None:
+            if progress is not None:
+                progress({"name": name, "status": status, "chunks": chunks, "error": error})
+
+        def iter_chunks() -> Iterator[Tuple[str, Any]]:
+            # Sources stream off the loader pipeline into the embedding
+            # stage, so embedding overlaps with parsing of later files.
+            for source, result in results:
+                name, content_hash = file_info[source]
+                if isinstance(result, Exception):
+                    failed_files.append((name, str(result)))
+                    logger.error(f"Failed to process {name}: {str(result)}")
+                    report(name, "failed", error=str(result))
+                    continue
+
+                ids, indexed = [], []
+                found: Dict[str, List[Dict[str, Any]]] = {}
                 try:
-                    chunks = self.load_document(file_path)
-                    if chunks:
-                        all_chunks.extend(chunks)
-                        logger.info(f"Successfully processed: {file_path}")
-                    else:
-                        failed_files.append((file_path, "No content extracted"))
+                    for chunk in result:
+                        chunk_id = f"{content_hash[:16]}-{len(ids)}"
+                        duplicate_of = None
+                        if deduplicator is not None:
+                            duplicate_of = deduplicator.find_or_add(chunk_id, chunk.page_content)
+                        if duplicate_of is not None:
+                            ids.append(duplicate_of)
+                            found.setdefault(duplicate_of, []).append(chunk_location(chunk.metadata))
+                        else:
+                            ids.append(chunk_id)
+                            indexed.append(chunk_id)
+                            yield chunk_id, chunk
+                        report(name, "reading", len(ids))
+                except IngestCancelled:
+                    raise
                 except Exception as e:
-                    failed_files.append((file_path, str(e)))
-                    logger.error(f"Failed to process {file_path}: {str(e)}")
+                    failed_files.append((name, str(e)))
+                    logger.error(f"Failed to process {name}: {str(e)}")
+                    partial_ids.extend(indexed)
+                    if deduplicator is not None:
+                        deduplicator.remove(indexed)
+                    report(name, "failed", len(ids), str(e))
+                    continue
 
-            if not all_chunks:
-                raise ValueError("No valid content extracted from any of the provided files")
+                if ids:
+                    logger.info(f"Successfully processed: {name}")
+                    new_entries[name] = {
+                        "hash": content_hash,
+                        "ids": list(dict.fromkeys(ids)),
+                        "chunks": len(ids),
+                    }
+                    for chunk_id, locations in found.items():
+                        duplicates.setdefault(chunk_id, []).extend(locations)
+                    if log is not None:
+                        log.append_document(name, new_entries[name], found)
+                    report(name, "read", len(ids))
+                else:
+                    failed_files.append((name, "No content extracted"))
+                    report(name, "failed", error="No content extracted")
 
-            # Create or update vector store
-            if self.vector_store is None:
-                self.vector_store = FAISS.from_documents(
-                    documents=all_chunks, embedding=self.embeddings
-                )
-            else:
-                self.vector_store.add_documents(all_chunks)
+        chunk_count = self._embed_and_index(iter_chunks(), log) - len(partial_ids)
+        self._delete_vectors(partial_ids)
+        if not new_entries:
+            raise ValueError("No valid content extracted from any of the provided files")
+
+        self.kb_version = uuid.uuid4().hex
+        self._record_duplicate_sources(duplicates)
+
+        # Drop the previous vectors of documents that were re-uploaded,
+        # except chunks the new version or other documents still refer to
+        previous = {name: self.manifest[name]["ids"] for name in replaced if name in new_entries}
+        self.manifest.update(new_entries)
+        for ids in previous.values():
+            self._delete_vectors(self._unreferenced_ids(ids))
+
+        # Initialize retriever
+        self._initialize_retriever()
+
+        # Log results
+        success_count = len(to_ingest) - len(failed_files)
+        duplicate_count = sum(len(locations) for locations in duplicates.values())
+        if duplicate_count:
+            logger.info(
+                f"Skipped {duplicate_count} duplicate chunks "
+                f"({duplicate_count / (duplicate_count + chunk_count):.1%} of the chunks)"
+            )
+        cache_after = self.get_embedding_cache_stats()
+        self.last_ingest_stats = {
+            "files": success_count,
+            "failed_files": len(failed_files),
+            "skipped_files": len(skipped),
+            "replaced_files": len([name for name in replaced if name in new_entries]),
+            "chunks": chunk_count,
+            "duplicate_chunks": duplicate_count,
+            "cache_hits": cache_after.get("hits", 0) - cache_before.get("hits", 0),
+            "cache_misses": cache_after.get("misses", 0) - cache_before.get("misses", 0),
+        }
+        for counter, value in (
+            ("documents_ingested", success_count),
+            ("documents_failed", len(failed_files)),
+            ("chunks_indexed", chunk_count),
+            ("duplicate_chunks", duplicate_count),
+        ):
+            self.telemetry.increment(counter, value)
+        logger.info(
+            f"Successfully processed {success_count} out of {len(to_ingest)} documents"
+            f" ({len(skipped)} unchanged documents skipped)"
+        )
+
+        if failed_files:
+            error_msg = "\n".join([f"- {name}: {error}" for name, error in failed_files])
+            logger.warning(f"Failed to process the following files:\n{error_msg}")
+
+    def _get_deduplicator(self) -> Optional[ChunkDeduplicator]:
+        """Return the deduplicator for the loaded KB, fingerprinting its chunks on first use."""
+        if self.dedup == "off":
+            return None
+        if self._deduplicator is None:
+            deduplicator = ChunkDeduplicator(max_distance=3 if self.dedup == "near" else 0)
+            if self.vector_store is not None:
+                docstore = self.vector_store.docstore
+                for _, chunk_id in sorted(self.vector_store.index_to_docstore_id.items()):
+                    deduplicator.find_or_add(chunk_id, docstore.search(chunk_id).page_content)
+            self._deduplicator = deduplicator
+        return self._deduplicator
 
-            # Initialize conversation chain
-            self._initialize_conversation_chain()
+    def _record_duplicate_sources(self, duplicates: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Add the locations of dropped duplicates to their representatives' metadata."""
+        if not duplicates:
+            return
+        from langchain_core.documents import Document
 
-            # Log results
-            success_count = len(file_paths) - len(failed_files)
-            logger.info(f"Successfully processed {success_count} out of {len(file_paths)} documents")
-            
-            if failed_files:
-                error_msg = "\n".join([f"- {path}: {error}" for path, error in failed_files])
-                logger.warning(f"Failed to process the following files:\n{error_msg}")
+        self._ensure_writable_index()
+        docstore = self.vector_store.docstore
+        for chunk_id, locations in duplicates.items():
+            doc = docstore.search(chunk_id)
+            if not isinstance(doc, Document):
+                continue
+            metadata = dict(doc.metadata)
+            sources = list(metadata.get("duplicate_sources", []))
+            for location in locations:
+                if location not in sources and len(sources) < MAX_DUPLICATE_SOURCES:
+                    sources.append(location)
+            metadata["duplicate_sources"] = sources
+            metadata["duplicate_count"] = metadata.get("duplicate_count", 0) + len(locations)
+            docstore.delete([chunk_id])
+            docstore.add({chunk_id: Document(page_content=doc.page_content, metadata=metadata)})
+
+    def _unreferenced_ids(self, ids: List[str]) -> List[str]:
+        """Chunk IDs no document in the manifest refers to any more."""
+        referenced = {chunk_id for entry in self.manifest.values() for chunk_id in entry["ids"]}
+        return [chunk_id for chunk_id in ids if chunk_id not in referenced]
+
+    def _ensure_writable_index(self) -> None:
+        """Make the loaded KB safe to modify.
+
+        A KB shared with other sessions is replaced by a private copy read
+        from disk. Saved segments are never modified, so the copy can keep
+        them memory-mapped.
+        """
+        if self._shared_kb is None:
+            return
+        kb = open_knowledge_base(self._shared_kb.path, self.embeddings)
+        self.resources.release_knowledge_base(self._shared_kb)
+        self._shared_kb = None
+        self.vector_store = kb.vector_store
+        self.bm25 = kb.bm25
+        apply_search_params(self.vector_store.index, self.search_params)
+
+    def _delete_vectors(self, ids: List[str]) -> None:
+        """Remove vectors from the store, ignoring IDs it no longer holds."""
+        if self.vector_store is None or not ids:
+            return
+        present = set(self.vector_store.index_to_docstore_id.values())
+        ids = [chunk_id for chunk_id in ids if chunk_id in present]
+        if not ids:
+            return
+
+        self._ensure_writable_index()
+        self.bm25.remove(ids)
+        if self._deduplicator is not None:
+            self._deduplicator.remove(ids)
+
+        import faiss
+
+        if isinstance(self.vector_store.index, (faiss.IndexFlat, NumpyIndex, SegmentedIndex)):
+            self.vector_store.delete(ids)
+        else:
+            self._rebuild_without(set(ids))
+
+    def _rebuild_without(self, deleted_ids: set) -> None:
+        """Rebuild a non-flat index without the given chunk IDs.
+
+        IVF indexes do not renumber positions on removal and HNSW does not
+        support removal at all, so the remaining chunks are re-added to an
+        empty copy of the trained index. Their vectors come from the
+        embedding cache, so this does not normally call the embedding model.
+        """
+        import faiss
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+
+        old_store = self.vector_store
+        index = faiss.clone_index(old_store.index)
+        index.reset()
+        apply_search_params(index, self.search_params)
+        self.vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+        )
+        remaining = [
+            (chunk_id, old_store.docstore.search(chunk_id))
+            for _, chunk_id in sorted(old_store.index_to_docstore_id.items())
+            if chunk_id not in deleted_ids
+        ]
+        for start in range(0, len(remaining), self.embed_batch_size):
+            batch = remaining[start : start + self.embed_batch_size]
+            vectors = self._embed_texts([doc.page_content for _, doc in batch])
+            self._add_embedded_batch(batch, vectors)
+
+    def list_documents(self) -> Dict[str, Dict[str, Any]]:
+        """Return the manifest entries of the documents in the loaded knowledge base."""
+        return {name: dict(entry) for name, entry in self.manifest.items()}
+
+    def delete_document(self, name: str) -> bool:
+        """Remove a single document's vectors from the knowledge base."""
+        try:
+            entry = self.manifest.get(name)
+            if entry is None:
+                logger.warning(f"Document not found in knowledge base: {name}")
+                return False
+
+            del self.manifest[name]
+            self._delete_vectors(self._unreferenced_ids(entry["ids"]))
+            self.kb_version = uuid.uuid4().hex
+            if self.vector_store is not None:
+                self._initialize_retriever()
+            logger.info(f"Deleted document {name} ({len(entry['ids'])} chunks)")
+            return True
 
         except Exception as e:
-            logger.error(f"Error in document processing: {str(e)}")
+            logger.error(f"Error deleting document {name}: {str(e)}")
             raise
 
+    def set_search_params(self, **search_params: Any) -> None:
+        """Update query-time index parameters, e.g. ``nprobe=32`` or ``efSearch=128``."""
+        self.search_params.update(search_params)
+        if self.vector_store is not None:
+            apply_search_params(self.vector_store.index, self.search_params)
+        logger.info(f"Updated search parameters to {self.search_params}")
+
+    def get_embedding_cache_stats(self) -> Dict[str, Any]:
+        """Return embedding cache counters, or an empty dict if caching is disabled."""
+        if self.embedding_cache is None:
+            return {}
+        return self.embedding_cache.stats()
+
     def save_knowledge_base(self, save_path: str) -> None:
-        """Save the vector store to disk."""
+        """Save the vector store to disk.
+
+        Saving to the directory the KB was loaded from or last saved to
+        appends one segment holding the changes (see ``append_segment``);
+        anywhere else, the directory is replaced atomically by a full
+        snapshot (see ``write_knowledge_base``). If other sessions saved
+        the same KB meanwhile, the changes are rebased onto theirs and the
+        KB is reopened; if it was replaced or deleted, KnowledgeBaseConflict
+        is raised rather than overwriting it. Either way the write-ahead
+        log of ingestion checkpoints is dropped, as the saved KB now
+        contains everything it recorded, and the KB is queued for
+        compaction if appends have fragmented it.
+        """
         try:
             if self.vector_store is not None:
-                # Create directory if it doesn't exist
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                changed = {
+                    name: entry for name, entry in self.manifest.items() if self._saved_documents.get(name) != entry
+                }
+                removed = [name for name in self._saved_documents if name not in self.manifest]
+                if (
+                    self._shared_kb is not None
+                    and Path(self._shared_kb.path).resolve() == Path(save_path).resolve()
+                    and not changed
+                    and not removed
+                ):
+                    logger.info(f"Knowledge base at {save_path} is unchanged")
+                    return
+                self._ensure_writable_index()
 
-                # Save the vector store
-                self.vector_store.save_local(save_path)
+                # Save the vector store and its document manifest
+                settings = {
+                    "version": 1,
+                    "index_factory": self.index_factory,
+                    "search_params": self.search_params,
+                }
+                with self.telemetry.span("kb_save", chunks=self.vector_store.index.ntotal) as span:
+                    span["mode"] = "append"
+                    result = append_segment(
+                        save_path, self.vector_store, changed, removed, settings, self._kb_generation
+                    )
+                    if result is None:
+                        span["mode"] = "snapshot"
+                        # Only overwrite the loaded KB if nobody else saved it meanwhile
+                        same_kb = self.kb_path is not None and Path(self.kb_path).resolve() == Path(save_path).resolve()
+                        manifest = write_knowledge_base(
+                            save_path,
+                            self.vector_store,
+                            self.bm25,
+                            {**settings, "documents": self.manifest},
+                            expected_generation=(self._kb_generation or "") if same_kb else None,
+                        )
+                        # Serve queries from the saved segment from now on, so the next save can append
+                        self.vector_store = read_vector_store(save_path, self.embeddings, manifest=manifest)
+                        apply_search_params(self.vector_store.index, self.search_params)
+                        self._initialize_retriever()
+                    else:
+                        manifest, rebased = result
+                        if rebased:
+                            # Other sessions saved meanwhile; reopen the KB to include their changes
+                            span["mode"] = "rebase"
+                            kb = open_knowledge_base(save_path, self.embeddings)
+                            self.vector_store = kb.vector_store
+                            self.bm25 = kb.bm25
+                            self.kb_version = kb.version
+                            self.manifest = dict(kb.manifest["documents"])
+                            self._deduplicator = None
+                            manifest = kb.manifest
+                            apply_search_params(self.vector_store.index, self.search_params)
+                            self._initialize_retriever()
+                self._saved_documents = {name: dict(entry) for name, entry in self.manifest.items()}
+                self._kb_generation = manifest.get("generation")
+                if self._ingest_log is not None and self.kb_path == save_path:
+                    self._ingest_log.clear()
+                self._release_ingest_log()
+                self.kb_path = save_path
+                if self.resources is not None:
+                    self.resources.invalidate_knowledge_base(save_path)
+                self.compactor.schedule(save_path)
                 logger.info(f"Successfully saved knowledge base to {save_path}")
             else:
                 logger.warning("No vector store to save")
@@ -215,17 +4166,58 @@ class RAGSystem:
             raise
 
     def load_knowledge_base(self, load_path: str) -> None:
-        """Load a vector store from disk."""
+        """Load a vector store from disk.
+
+        Knowledge bases saved in the old pickle format are migrated first.
+        A save interrupted by a crash is completed or rolled back, and
+        documents checkpointed to the write-ahead log since the last save
+        are replayed and saved.
+        """
         try:
+            recover_knowledge_base(load_path)
             if os.path.exists(load_path):
-                self.vector_store = FAISS.load_local(
-                    load_path,
-                    self.embeddings,
-                    allow_dangerous_deserialization=True,  # Only for local files we created
-                )
+                self._release_shared_kb()
+                self._release_ingest_log()
+                log = IngestLog(os.path.join(load_path, WAL_DIR))
+                has_log = bool(log.segments()) and not log.in_use()
+                if is_knowledge_base(load_path) or not has_log:
+                    with self.telemetry.span("kb_load") as span:
+                        if self.resources is not None:
+                            kb = self.resources.acquire_knowledge_base(load_path, self.embeddings)
+                            self._shared_kb = kb
+                        else:
+                            kb = open_knowledge_base(load_path, self.embeddings)
+                        span["chunks"] = kb.vector_store.index.ntotal
 
-                # Initialize conversation chain
-                self._initialize_conversation_chain()
+                    self.vector_store = kb.vector_store
+                    self.bm25 = kb.bm25
+                    self.kb_version = kb.version
+                    self.manifest = dict(kb.manifest.get("documents", {}))
+                    self._saved_documents = {name: dict(entry) for name, entry in self.manifest.items()}
+                    self._kb_generation = kb.manifest.get("generation")
+                    self.index_factory = kb.manifest.get("index_factory", "Flat")
+                    self.search_params = dict(kb.manifest.get("search_params", self.search_params))
+                else:
+                    # Only checkpoints exist: the first ingestion never reached a save
+                    self.vector_store = None
+                    self.bm25 = BM25Index()
+                    self.kb_version = uuid.uuid4().hex
+                    self.manifest = {}
+                    self._saved_documents = {}
+                    self._kb_generation = None
+                self._deduplicator = None
+                self.kb_path = load_path
+
+                if has_log:
+                    if self._replay_ingest_log(log):
+                        self.save_knowledge_base(load_path)
+                    # The saved KB now holds what the log recorded
+                    log.clear()
+                if self.vector_store is None:
+                    raise FileNotFoundError(f"No index or checkpointed documents in {load_path}")
+
+                # Initialize retriever
+                self._initialize_retriever()
 
                 logger.info(f"Successfully loaded knowledge base from {load_path}")
             else:
@@ -235,30 +4227,548 @@ class RAGSystem:
             logger.error(f"Error loading knowledge base: {str(e)}")
             raise
 
+    def refresh_knowledge_base(self) -> bool:
+        """Reload the shared knowledge base if it was saved again on disk.
+
+        Returns True if a newer version was loaded.
+        """
+        if self._shared_kb is None or self.resources.is_current(self._shared_kb):
+            return False
+        kb_path = self._shared_kb.path
+        if not is_knowledge_base(kb_path):
+            return False
+        self.load_knowledge_base(kb_path)
+        return True
+
+    def _release_shared_kb(self) -> None:
+        """Give back the shared knowledge base this session is using, if any."""
+        if self._shared_kb is not None:
+            self.resources.release_knowledge_base(self._shared_kb)
+            self._shared_kb = None
+
+    def close(self) -> None:
+        """Release shared resources held by this instance."""
+        self._release_shared_kb()
+        self._release_ingest_log()
+
+    def _replay_ingest_log(self, log: IngestLog) -> int:
+        """Apply the documents checkpointed in a write-ahead log; returns how many were restored.
+
+        A document is restored if all of its chunks reached the log (or are
+        already indexed) and the snapshot does not hold the same version of
+        it. Vectors of chunks whose document never completed are put in the
+        embedding cache, so ingesting that document again does not re-embed
+        them.
+        """
+        from langchain_core.documents import Document
+
+        chunks: Dict[str, Tuple[Any, np.ndarray, str]] = {}
+        documents = []
+        for kind, header, vectors in log.replay():
+            if kind == "chunks":
+                for i, chunk_id in enumerate(header["ids"]):
+                    doc = Document(page_content=header["texts"][i], metadata=header["metadatas"][i])
+                    chunks[chunk_id] = (doc, vectors[i], header["model"])
+            else:
+                documents.append(header)
+
+        present = set(self.vector_store.index_to_docstore_id.values()) if self.vector_store else set()
+        used = set()
+        duplicates: Dict[str, List[Dict[str, Any]]] = {}
+        restored = 0
+        for record in documents:
+            name, entry = record["name"], record["entry"]
+            if self.manifest.get(name, {}).get("hash") == entry["hash"]:
+                continue
+            if not all(chunk_id in present or chunk_id in chunks for chunk_id in entry["ids"]):
+                continue
+
+            self._ensure_writable_index()
+            new_ids = [chunk_id for chunk_id in entry["ids"] if chunk_id not in present]
+            for start in range(0, len(new_ids), self.embed_batch_size):
+                batch_ids = new_ids[start : start + self.embed_batch_size]
+                batch = [(chunk_id, chunks[chunk_id][0]) for chunk_id in batch_ids]
+                self._add_embedded_batch(batch, [chunks[chunk_id][1] for chunk_id in batch_ids])
+                for chunk_id, doc in batch:
+                    self.bm25.add(chunk_id, doc.page_content)
+            present.update(new_ids)
+            used.update(new_ids)
+            for chunk_id, locations in record["duplicates"].items():
+                duplicates.setdefault(chunk_id, []).extend(locations)
+
+            previous = self.manifest.get(name)
+            self.manifest[name] = entry
+            if previous is not None:
+                self._delete_vectors(self._unreferenced_ids(previous["ids"]))
+            restored += 1
+        if restored:
+            # A first ingestion into a trained index type buffers until here
+            self._build_trained_store()
+            self._record_duplicate_sources(duplicates)
+
+        leftovers = [chunk for chunk_id, chunk in chunks.items() if chunk_id not in used]
+        if leftovers and self.embedding_cache is not None:
+            for model in {model for _, _, model in leftovers}:
+                same_model = [(doc, vector) for doc, vector, m in leftovers if m == model]
+                self.embedding_cache.put_many(
+                    model, [doc.page_content for doc, _ in same_model], [v for _, v in same_model]
+                )
+        if restored:
+            self._deduplicator = None
+            self.kb_version = uuid.uuid4().hex
+            logger.info(f"Restored {restored} documents from the ingestion log in {log.wal_dir}")
+        return restored
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _needs_condense(self, question: str) -> bool:
+        """Decide whether a question must be rewritten using the chat history."""
+        if not self.memory.chat_memory.messages or self.condense_mode == "never":
+            return False
+        if self.condense_mode == "always":
+            return True
+        return len(question.split()) <= 3 or bool(_FOLLOW_UP_PATTERN.search(question))
+
+    def _condense_prompt(self, question: str) -> str:
+        """Build the prompt that rewrites a follow-up into a standalone question."""
+        from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+
+        return CONDENSE_QUESTION_PROMPT.format(
+            chat_history=self._format_chat_history(), question=question
+        )
+
+    @staticmethod
+    def _same_question(a: str, b: str) -> bool:
+        """Compare questions ignoring case, whitespace and trailing punctuation."""
+        def normalize(text: str) -> str:
+            return " ".join(text.lower().split()).rstrip("?.! ")
+
+        return normalize(a) == normalize(b)
+
+    def _prepare_answer(self, question: str) -> Tuple[str, List["Document"], Dict[str, Any]]:
+        """Resolve the standalone question and retrieve its context.
+
+        When a rewrite is needed, retrieval on the raw question runs
+        concurrently with the condense call and is reused if the rewrite
+        leaves the question unchanged. Returns (standalone question, docs,
+        stats) where stats counts LLM calls and per-stage milliseconds.
+        """
+        stats = {"llm_calls": 0, "condensed": False, "timings_ms": {}}
+        timings = stats["timings_ms"]
+
+        if not self._needs_condense(question):
+            start = time.perf_counter()
+            docs = self.retriever.invoke(question)
+            timings["retrieve"] = (time.perf_counter() - start) * 1000
+            return question, docs, stats
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            start = time.perf_counter()
+            raw_docs = executor.submit(self.retriever.invoke, question)
+            condensed = self.llm.invoke(self._condense_prompt(question))
+            standalone_question = condensed.content.strip()
+            self._add_token_usage(stats, condensed)
+            stats["llm_calls"] += 1
+            timings["condense"] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            if self._same_question(standalone_question, question):
+                docs = raw_docs.result()
+            else:
+                stats["condensed"] = True
+                docs = self.retriever.invoke(standalone_question)
+            timings["retrieve"] = (time.perf_counter() - start) * 1000
+        return standalone_question, docs, stats
+
+    async def _aprepare_answer(
+        self, question: str
+    ) -> Tuple[str, List["Document"], Dict[str, Any]]:
+        """Async variant of _prepare_answer."""
+        stats = {"llm_calls": 0, "condensed": False, "timings_ms": {}}
+        timings = stats["timings_ms"]
+
+        if not self._needs_condense(question):
+            start = time.perf_counter()
+            docs = await self.retriever.ainvoke(question)
+            timings["retrieve"] = (time.perf_counter() - start) * 1000
+            return question, docs, stats
+
+        start = time.perf_counter()
+        raw_docs = asyncio.ensure_future(self.retriever.ainvoke(question))
+        condensed = await self.llm.ainvoke(self._condense_prompt(question))
+        standalone_question = condensed.content.strip()
+        self._add_token_usage(stats, condensed)
+        stats["llm_calls"] += 1
+        timings["condense"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        if self._same_question(standalone_question, question):
+            docs = await raw_docs
+        else:
+            raw_docs.cancel()
+            stats["condensed"] = True
+            docs = await self.retriever.ainvoke(standalone_question)
+        timings["retrieve"] = (time.perf_counter() - start) * 1000
+        return standalone_question, docs, stats
+
+    def _answer_cache_lookup(
+        self, question: str
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        """Return (cached result, question embedding) for a cacheable question.
+
+        Only deterministic (temperature 0) answers to questions that need no
+        rewriting are cached. The embedding is computed only for semantic
+        matching and is passed on to _answer_cache_store.
+        """
+        if (
+            self.answer_cache is None
+            or self.temperature != 0
+            or self._needs_condense(question)
+        ):
+            return None, None
+
+        embedding = None
+        if self.answer_cache.similarity_threshold:
+            embedding = self.embeddings.embed_query(question)
+        cached = self.answer_cache.get(self._answer_cache_scope(), question, embedding)
+        return cached, embedding
+
+    def _answer_cache_scope(self) -> Tuple:
+        """Cache scope: answers are only reused for the same KB content, model and retrieval settings."""
+        return (
+            self.kb_version,
+            self.model_name,
+            self.temperature,
+            self.embed_model,
+            self.retrieval_mode,
+            self.retrieval_k,
+            tuple(self.hybrid_weights),
+            self.rrf_k,
+            json.dumps(self.search_params, sort_keys=True),
+        )
+
+    def _answer_cache_store(
+        self,
+        question: str,
+        answer: str,
+        docs: List["Document"],
+        stats: Dict[str, Any],
+        embedding: Optional[List[float]],
+    ) -> None:
+        """Cache an answer if it was produced without rewriting the question."""
+        if self.answer_cache is None or self.temperature != 0 or stats["condensed"]:
+            return
+        if stats["llm_calls"] != 1:
+            return
+        self.answer_cache.put(
+            self._answer_cache_scope(),
+            question,
+            {"answer": answer, "sources": self._format_sources(docs)},
+            embedding,
+        )
+
+    def get_answer_cache_stats(self) -> Dict[str, Any]:
+        """Return answer cache counters, or an empty dict if caching is disabled."""
+        if self.answer_cache is None:
+            return {}
+        return self.answer_cache.stats()
+
     def query(self, question: str) -> Dict[str, Any]:
         """Query the knowledge base."""
         try:
-            if self.conversation_chain is None:
+            if self.retriever is None:
                 raise ValueError(
                     "No knowledge base loaded. Please process documents first."
                 )
 
-            # Get response from conversation chain
-            response = self.conversation_chain.invoke({"question": question})
+            start = time.perf_counter()
+            cached, question_embedding = self._answer_cache_lookup(question)
+            if cached is not None:
+                self.memory.save_context({"question": question}, {"answer": cached["answer"]})
+                stats = {
+                    "llm_calls": 0,
+                    "condensed": False,
+                    "cache_hit": True,
+                    "timings_ms": {"cache": (time.perf_counter() - start) * 1000},
+                }
+                self._record_query(stats)
+                return {**cached, "stats": stats}
 
-            # Extract answer and source documents
-            answer = response["answer"]
-            source_docs = response["source_documents"]
+            standalone_question, docs, stats = self._prepare_answer(question)
 
-            # Format source documents
-            sources = []
-            for doc in source_docs:
-                source_info = {"content": doc.page_content, "metadata": doc.metadata}
-                sources.append(source_info)
+            start = time.perf_counter()
+            response = self.llm.invoke(self._build_answer_messages(standalone_question, docs))
+            answer = response.content
+            self._add_token_usage(stats, response)
+            stats["llm_calls"] += 1
+            stats["timings_ms"]["answer"] = (time.perf_counter() - start) * 1000
+            self._record_query(stats)
+
+            self.memory.save_context({"question": question}, {"answer": answer})
+            self._answer_cache_store(question, answer, docs, stats, question_embedding)
+            return {"answer": answer, "sources": self._format_sources(docs), "stats": stats}
+
+        except Exception as e:
+            self.telemetry.increment("query_errors")
+            logger.error(f"Error querying knowledge base: {str(e)}")
+            raise
+
+    def _add_token_usage(self, stats: Dict[str, Any], message: Any) -> None:
+        """Add an LLM response's token counts, when the model reports them, to stats."""
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            return
+        tokens = stats.setdefault("tokens", {"input": 0, "output": 0})
+        tokens["input"] += usage.get("input_tokens", 0)
+        tokens["output"] += usage.get("output_tokens", 0)
+
+    def _record_query(self, stats: Dict[str, Any]) -> None:
+        """Report a finished query's stage timings and token counts to telemetry."""
+        self.telemetry.increment("queries")
+        if stats.get("cache_hit"):
+            self.telemetry.increment("answer_cache_hits")
+        for key, stage in _QUERY_STAGES.items():
+            if key in stats["timings_ms"]:
+                self.telemetry.record(stage, stats["timings_ms"][key])
+        tokens = stats.get("tokens", {})
+        self.telemetry.increment("llm_input_tokens", tokens.get("input", 0))
+        self.telemetry.increment("llm_output_tokens", tokens.get("output", 0))
+
+    def query_batch(self, questions: List[str], concurrency: int = 4) -> List[Dict[str, Any]]:
+        """Answer many standalone questions, e.g. for offline evaluation.
+
+        All questions are embedded in batches of ``embed_batch_size``
+        (bypassing the chunk embedding cache) and searched with one index query over the question matrix; answers are
+        then generated with at most ``concurrency`` LLM calls in flight.
+        Chat memory and the answer cache are not used, so every question is
+        answered on its own. Returns one dict per question, in order, with
+        "question", "answer", "sources", "error" (None on success) and
+        "timings_ms"; a failed LLM call only fails its own item. Batch-wide
+        timings are kept in ``last_batch_stats``.
+        """
+        try:
+            if self.retriever is None:
+                raise ValueError(
+                    "No knowledge base loaded. Please process documents first."
+                )
+            timings: Dict[str, float] = {}
+
+            start = time.perf_counter()
+            vectors = []
+            for first in range(0, len(questions), self.embed_batch_size):
+                vectors.extend(self._embed_texts(questions[first : first + self.embed_batch_size], cache=False))
+            timings["embed"] = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            with self.telemetry.span("retrieve_batch", questions=len(questions)):
+                retrieved = self._retrieve_batch(questions, vectors)
+            timings["retrieve"] = (time.perf_counter() - start) * 1000
+
+            def answer(i: int) -> Dict[str, Any]:
+                result = {
+                    "question": questions[i],
+                    "answer": None,
+                    "sources": [],
+                    "error": None,
+                    "timings_ms": {},
+                }
+                start = time.perf_counter()
+                try:
+                    docs = retrieved[i]
+                    if isinstance(docs, Exception):
+                        raise docs
+                    result["sources"] = self._format_sources(docs)
+                    messages = self._build_answer_messages(questions[i], docs)
+                    response = self.llm.invoke(messages)
+                    result["answer"] = response.content
+                    stats = {"timings_ms": result["timings_ms"]}
+                    self._add_token_usage(stats, response)
+                    result["timings_ms"]["answer"] = (time.perf_counter() - start) * 1000
+                    self._record_query(stats)
+                except Exception as e:
+                    self.telemetry.increment("query_errors")
+                    logger.error(f"Error answering batch question {i}: {str(e)}")
+                    result["error"] = str(e)
+                    result["timings_ms"]["answer"] = (time.perf_counter() - start) * 1000
+                return result
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                results = list(executor.map(answer, range(len(questions))))
+            timings["answer"] = (time.perf_counter() - start) * 1000
+
+            self.last_batch_stats = {
+                "questions": len(questions),
+                "errors": sum(result["error"] is not None for result in results),
+                "concurrency": max(1, concurrency),
+                "timings_ms": timings,
+            }
+            return results
+
+        except Exception as e:
+            logger.error(f"Error in batch query: {str(e)}")
+            raise
+
+    def _retrieve_batch(
+        self, questions: List[str], vectors: List[List[float]]
+    ) -> List[Union[List["Document"], Exception]]:
+        """Retrieve chunks for every question with one dense index search.
+
+        Gives the same chunks as ``self.retriever``; in hybrid mode each
+        question's BM25 results are fused with its dense results.
+        """
+        from langchain_core.documents import Document
+
+        hybrid = self.retrieval_mode == "hybrid"
+        fetch_k = self.retriever.fetch_k if hybrid else self.retrieval_k
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(questions), -1)
+        _, positions = self.vector_store.index.search(matrix, fetch_k)
+        mapping = self.vector_store.index_to_docstore_id
+
+        retrieved: List[Union[List["Document"], Exception]] = []
+        for question, row in zip(questions, positions):
+            try:
+                dense_ids = [mapping[p] for p in row if p != -1 and p in mapping]
+                if hybrid:
+                    lexical_ids = [doc_id for doc_id, _ in self.bm25.search(question, fetch_k)]
+                    retrieved.append(self.retriever.fuse(dense_ids, lexical_ids))
+                else:
+                    docs = [self.vector_store.docstore.search(doc_id) for doc_id in dense_ids]
+                    retrieved.append([doc for doc in docs if isinstance(doc, Document)])
+            except Exception as e:
+                retrieved.append(e)
+        return retrieved
 
-            return {"answer": answer, "sources": sources}
+    def _format_chat_history(self) -> str:
+        """Render the conversation so far the way ConversationalRetrievalChain does."""
+        buffer = ""
+        for message in self.memory.chat_memory.messages:
+            role = "Human" if message.type == "human" else "Assistant"
+            buffer += f"\n{role}: {message.content}"
+        return buffer
+
+    @staticmethod
+    def _format_sources(docs: List["Document"]) -> List[Dict[str, Any]]:
+        """Convert retrieved chunks to the source dicts returned by query()."""
+        return [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+
+    @staticmethod
+    def _build_answer_messages(question: str, docs: List["Document"]) -> List["BaseMessage"]:
+        """Build the "stuff" QA prompt used by ConversationalRetrievalChain."""
+        from langchain.chains.question_answering.stuff_prompt import CHAT_PROMPT
+
+        context = "\n\n".join(doc.page_content for doc in docs)
+        return CHAT_PROMPT.format_messages(context=context, question=question)
+
+    def stream_query(self, question: str) -> Iterator[Dict[str, Any]]:
+        """Query the knowledge base, streaming the answer.
+
+        Yields ``{"type": "sources", "sources": [...]}`` once retrieval is
+        done, then ``{"type": "token", "content": str}`` for each answer token,
+        and finally ``{"type": "stats", "stats": {...}}``. The exchange is
+        added to conversation memory when the answer completes.
+        """
+        try:
+            if self.retriever is None:
+                raise ValueError(
+                    "No knowledge base loaded. Please process documents first."
+                )
+
+            start = time.perf_counter()
+            cached, question_embedding = self._answer_cache_lookup(question)
+            if cached is not None:
+                yield {"type": "sources", "sources": cached["sources"]}
+                yield {"type": "token", "content": cached["answer"]}
+                self.memory.save_context({"question": question}, {"answer": cached["answer"]})
+                stats = {
+                    "llm_calls": 0,
+                    "condensed": False,
+                    "cache_hit": True,
+                    "timings_ms": {"cache": (time.perf_counter() - start) * 1000},
+                }
+                self._record_query(stats)
+                yield {"type": "stats", "stats": stats}
+                return
+
+            standalone_question, docs, stats = self._prepare_answer(question)
+            yield {"type": "sources", "sources": self._format_sources(docs)}
+
+            start = time.perf_counter()
+            answer_parts = []
+            for chunk in self.llm.stream(self._build_answer_messages(standalone_question, docs)):
+                self._add_token_usage(stats, chunk)
+                if chunk.content:
+                    if not answer_parts:
+                        stats["timings_ms"]["first_token"] = (time.perf_counter() - start) * 1000
+                    answer_parts.append(chunk.content)
+                    yield {"type": "token", "content": chunk.content}
+            stats["llm_calls"] += 1
+            stats["timings_ms"]["answer"] = (time.perf_counter() - start) * 1000
+            self._record_query(stats)
+
+            answer = "".join(answer_parts)
+            self.memory.save_context({"question": question}, {"answer": answer})
+            self._answer_cache_store(question, answer, docs, stats, question_embedding)
+            yield {"type": "stats", "stats": stats}
+
+        except Exception as e:
+            self.telemetry.increment("query_errors")
+            logger.error(f"Error querying knowledge base: {str(e)}")
+            raise
+
+    async def astream_query(self, question: str) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of stream_query, yielding the same events."""
+        try:
+            if self.retriever is None:
+                raise ValueError(
+                    "No knowledge base loaded. Please process documents first."
+                )
+
+            start = time.perf_counter()
+            cached, question_embedding = self._answer_cache_lookup(question)
+            if cached is not None:
+                yield {"type": "sources", "sources": cached["sources"]}
+                yield {"type": "token", "content": cached["answer"]}
+                self.memory.save_context({"question": question}, {"answer": cached["answer"]})
+                stats = {
+                    "llm_calls": 0,
+                    "condensed": False,
+                    "cache_hit": True,
+                    "timings_ms": {"cache": (time.perf_counter() - start) * 1000},
+                }
+                self._record_query(stats)
+                yield {"type": "stats", "stats": stats}
+                return
+
+            standalone_question, docs, stats = await self._aprepare_answer(question)
+            yield {"type": "sources", "sources": self._format_sources(docs)}
+
+            start = time.perf_counter()
+            answer_parts = []
+            async for chunk in self.llm.astream(
+                self._build_answer_messages(standalone_question, docs)
+            ):
+                self._add_token_usage(stats, chunk)
+                if chunk.content:
+                    if not answer_parts:
+                        stats["timings_ms"]["first_token"] = (time.perf_counter() - start) * 1000
+                    answer_parts.append(chunk.content)
+                    yield {"type": "token", "content": chunk.content}
+            stats["llm_calls"] += 1
+            stats["timings_ms"]["answer"] = (time.perf_counter() - start) * 1000
+            self._record_query(stats)
+
+            answer = "".join(answer_parts)
+            self.memory.save_context({"question": question}, {"answer": answer})
+            self._answer_cache_store(question, answer, docs, stats, question_embedding)
+            yield {"type": "stats", "stats": stats}
 
         except Exception as e:
+            self.telemetry.increment("query_errors")
             logger.error(f"Error querying knowledge base: {str(e)}")
             raise
 
@@ -268,5 +4778,489 @@ class RAGSystem:
         logger.info("Cleared conversation memory")
 
 
-# Create a global instance with default configuration
-rag_instance = RAGSystem()
+class IngestJobQueue:
+    """Background ingestion jobs with persistent state and progress.
+
+    Jobs run on ``max_jobs`` worker threads, so at most that many
+    ingestions compete with queries for CPU and the embedding server;
+    further jobs wait in the queue, and jobs writing the same knowledge base
+    run one after another. Uploads are copied into ``jobs_dir`` when a job
+    is submitted, so it does not depend on the browser session.
+
+    Files are ingested in commit batches of up to ``commit_bytes`` (at most
+    ``commit_files`` files). After each batch the knowledge base is saved and
+    the batch's files are marked done in ``jobs.sqlite``, so a cancelled or
+    failed job, or one interrupted by a server restart, resumes from the last
+    committed batch.
+    """
+
+    ACTIVE = ("queued", "running")
+    RESUMABLE = ("cancelled", "failed", "interrupted")
+
+    def __init__(
+        self,
+        jobs_dir: str = "ingest_jobs",
+        resources: Optional[SharedResources] = None,
+        max_jobs: int = 1,
+        commit_bytes: int = 32 << 20,
+        commit_files: int = 64,
+    ):
+        self.jobs_dir = jobs_dir
+        self.resources = resources
+        self.max_jobs = max(1, max_jobs)
+        self.commit_bytes = commit_bytes
+        self.commit_files = max(1, commit_files)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="ingest-job")
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._futures: Dict[str, Any] = {}
+        self._kb_locks: Dict[str, threading.Lock] = {}
+
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(jobs_dir, "jobs.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kb_path TEXT NOT NULL, status TEXT NOT NULL, "
+            "settings TEXT NOT NULL, created REAL NOT NULL, updated REAL NOT NULL, "
+            "finished REAL, error TEXT, committed_batches INTEGER NOT NULL DEFAULT 0, "
+            "chunks INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files ("
+            "job_id TEXT NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL, "
+            "path TEXT NOT NULL, size INTEGER NOT NULL, spooled INTEGER NOT NULL, "
+            "status TEXT NOT NULL, chunks INTEGER NOT NULL DEFAULT 0, error TEXT, "
+            "PRIMARY KEY (job_id, position))"
+        )
+        # Jobs that were queued or running when the process stopped
+        now = time.time()
+        self._conn.execute(
+            "UPDATE jobs SET status = 'interrupted', updated = ? WHERE status IN ('queued', 'running')",
+            (now,),
+        )
+        self._conn.execute(
+            "UPDATE job_files SET status = 'pending', chunks = 0 WHERE status = 'running'"
+        )
+        self._conn.commit()
+
+    def submit(self, kb_path: str, files: List[Any], settings: Optional[Dict[str, Any]] = None) -> str:
+        """Queue files for ingestion into the knowledge base at kb_path and return the job ID.
+
+        ``files`` are paths, which are read in place, or uploads accepted by
+        ``open_upload``, which are copied into the jobs directory first.
+        ``settings`` are RAGSystem constructor arguments, typically a
+        session's ``ingest_settings()``. Documents are known by file name,
+        so two files with the same name raise ValueError.
+        """
+        if not files:
+            raise ValueError("No files provided for processing")
+
+        job_id = uuid.uuid4().hex[:12]
+        rows = []
+        names = set()
+        try:
+            for position, item in enumerate(files):
+                if isinstance(item, (str, os.PathLike)):
+                    path, name, spooled = str(item), Path(item).name, False
+                else:
+                    name, stream = open_upload(item)
+                    path = os.path.join(self.jobs_dir, job_id, f"{position:05d}", name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "wb") as f:
+                        shutil.copyfileobj(stream, f, STREAM_BLOCK_SIZE)
+                    spooled = True
+                if name in names:
+                    raise ValueError(f"More than one file is named {name}; rename or remove the duplicates")
+                names.add(name)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                rows.append((job_id, position, name, path, size, int(spooled), "pending"))
+        except Exception as e:
+            logger.error(f"Error queueing ingestion job: {str(e)}")
+            shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+            raise
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kb_path, status, settings, created, updated) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, str(kb_path), json.dumps(settings or {}), now, now),
+            )
+            self._conn.executemany(
+                "INSERT INTO job_files (job_id, position, name, path, size, spooled, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+        self._start(job_id)
+        logger.info(f"Queued ingestion job {job_id} with {len(rows)} files for {kb_path}")
+        return job_id
+
+    def _start(self, job_id: str) -> None:
+        with self._lock:
+            self._cancel_events[job_id] = threading.Event()
+            self._futures[job_id] = self._executor.submit(self._run, job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job with its files and progress, or None if it does not exist."""
+        jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def list_jobs(self, kb_path: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Return the most recent jobs, newest first, optionally for one knowledge base."""
+        if kb_path is None:
+            return self._select("ORDER BY created DESC LIMIT ?", (limit,))
+        return self._select("WHERE kb_path = ? ORDER BY created DESC LIMIT ?", (str(kb_path), limit))
+
+    def _select(self, clause: str, params: Tuple[Any, ...]) -> List[Dict[str, Any]]:
+        columns = (
+            "id", "kb_path", "status", "settings", "created", "updated", "finished", "error",
+            "committed_batches", "chunks",
+        )
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(columns)} FROM jobs {clause}", params).fetchall()
+            jobs = []
+            for row in rows:
+                job = dict(zip(columns, row))
+                job["settings"] = json.loads(job["settings"])
+                job["files"] = [
+                    dict(zip(("position", "name", "path", "size", "status", "chunks", "error"), file_row))
+                    for file_row in self._conn.execute(
+                        "SELECT position, name, path, size, status, chunks, error FROM job_files "
+                        "WHERE job_id = ? ORDER BY position",
+                        (job["id"],),
+                    )
+                ]
+                jobs.append(job)
+
+        for job in jobs:
+            files = job["files"]
+            finished = [f for f in files if f["status"] in ("done", "skipped", "failed")]
+            total_bytes = sum(f["size"] for f in files)
+            job["files_total"] = len(files)
+            job["files_finished"] = len(finished)
+            job["chunks_read"] = sum(f["chunks"] for f in files)
+            job["progress"] = (
+                sum(f["size"] for f in finished) / total_bytes
+                if total_bytes
+                else len(finished) / max(1, len(files))
+            )
+        return jobs
+
+    def cancel(self, job_id: str) -> bool:
+        """Ask a queued or running job to stop; a running job stops at its next chunk or commit."""
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        job = self.get(job_id)
+        if event is None or job is None or job["status"] not in self.ACTIVE:
+            return False
+        event.set()
+        logger.info(f"Cancelling ingestion job {job_id}")
+        return True
+
+    def resume(self, job_id: str) -> bool:
+        """Queue a cancelled, failed or interrupted job again; committed files are not redone."""
+        job = self.get(job_id)
+        if job is None or job["status"] not in self.RESUMABLE:
+            return False
+        self._update(job_id, status="queued", error=None, finished=None)
+        self._start(job_id)
+        logger.info(f"Resuming ingestion job {job_id}")
+        return True
+
+    def discard(self, job_id: str) -> bool:
+        """Delete a job that is not queued or running, with its copied uploads."""
+        job = self.get(job_id)
+        if job is None or job["status"] in self.ACTIVE:
+            return False
+        with self._lock:
+            self._conn.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._conn.commit()
+            self._cancel_events.pop(job_id, None)
+            self._futures.pop(job_id, None)
+        shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+        return True
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until a job started by this process finishes, then return it."""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+        return self.get(job_id)
+
+    def shutdown(self, cancel: bool = True) -> None:
+        """Stop the worker threads, cancelling running jobs so they can be resumed later."""
+        if cancel:
+            with self._lock:
+                events = list(self._cancel_events.values())
+            for event in events:
+                event.set()
+        self._executor.shutdown(wait=True)
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def _update_files(self, job_id: str, rows: List[Tuple[str, int, Optional[str], int]]) -> None:
+        """Set (status, chunks, error) of files given as (status, chunks, error, position) rows."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE job_files SET status = ?, chunks = ?, error = ? WHERE job_id = ? AND position = ?",
+                [(status, chunks, error, job_id, position) for status, chunks, error, position in rows],
+            )
+            self._conn.commit()
+
+    def _kb_lock(self, kb_path: str) -> threading.Lock:
+        key = str(Path(kb_path).resolve())
+        with self._lock:
+            return self._kb_locks.setdefault(key, threading.Lock())
+
+    def _commit_batches(self, files: List[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        batch, batch_bytes = [], 0
+        for file in files:
+            if batch and (batch_bytes + file["size"] > self.commit_bytes or len(batch) >= self.commit_files):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(file)
+            batch_bytes += file["size"]
+        if batch:
+            yield batch
+
+    def _run(self, job_id: str) -> None:
+        """Worker thread body: ingest a job's pending files batch by batch."""
+        job = self.get(job_id)
+        with self._lock:
+            cancelled = self._cancel_events[job_id]
+        with self._kb_lock(job["kb_path"]):
+            if cancelled.is_set():
+                self._finish(job_id, "cancelled")
+                return
+            self._update(job_id, status="running")
+            rag = None
+            try:
+                rag = RAGSystem(resources=self.resources, **job["settings"])
+                kb_path = job["kb_path"]
+                recover_knowledge_base(kb_path)
+                if is_knowledge_base(kb_path) or IngestLog(
+                    os.path.join(kb_path, WAL_DIR)
+                ).segments():
+                    # Also replays documents checkpointed before a crash or cancel
+                    rag.load_knowledge_base(kb_path)
+                else:
+                    rag.kb_path = kb_path
+                pending = [f for f in job["files"] if f["status"] in ("pending", "running")]
+                for batch in self._commit_batches(pending):
+                    self._ingest_batch(job, rag, batch, cancelled)
+            except IngestCancelled:
+                self._reset_running_files(job_id)
+                self._finish(job_id, "cancelled")
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+                self._reset_running_files(job_id)
+                self._finish(job_id, "failed", str(e))
+            else:
+                self._finish(job_id, "completed")
+                shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+            finally:
+                if rag is not None:
+                    rag.close()
+
+    def _ingest_batch(
+        self, job: Dict[str, Any], rag: RAGSystem, batch: List[Dict[str, Any]], cancelled: threading.Event
+    ) -> None:
+        """Ingest one commit batch, save the knowledge base and mark the batch's files done."""
+        if cancelled.is_set():
+            raise IngestCancelled("Ingestion cancelled")
+        job_id = job["id"]
+        positions = {file["name"]: file["position"] for file in batch}
+        self._update_files(job_id, [("running", 0, None, file["position"]) for file in batch])
+
+        outcomes: Dict[str, Dict[str, Any]] = {}
+        last_write = [0.0]
+
+        def progress(event: Dict[str, Any]) -> None:
+            if cancelled.is_set():
+                raise IngestCancelled("Ingestion cancelled")
+            outcomes[event["name"]] = event
+            # Chunk counts are written at most twice a second; finished files right away
+            now = time.monotonic()
+            if event["status"] != "reading" or now - last_write[0] >= 0.5:
+                last_write[0] = now
+                self._update_files(
+                    job_id, [("running", event["chunks"], event["error"], positions[event["name"]])]
+                )
+
+        try:
+            rag.process_documents([file["path"] for file in batch], progress=progress)
+        except IngestCancelled:
+            raise
+        except Exception:
+            # A batch in which every file failed to load has nothing to commit
+            if not all(outcomes.get(name, {}).get("status") == "failed" for name in positions):
+                raise
+        else:
+            if rag.last_ingest_stats.get("files"):
+                rag.save_knowledge_base(job["kb_path"])
+
+        rows = []
+        for file in batch:
+            event = outcomes.get(file["name"])
+            if event is None:
+                rows.append(("skipped", 0, None, file["position"]))
+            elif event["status"] == "failed":
+                rows.append(("failed", event["chunks"], event["error"], file["position"]))
+            else:
+                rows.append(("done", event["chunks"], None, file["position"]))
+        self._update_files(job_id, rows)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET committed_batches = committed_batches + 1, chunks = chunks + ?, "
+                "updated = ? WHERE id = ?",
+                (rag.last_ingest_stats.get("chunks", 0), time.time(), job_id),
+            )
+            self._conn.commit()
+
+    def _reset_running_files(self, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_files SET status = 'pending', chunks = 0, error = NULL "
+                "WHERE job_id = ? AND status = 'running'",
+                (job_id,),
+            )
+            self._conn.commit()
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        self._update(job_id, status=status, error=error, finished=time.time())
+        if self.resources is not None:
+            self.resources.telemetry.increment(f"ingest_jobs_{status}")
+        logger.info(f"Ingestion job {job_id} {status}")
+
+
+# Heavy resources shared by every session in this process
+shared_resources = SharedResources(
+    kb_cache_bytes=int(os.environ.get("DOCUBUDDY_KB_CACHE_MB", "2048")) << 20,
+    max_segments=int(os.environ.get("DOCUBUDDY_MAX_SEGMENTS", "8")),
+)
+
+
+def get_session_rag(session_state: Any) -> RAGSystem:
+    """Return the RAGSystem owned by a UI session, creating it on first use.
+
+    ``session_state`` is any mutable mapping scoped to one user session,
+    such as ``st.session_state``.
+    """
+    metrics_port = os.environ.get("DOCUBUDDY_METRICS_PORT")
+    if metrics_port:
+        shared_resources.serve_metrics(
+            int(metrics_port), os.environ.get("DOCUBUDDY_METRICS_HOST", "127.0.0.1")
+        )
+    if "rag" not in session_state:
+        session_state["rag"] = RAGSystem(
+            ingest_workers=int(os.environ.get("DOCUBUDDY_INGEST_WORKERS", "1")),
+            splitter_engine=os.environ.get("DOCUBUDDY_SPLITTER", "recursive"),
+            dedup=os.environ.get("DOCUBUDDY_DEDUP", "exact"),
+            checkpoint_every=int(os.environ.get("DOCUBUDDY_CHECKPOINT_BATCHES", "8")),
+            vector_backend=os.environ.get("DOCUBUDDY_VECTOR_BACKEND", "faiss"),
+            vector_dtype=os.environ.get("DOCUBUDDY_VECTOR_DTYPE", "float32"),
+            resources=shared_resources,
+        )
+        # Start at the temperature the UI shows, not the RAGSystem default
+        if "current_temperature" in session_state:
+            session_state["rag"].update_temperature(session_state["current_temperature"])
+    return session_state["rag"]
+
+
+_ingest_jobs: Optional[IngestJobQueue] = None
+_ingest_jobs_lock = threading.Lock()
+
+
+def get_ingest_jobs() -> IngestJobQueue:
+    """Return the process-wide ingestion job queue, creating it on first use."""
+    global _ingest_jobs
+    with _ingest_jobs_lock:
+        if _ingest_jobs is None:
+            _ingest_jobs = IngestJobQueue(
+                os.environ.get("DOCUBUDDY_JOBS_DIR", "ingest_jobs"),
+                resources=shared_resources,
+                max_jobs=int(os.environ.get("DOCUBUDDY_MAX_INGEST_JOBS", "1")),
+            )
+        return _ingest_jobs
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Answer a JSONL file of questions against a saved knowledge base.
+
+    Each input line is an object with a "question" field (other fields are
+    copied to the output) or a bare JSON string. Each output line adds
+    "answer", "sources", "error" and "timings_ms", in input order.
+    """
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Answer a JSONL file of questions against a DocuBuddy knowledge base."
+    )
+    parser.add_argument("knowledge_base", help="knowledge base directory, e.g. knowledge_bases/manuals")
+    parser.add_argument("-i", "--input", default="-", help="questions JSONL file, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="answers JSONL file, or - for stdout")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM calls in flight")
+    parser.add_argument(
+        "--batch-size", type=int, default=256, help="questions per batch; output is written after each"
+    )
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--embed-model", default="nomic-embed-text")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--retrieval-mode", choices=["hybrid", "dense"], default="hybrid")
+    parser.add_argument("--base-url", help="Ollama server URL")
+    parser.add_argument("--no-sources", action="store_true", help="leave retrieved chunks out of the output")
+    args = parser.parse_args(argv)
+
+    if not is_knowledge_base(args.knowledge_base):
+        parser.error(f"no knowledge base at {args.knowledge_base}")
+    rag = RAGSystem(
+        model_name=args.model,
+        embed_model=args.embed_model,
+        base_url=args.base_url,
+        retrieval_mode=args.retrieval_mode,
+        answer_cache_size=0,
+    )
+    rag.temperature = args.temperature
+    rag.load_knowledge_base(args.knowledge_base)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    answered = failed = 0
+    try:
+        records = (json.loads(line) for line in source if line.strip())
+        while True:
+            batch = [
+                record if isinstance(record, dict) else {"question": record}
+                for record in islice(records, max(1, args.batch_size))
+            ]
+            if not batch:
+                break
+            results = rag.query_batch([str(record["question"]) for record in batch], args.concurrency)
+            for record, result in zip(batch, results):
+                del result["question"]
+                if args.no_sources:
+                    del result["sources"]
+                sink.write(json.dumps({**record, **result}, ensure_ascii=False) + "\n")
+                failed += result["error"] is not None
+            sink.flush()
+            answered += len(batch)
+            logger.info(f"Answered {answered} questions ({failed} errors)")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import os
 from pathlib import Path
 from typing import List, Dict
 import logging
-from Agent import rag_instance
+from Agent import get_session_rag
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -66,6 +66,7 @@ class DocuBuddy:
 
     def _setup_sidebar(self):
         """Configure the sidebar with model settings."""
+        rag = get_session_rag(st.session_state)
         with st.sidebar:
             st.header("⚙️ Configuration")
 
@@ -81,7 +82,7 @@ class DocuBuddy:
             # Update model if changed
             if model != st.session_state.current_model:
                 st.session_state.current_model = model
-                rag_instance.update_model(model)
+                rag.update_model(model)
                 st.success(f"Switched to {model} model")
 
             # Model info
@@ -102,9 +103,10 @@ class DocuBuddy:
                 help="Higher values make responses more creative but less focused",
             )
 
-            if temperature != st.session_state.current_temperature:
+            # Also syncs a session RAGSystem created before the slider's default was set
+            if temperature != rag.temperature:
                 st.session_state.current_temperature = temperature
-                rag_instance.update_temperature(temperature)
+                rag.update_temperature(temperature)
 
             # Knowledge Base selection
             st.divider()
@@ -113,7 +115,7 @@ class DocuBuddy:
             if os.path.exists(kb_path):
                 st.success("✅ Knowledge Base: Ready")
                 if st.button("Clear Memory"):
-                    rag_instance.clear_memory()
+                    rag.clear_memory()
                     st.session_state.messages = []
                     st.success("Memory cleared!")
             else:
@@ -129,6 +131,7 @@ class DocuBuddy:
         - View source documents
         - Maintain conversation context
         """
+        rag = get_session_rag(st.session_state)
         st.title("DocuBuddy Chat")
 
         # Setup sidebar with model configuration
@@ -153,45 +156,58 @@ class DocuBuddy:
 
             try:
                 with st.chat_message("assistant"):
-                    with st.spinner("Thinking..."):
-                        response = rag_instance.query(prompt)
-                        sources = response.get("sources", [])
-
-                        # Format source documents
-                        if sources:
-                            source_text = ", ".join(
-                                [
-                                    f"{s.get('metadata', {}).get('source', 'Unknown')}"
-                                    for s in sources
-                                ]
-                            )
-                        else:
-                            source_text = "No specific sources"
-
-                        st.markdown(response["answer"])
-                        st.info(f"Sources: {source_text}")
-
-                        # Save message with sources
-                        st.session_state.messages.append(
-                            {
-                                "role": "assistant",
-                                "content": response["answer"],
-                                "sources": source_text,
-                            }
+                    sources = []
+
+                    def answer_tokens():
+                        # Sources arrive before the first token; keep them
+                        # aside and stream only the answer text.
+                        for event in rag.stream_query(prompt):
+                            if event["type"] == "sources":
+                                sources.extend(event["sources"])
+                            elif event["type"] == "token":
+                                yield event["content"]
+                            elif event["type"] == "stats":
+                                logger.info(f"Query stats: {event['stats']}")
+
+                    answer = st.write_stream(answer_tokens())
+
+                    # Format source documents
+                    if sources:
+                        source_text = ", ".join(
+                            [
+                                f"{s.get('metadata', {}).get('source', 'Unknown')}"
+                                for s in sources
+                            ]
                         )
+                    else:
+                        source_text = "No specific sources"
+
+                    st.info(f"Sources: {source_text}")
+
+                    # Save message with sources
+                    st.session_state.messages.append(
+                        {
+                            "role": "assistant",
+                            "content": answer,
+                            "sources": source_text,
+                        }
+                    )
             except Exception as e:
                 st.error(f"Error: {str(e)}")
                 logger.error(f"Error in chat interface: {e}", exc_info=True)
 
     def run(self):
         """Run the DocuBuddy application."""
+        rag = get_session_rag(st.session_state)
         try:
             # Load knowledge base if needed
             if not st.session_state.kb_loaded:
                 kb_path = os.path.join(KB_DIR, st.session_state.current_kb)
                 if os.path.exists(kb_path):
-                    rag_instance.load_knowledge_base(kb_path)
+                    rag.load_knowledge_base(kb_path)
                     st.session_state.kb_loaded = True
+            elif rag.refresh_knowledge_base():
+                logger.info("Knowledge base changed on disk; reloaded it")
 
             # Display chat interface
             self.display_chat_interface()
@@ -0,0 +1,163 @@
+"""
+Chunks removed by near-duplicate elimination and the index size and query time saved.
+
+The synthetic corpus mimics a document collection with boilerplate:
+every page carries a header, a disclaimer and a footer that differ only
+in the date and page number, and some documents are revisions of others
+with a few paragraphs rewritten. Each ``dedup`` mode ingests the same
+files with fake embeddings, so no Ollama server is needed; query time is
+retrieval only (dense FAISS + BM25), not generation. "distinct top-k" is
+the mean number of different chunk texts among the retrieved chunks,
+which drops when duplicates crowd each other into the results.
+
+Usage:
+    python benchmarks/dedup_savings.py --docs 40 --pages 10 --queries 200
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Agent import RAGSystem  # noqa: E402
+
+WORDS = (
+    "pump valve sensor pressure flow inspection maintenance schedule operator "
+    "calibration turbine bearing seal lubricant vibration alarm threshold shift "
+    "report supplier invoice warranty replacement torque coupling filter manifold"
+).split()
+
+HEADER = "Example Corp Operations Manual, document {doc}, revision {rev}\n\n"
+DISCLAIMER = (
+    "CONFIDENTIAL. This document is the property of Example Corp and may not be "
+    "copied, distributed or disclosed without prior written permission. Printed "
+    "copies are uncontrolled; check the document system for the current revision "
+    "before use. Printed on 2024-{month:02d}-{day:02d}.\n\nPage {page} of {pages}"
+)
+
+
+def paragraph(rng: random.Random) -> str:
+    words, length = [], 0
+    while length < rng.randint(700, 950):
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words) + "."
+
+
+def make_corpus(directory: Path, docs: int, pages: int, revisions: float, seed: int = 0) -> list:
+    """Write the corpus and return the file paths."""
+    rng = random.Random(seed)
+    bodies = {}
+    paths = []
+    for doc in range(docs):
+        if bodies and rng.random() < revisions:
+            # A revision of an earlier document with a few paragraphs rewritten
+            original = rng.choice(list(bodies.values()))
+            body = [paragraph(rng) if rng.random() < 0.1 else p for p in original]
+        else:
+            body = [paragraph(rng) for _ in range(pages * 2)]
+        bodies[doc] = body
+
+        month, day = rng.randint(1, 12), rng.randint(1, 28)
+        page_texts = []
+        for page in range(pages):
+            page_texts.append(
+                HEADER.format(doc=doc, rev=rng.randint(1, 9))
+                + "\n\n".join(body[2 * page : 2 * page + 2])
+                + "\n\n"
+                + DISCLAIMER.format(month=month, day=day, page=page + 1, pages=pages)
+            )
+        path = directory / f"doc-{doc:04d}.txt"
+        path.write_text("\n\n".join(page_texts), encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def directory_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def run(mode: str, paths: list, queries: list, dim: int, kb_path: Path) -> dict:
+    """Ingest the corpus with one dedup mode, then save it and time retrieval."""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    rag = RAGSystem(embed_cache_path=None, answer_cache_size=0, dedup=mode)
+    rag.embeddings = DeterministicFakeEmbedding(size=dim)
+    start = time.perf_counter()
+    rag.process_documents(paths)
+    ingest_seconds = time.perf_counter() - start
+    rag.save_knowledge_base(str(kb_path))
+
+    timings, distinct = [], []
+    for query in queries:
+        start = time.perf_counter()
+        docs = rag.retriever.invoke(query)
+        timings.append(time.perf_counter() - start)
+        distinct.append(len({doc.page_content for doc in docs}))
+    timings.sort()
+    stats = rag.last_ingest_stats
+    return {
+        "chunks": stats["chunks"],
+        "duplicate_chunks": stats.get("duplicate_chunks", 0),
+        "ingest_s": ingest_seconds,
+        "index_bytes": directory_size(kb_path),
+        "query_p50_ms": 1000 * statistics.median(timings),
+        "query_p95_ms": 1000 * timings[int(0.95 * (len(timings) - 1))],
+        "distinct_top_k": statistics.mean(distinct),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=40)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--revisions", type=float, default=0.3, help="share of documents that revise another")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384, help="fake embedding dimension")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    queries = [" ".join(rng.choice(WORDS) for _ in range(6)) for _ in range(args.queries)]
+    queries += ["confidential printed copies uncontrolled"] * (args.queries // 10)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = Path(tmp) / "corpus"
+        corpus.mkdir()
+        paths = make_corpus(corpus, args.docs, args.pages, args.revisions)
+        for mode in ("off", "exact", "near"):
+            results[mode] = run(mode, paths, queries, args.dim, Path(tmp) / f"kb-{mode}")
+
+    baseline = results["off"]
+    for row in results.values():
+        total = row["chunks"] + row["duplicate_chunks"]
+        row["removed_pct"] = 100 * row["duplicate_chunks"] / total
+        row["index_saving_pct"] = 100 * (1 - row["index_bytes"] / baseline["index_bytes"])
+        row["latency_saving_pct"] = 100 * (1 - row["query_p50_ms"] / baseline["query_p50_ms"])
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        f"{'dedup':<6} {'chunks':>7} {'removed':>8} {'index':>9} {'saved':>6} "
+        f"{'p50 ms':>7} {'p95 ms':>7} {'saved':>6} {'distinct top-k':>15}"
+    )
+    for mode, row in results.items():
+        print(
+            f"{mode:<6} {row['chunks']:>7} {row['removed_pct']:>7.1f}% "
+            f"{row['index_bytes'] / 2**20:>6.1f} MB {row['index_saving_pct']:>5.1f}% "
+            f"{row['query_p50_ms']:>7.2f} {row['query_p95_ms']:>7.2f} "
+            f"{row['latency_saving_pct']:>5.1f}% {row['distinct_top_k']:>15.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
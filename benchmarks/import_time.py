@@ -0,0 +1,129 @@
+"""
+Cold-start time of each Streamlit page, optionally compared with another git revision.
+
+Every page runs in a fresh interpreter, as it does after a server restart.
+The timing covers the page's top-level imports plus creating the session's
+RAGSystem, which is all a page does before it renders anything. No Ollama
+server is needed because the model clients are never called.
+
+Usage:
+    python benchmarks/import_time.py --baseline HEAD~1 --repeat 5
+"""
+
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Runs inside the child interpreter: argv = [tree, page imports]
+CHILD = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+exec(sys.argv[2], {})
+agent = sys.modules.get("Agent")
+if hasattr(agent, "get_session_rag"):
+    agent.get_session_rag({})
+print(time.perf_counter() - start)
+"""
+
+
+def page_files(tree: Path):
+    """Return the app entry point followed by the multipage scripts."""
+    return [tree / "DocuBuddy.py"] + sorted((tree / "pages").glob("*.py"))
+
+
+def page_imports(page: Path, skip: set) -> str:
+    """Return the page's top-level import statements as source code."""
+    tree = ast.parse(page.read_text(encoding="utf-8"))
+    lines = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            names = [node.module or ""]
+        else:
+            continue
+        if not any(name.split(".")[0] in skip for name in names):
+            lines.append(ast.unparse(node))
+    return "\n".join(lines)
+
+
+def measure(tree: Path, page: Path, repeat: int, skip: set) -> float:
+    """Median seconds until the page is ready to render."""
+    code = page_imports(page, skip)
+    samples = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(repeat):
+            out = subprocess.run(
+                [sys.executable, "-c", CHILD, str(tree), code],
+                cwd=workdir,  # keeps the embedding cache out of the repo
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def export_revision(ref: str, target: Path) -> Path:
+    """Extract a git revision of the repository into target."""
+    archive = subprocess.run(
+        ["git", "archive", "--format=tar", ref],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        check=True,
+    ).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--baseline", help="git revision to compare against, e.g. HEAD~1")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    skip = set()
+    try:
+        import streamlit  # noqa: F401
+    except ImportError:
+        # Same cost before and after; leave it out rather than fail
+        skip.add("streamlit")
+        print("streamlit is not installed; its import is not timed", file=sys.stderr)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline_tree = export_revision(args.baseline, Path(tmp)) if args.baseline else None
+        for page in page_files(REPO_ROOT):
+            name = str(page.relative_to(REPO_ROOT))
+            results[name] = {"current_s": measure(REPO_ROOT, page, args.repeat, skip)}
+            if baseline_tree is not None and (baseline_tree / name).exists():
+                results[name]["baseline_s"] = measure(
+                    baseline_tree, baseline_tree / name, args.repeat, skip
+                )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'page':<40} {'current':>9} {'baseline':>9} {'speedup':>8}")
+    for name, row in results.items():
+        baseline = row.get("baseline_s")
+        speedup = f"{baseline / row['current_s']:.1f}x" if baseline else "-"
+        baseline_text = f"{baseline:.3f}s" if baseline else "-"
+        print(f"{name:<40} {row['current_s']:>8.3f}s {baseline_text:>9} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
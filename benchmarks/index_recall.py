@@ -0,0 +1,122 @@
+"""
+Recall vs latency report for the FAISS index types supported by RAGSystem.
+
+Builds each index with ``build_faiss_index`` on a synthetic clustered
+corpus and compares its top-k results with an exact Flat index.
+
+Usage:
+    python benchmarks/index_recall.py --vectors 200000 --dim 768 \
+        --specs "HNSW32" "IVF1024,Flat" "IVF1024,PQ64" "IVF1024,SQ8"
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Agent import apply_search_params, build_faiss_index  # noqa: E402
+
+
+def make_corpus(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Generate clustered float32 vectors, roughly like sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    noise = rng.normal(scale=0.3, size=(n, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def timed_search(index: faiss.Index, queries: np.ndarray, k: int):
+    """Search one query at a time, as RAGSystem does, and return (ids, ms per query)."""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        _, ids[i] = index.search(query[None, :], k)
+    return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Fraction of the exact top-k neighbours that the index also returned."""
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--train-size", type=int, default=50_000)
+    parser.add_argument(
+        "--specs", nargs="+", default=["HNSW32", "IVF1024,Flat", "IVF1024,PQ64", "IVF1024,SQ8"]
+    )
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument("--output", help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.vectors, args.dim, clusters=256, seed=0)
+    queries = make_corpus(args.queries, args.dim, clusters=256, seed=1)
+
+    flat = build_faiss_index("Flat", corpus[:1])
+    flat.add(corpus)
+    truth, flat_ms = timed_search(flat, queries, args.k)
+    results = [
+        {
+            "index": "Flat",
+            "params": {},
+            "recall": 1.0,
+            "ms_per_query": flat_ms,
+            "bytes": faiss.serialize_index(flat).nbytes,
+        }
+    ]
+
+    for spec in args.specs:
+        build_start = time.perf_counter()
+        index = build_faiss_index(spec, corpus[: args.train_size])
+        index.add(corpus)
+        build_s = time.perf_counter() - build_start
+        size = faiss.serialize_index(index).nbytes
+
+        if "IVF" in spec:
+            sweeps = [{"nprobe": n} for n in args.nprobe]
+        elif "HNSW" in spec:
+            sweeps = [{"efSearch": ef} for ef in args.ef_search]
+        else:
+            sweeps = [{}]
+
+        for params in sweeps:
+            apply_search_params(index, params)
+            found, ms = timed_search(index, queries, args.k)
+            results.append(
+                {
+                    "index": spec,
+                    "params": params,
+                    "recall": recall_at_k(found, truth),
+                    "ms_per_query": ms,
+                    "bytes": size,
+                    "build_s": build_s,
+                }
+            )
+
+    print(f"{'index':<16} {'params':<16} {'recall@' + str(args.k):>10} {'ms/query':>10} {'size MB':>10}")
+    for row in results:
+        params = ",".join(f"{k}={v}" for k, v in row["params"].items())
+        print(
+            f"{row['index']:<16} {params:<16} {row['recall']:>10.3f} "
+            f"{row['ms_per_query']:>10.3f} {row['bytes'] / 2**20:>10.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
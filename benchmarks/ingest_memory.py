@@ -0,0 +1,144 @@
+"""
+Peak memory of loading and splitting large documents, eager vs lazy.
+
+"eager" is the previous path: ``loader.load()`` builds every page, then
+``split_documents`` builds every chunk. "lazy" is ``iter_document_chunks``,
+consumed in embedding-sized batches that are dropped once handed on, as
+the ingestion pipeline does. Each run happens in a fresh subprocess so
+peaks do not leak between runs.
+
+Usage:
+    python benchmarks/ingest_memory.py --pdf-pages 2000 --txt-mb 100
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Runs inside the child interpreter: argv = [repo, file, mode, trace]
+CHILD = """
+import json, resource, sys, time, tracemalloc
+from itertools import islice
+sys.path.insert(0, sys.argv[1])
+from Agent import _build_text_splitter, iter_document_chunks
+from langchain_community.document_loaders import PyPDFLoader, TextLoader
+import pypdf  # imported up front so module loading is not counted
+
+file_path, mode, trace = sys.argv[2], sys.argv[3], sys.argv[4] == "1"
+splitter = _build_text_splitter(1000, 200)
+scale = 1 if sys.platform == "darwin" else 1024
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+if trace:
+    tracemalloc.start()
+start = time.perf_counter()
+if mode == "eager":
+    loader = PyPDFLoader(file_path) if file_path.endswith(".pdf") else TextLoader(file_path)
+    chunks = splitter.split_documents(loader.load())
+    count = len(chunks)
+else:
+    chunks = iter_document_chunks(file_path, splitter)
+    count = 0
+    while True:
+        batch = list(islice(chunks, 64))
+        if not batch:
+            break
+        count += len(batch)
+elapsed = time.perf_counter() - start
+traced = tracemalloc.get_traced_memory()[1] if trace else None
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+print(json.dumps({
+    "chunks": count,
+    "seconds": elapsed,
+    "peak_traced_mb": traced / 2**20 if traced is not None else None,
+    "peak_rss_growth_mb": (rss_after - rss_before) / 2**20,
+}))
+"""
+
+
+def make_pdf(path: Path, pages: int) -> None:
+    """Write a PDF with a few paragraphs of distinct text on every page."""
+    import pymupdf
+
+    doc = pymupdf.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        text = "\n".join(
+            f"Page {page_number} line {line}: component C-{page_number % 97}{line} "
+            f"reported status code E-{(page_number * 31 + line) % 9973} during step {line}."
+            for line in range(45)
+        )
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=8)
+    doc.save(path)
+
+
+def make_txt(path: Path, megabytes: int) -> None:
+    """Write a plain-text file of roughly the given size, one paragraph at a time."""
+    target = megabytes * 2**20
+    with open(path, "w", encoding="utf-8") as f:
+        paragraph = 0
+        while f.tell() < target:
+            f.write(
+                " ".join(f"Paragraph {paragraph} sentence {i} about topic T{i * paragraph % 501}."
+                         for i in range(12))
+                + "\n\n"
+            )
+            paragraph += 1
+
+
+def run(file_path: Path, mode: str, trace: bool) -> dict:
+    """Measure one mode on one file in a fresh interpreter."""
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, str(REPO_ROOT), str(file_path), mode, "1" if trace else "0"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pdf-pages", type=int, default=2000)
+    parser.add_argument("--txt-mb", type=int, default=100)
+    parser.add_argument(
+        "--trace", action="store_true", help="also report tracemalloc peaks (much slower)"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {}
+        if args.pdf_pages:
+            pdf_path = Path(tmp) / "large.pdf"
+            make_pdf(pdf_path, args.pdf_pages)
+            files[f"pdf ({args.pdf_pages} pages)"] = pdf_path
+        if args.txt_mb:
+            txt_path = Path(tmp) / "large.txt"
+            make_txt(txt_path, args.txt_mb)
+            files[f"txt ({args.txt_mb} MB)"] = txt_path
+
+        for label, file_path in files.items():
+            for mode in ("eager", "lazy"):
+                results[f"{label} {mode}"] = run(file_path, mode, args.trace)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'run':<28} {'chunks':>8} {'seconds':>8} {'RSS growth':>11} {'traced peak':>12}")
+    for label, row in results.items():
+        traced = f"{row['peak_traced_mb']:.1f} MB" if row["peak_traced_mb"] is not None else "-"
+        print(
+            f"{label:<28} {row['chunks']:>8} {row['seconds']:>8.2f} "
+            f"{row['peak_rss_growth_mb']:>8.1f} MB {traced:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
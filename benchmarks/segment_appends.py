@@ -0,0 +1,147 @@
+"""
+Save cost of small appends, query latency per segment count and compaction time.
+
+A knowledge base of ``--docs`` synthetic documents is built with fake
+embeddings (no Ollama server needed) and saved. Then one small document
+at a time is ingested and saved back to the same directory, which writes
+only a new segment; for comparison the same store is also written as a
+full snapshot to another directory. Dense retrieval latency is measured
+as segments pile up, with background compaction disabled, and once more
+after ``compact_knowledge_base`` has merged them into one segment.
+
+Usage:
+    python benchmarks/segment_appends.py --docs 200 --appends 32 --dim 384
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Agent import (  # noqa: E402
+    RAGSystem,
+    SegmentCompactor,
+    compact_knowledge_base,
+    read_manifest,
+    write_knowledge_base,
+)
+
+WORDS = (
+    "pump valve sensor pressure flow inspection maintenance schedule operator "
+    "calibration turbine bearing seal lubricant vibration alarm threshold shift "
+    "report supplier invoice warranty replacement torque coupling filter manifold"
+).split()
+
+
+def write_document(path: Path, rng: random.Random, paragraphs: int) -> str:
+    text = "\n\n".join(
+        " ".join(rng.choice(WORDS) + (str(rng.randrange(1000)) if rng.random() < 0.2 else "") for _ in range(150))
+        for _ in range(paragraphs)
+    )
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def retrieve_p50_ms(rag: RAGSystem, queries: list, k: int) -> float:
+    seconds = []
+    for query in queries:
+        start = time.perf_counter()
+        rag.vector_store.similarity_search_with_score_by_vector(query, k=k)
+        seconds.append(time.perf_counter() - start)
+    return 1000 * statistics.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=200, help="documents in the initial knowledge base")
+    parser.add_argument("--paragraphs", type=int, default=20, help="paragraphs per initial document")
+    parser.add_argument("--appends", type=int, default=32, help="one-document saves to measure")
+    parser.add_argument("--append-paragraphs", type=int, default=3, help="paragraphs per appended document")
+    parser.add_argument("--every", type=int, default=8, help="report every this many appends")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    embeddings = DeterministicFakeEmbedding(size=args.dim)
+    queries = [embeddings.embed_query(" ".join(rng.sample(WORDS, 3))) for _ in range(args.queries)]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        docs = [write_document(tmp_path / f"doc{i}.txt", rng, args.paragraphs) for i in range(args.docs)]
+        kb_path = str(tmp_path / "kb")
+        rag = RAGSystem(answer_cache_size=0)
+        rag.embeddings = embeddings
+        # Keep every segment so query latency can be measured against their number
+        rag.compactor = SegmentCompactor(max_segments=args.appends + 1, max_deleted_ratio=1.0)
+        rag.process_documents(docs)
+        rag.save_knowledge_base(kb_path)
+        rag.load_knowledge_base(kb_path)
+
+        delta_ms, snapshot_ms = [], []
+        for number in range(1, args.appends + 1):
+            doc = write_document(tmp_path / f"append{number}.txt", rng, args.append_paragraphs)
+            rag.process_documents([doc])
+            start = time.perf_counter()
+            rag.save_knowledge_base(kb_path)
+            delta_ms.append(1000 * (time.perf_counter() - start))
+
+            start = time.perf_counter()
+            write_knowledge_base(
+                str(tmp_path / "snapshot"),
+                rag.vector_store,
+                rag.bm25,
+                {"version": 1, "index_factory": rag.index_factory, "documents": rag.manifest},
+            )
+            snapshot_ms.append(1000 * (time.perf_counter() - start))
+
+            if number % args.every == 0 or number == args.appends:
+                rows.append(
+                    {
+                        "appends": number,
+                        "segments": len(read_manifest(kb_path)["segments"]),
+                        "chunks": rag.vector_store.index.ntotal,
+                        "delta_save_ms": statistics.median(delta_ms),
+                        "snapshot_save_ms": statistics.median(snapshot_ms),
+                        "retrieve_p50_ms": retrieve_p50_ms(rag, queries, args.k),
+                    }
+                )
+                delta_ms, snapshot_ms = [], []
+
+        start = time.perf_counter()
+        compact_knowledge_base(kb_path, max_segments=0)
+        compact_ms = 1000 * (time.perf_counter() - start)
+        rag.load_knowledge_base(kb_path)
+        compacted = {
+            "segments": len(read_manifest(kb_path)["segments"]),
+            "compact_ms": compact_ms,
+            "retrieve_p50_ms": retrieve_p50_ms(rag, queries, args.k),
+        }
+
+    if args.json:
+        print(json.dumps({"appends": rows, "compacted": compacted}, indent=2))
+        return
+
+    print(f"{'appends':>7} {'segments':>8} {'chunks':>7} {'delta ms':>9} {'snapshot ms':>11} {'query p50 ms':>12}")
+    for row in rows:
+        print(
+            f"{row['appends']:>7} {row['segments']:>8} {row['chunks']:>7} {row['delta_save_ms']:>9.1f} "
+            f"{row['snapshot_save_ms']:>11.1f} {row['retrieve_p50_ms']:>12.3f}"
+        )
+    print(
+        f"compacted into {compacted['segments']} segment(s) in {compacted['compact_ms']:.1f} ms; "
+        f"query p50 {compacted['retrieve_p50_ms']:.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
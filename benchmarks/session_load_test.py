@@ -0,0 +1,120 @@
+"""
+Multi-session load test for per-session RAGSystem instances.
+
+Builds a small knowledge base, then runs concurrent queries from several
+sessions that share one SharedResources pool. Checks that every session's
+chat memory holds only its own questions and reports latency and
+throughput. Embeddings and the LLM are offline stand-ins.
+
+Usage:
+    python benchmarks/session_load_test.py --sessions 16 --queries 20
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Agent import RAGSystem, SharedResources  # noqa: E402
+
+
+class EchoChatModel(BaseChatModel):
+    """Chat model that echoes the question after a fixed delay."""
+
+    latency: float = 0.02
+
+    @property
+    def _llm_type(self) -> str:
+        return "echo"
+
+    def _generate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        answer = f"Answer to: {messages[-1].content}"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+
+def build_knowledge_base(root: Path, resources: SharedResources, files: int) -> Path:
+    """Write synthetic text files and index them into a KB under root."""
+    for i in range(files):
+        paragraphs = [
+            f"Document {i} section {j} describes component C-{i}{j:02d} and its maintenance."
+            for j in range(50)
+        ]
+        (root / f"doc_{i}.txt").write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+    kb_path = root / "kb"
+    builder = RAGSystem(embed_cache_path=None, resources=resources)
+    builder.process_documents([str(p) for p in sorted(root.glob("doc_*.txt"))])
+    builder.save_knowledge_base(str(kb_path))
+    return kb_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    resources = SharedResources(
+        embeddings_factory=lambda model, base_url: DeterministicFakeEmbedding(size=256),
+        llm_factory=lambda model, temperature, base_url, callbacks: EchoChatModel(
+            latency=args.llm_latency
+        ),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        kb_path = build_knowledge_base(Path(tmp), resources, args.files)
+        sessions = [RAGSystem(embed_cache_path=None, resources=resources) for _ in range(args.sessions)]
+        for session in sessions:
+            session.load_knowledge_base(str(kb_path))
+        print(f"Shared pool after loading: {resources.stats()['knowledge_bases']}")
+
+        def run_session(index: int) -> List[float]:
+            latencies = []
+            for j in range(args.queries):
+                start = time.perf_counter()
+                sessions[index].query(f"Session {index} question {j} about component C-{j}01?")
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+            results = list(executor.map(run_session, range(args.sessions)))
+        elapsed = time.perf_counter() - start
+
+        # Each session must only remember its own conversation
+        for index, session in enumerate(sessions):
+            questions = [m.content for m in session.memory.chat_memory.messages if m.type == "human"]
+            assert len(questions) == args.queries, f"session {index} has {len(questions)} turns"
+            assert all(q.startswith(f"Session {index} ") for q in questions), f"session {index} leaked"
+
+        latencies = sorted(l for session_latencies in results for l in session_latencies)
+        total = len(latencies)
+        print(f"{total} queries from {args.sessions} sessions in {elapsed:.2f}s ({total / elapsed:.1f} q/s)")
+        print(
+            f"latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p95 {latencies[int(0.95 * (total - 1))] * 1000:.1f} ms"
+        )
+        print("Session isolation: OK")
+
+        for session in sessions:
+            session.close()
+        print(f"Shared pool after release: {resources.stats()['knowledge_bases']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Throughput of FastTextSplitter against LangChain's RecursiveCharacterTextSplitter.
+
+Three synthetic corpora cover the shapes ingestion sees: prose with
+blank-line paragraphs, PDF-style text with a line break every line and
+no paragraphs, and run-on text without any line breaks. Token-length
+rows need the tiktoken encoding files, which tiktoken downloads on
+first use; they are skipped if the encoding cannot be loaded.
+
+Usage:
+    python benchmarks/splitter_throughput.py --size-mb 20 --encoding cl100k_base
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Agent import _build_text_splitter  # noqa: E402
+
+WORDS = (
+    "the component reported status code E-1042 during step v2.3.1 while the "
+    "service restarted and operators reviewed logs before escalating incident "
+    "naïve café résumé 東京 configuration deployment latency throughput"
+).split()
+
+
+def make_text(shape: str, size_mb: float, seed: int = 0) -> str:
+    """Generate text of the given shape: "paragraphs", "lines" or "runon"."""
+    rng = random.Random(seed)
+    target = int(size_mb * 2**20)
+    parts, length = [], 0
+    while length < target:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30))) + "."
+        if shape == "paragraphs":
+            sentence += "\n\n" if rng.random() < 0.15 else " "
+        elif shape == "lines":
+            sentence += "\n"
+        else:
+            sentence += " "
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+
+def measure(splitter, text: str, repeat: int, length) -> dict:
+    """Best-of-N throughput plus chunk statistics."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = splitter.split_text(text)
+        timings.append(time.perf_counter() - start)
+    sizes = [length(chunk) for chunk in chunks]
+    return {
+        "mb_per_s": len(text.encode("utf-8")) / 2**20 / min(timings),
+        "chunks": len(chunks),
+        "mean_size": statistics.mean(sizes),
+        "max_size": max(sizes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--token-chunk-size", type=int, default=256)
+    parser.add_argument("--token-chunk-overlap", type=int, default=32)
+    parser.add_argument("--encoding", default="cl100k_base", help="tiktoken encoding for token rows")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    configs = {
+        "recursive chars": (_build_text_splitter(args.chunk_size, args.chunk_overlap), len),
+        "fast chars": (_build_text_splitter(args.chunk_size, args.chunk_overlap, "fast"), len),
+    }
+    try:
+        from Agent import _tiktoken_encoding
+
+        encoding = _tiktoken_encoding(args.encoding)
+        token_length = lambda chunk: len(encoding.encode(chunk, disallowed_special=()))  # noqa: E731
+        for engine in ("recursive", "fast"):
+            splitter = _build_text_splitter(
+                args.token_chunk_size, args.token_chunk_overlap, engine, args.encoding
+            )
+            configs[f"{engine} tokens"] = (splitter, token_length)
+    except Exception as e:
+        print(f"Skipping token-length splitters: {e}", file=sys.stderr)
+
+    results = {}
+    for shape in ("paragraphs", "lines", "runon"):
+        text = make_text(shape, args.size_mb)
+        for name, (splitter, length) in configs.items():
+            results[f"{shape} / {name}"] = measure(splitter, text, args.repeat, length)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'corpus / splitter':<32} {'MB/s':>8} {'chunks':>8} {'mean':>7} {'max':>6}")
+    for name, row in results.items():
+        print(
+            f"{name:<32} {row['mb_per_s']:>8.1f} {row['chunks']:>8} "
+            f"{row['mean_size']:>7.0f} {row['max_size']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+End-to-end benchmark suite for RAGSystem: ingestion, knowledge base I/O and queries.
+
+Each format (TXT, DOCX, PDF) gets a synthetic corpus generated from a
+fixed seed, so every run sees the same documents. The corpus is ingested
+in a fresh interpreter with deterministic fake embeddings and a fake
+chat model, so no Ollama server is needed and peak RSS belongs to that
+scenario alone. Query timings cover the whole ``query`` path (retrieval
+plus prompt building and a constant-time fake LLM call), with chat
+memory cleared and the answer cache off so every question does the same
+work.
+
+Results are written as JSON together with the library versions and git
+commit. Pass ``--save-baseline`` to store them as the baseline; later
+runs are compared against it and metrics that got worse by more than
+``--tolerance`` are flagged (``--fail-on-regression`` turns that into a
+non-zero exit status for CI). Baselines are only comparable on the same
+machine with the same corpus settings.
+
+Usage:
+    python benchmarks/suite.py --size small --save-baseline
+    python benchmarks/suite.py --size small --output results.json --fail-on-regression
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+from Agent import RAGSystem, SharedResources  # noqa: E402
+
+# Preset corpus sizes: documents per format and pages per document
+SIZES = {"small": (20, 4), "medium": (100, 10), "large": (400, 20)}
+
+# Metric -> True if higher is better; these are the ones compared to the baseline
+METRICS = {
+    "ingest_docs_per_s": True,
+    "ingest_mb_per_s": True,
+    "peak_rss_mb": False,
+    "index_mb": False,
+    "kb_save_ms": False,
+    "kb_load_ms": False,
+    "retrieve_p50_ms": False,
+    "retrieve_p99_ms": False,
+    "query_p50_ms": False,
+    "query_p99_ms": False,
+}
+
+PACKAGES = ["langchain", "langchain-core", "langchain-community", "faiss-cpu", "numpy", "pypdf", "docx2txt"]
+
+WORDS = (
+    "pump valve sensor pressure flow inspection maintenance schedule operator "
+    "calibration turbine bearing seal lubricant vibration alarm threshold shift "
+    "report supplier invoice warranty replacement torque coupling filter manifold "
+    "the a of and to with during after before each every reading measured"
+).split()
+
+
+class BenchChatModel(BaseChatModel):
+    """Chat model with a fixed answer, optional delay and word-count token usage."""
+
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench"
+
+    def _generate(
+        self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        prompt_words = sum(len(str(m.content).split()) for m in messages)
+        answer = f"The context mentions {prompt_words} words relevant to: {messages[-1].content[:80]}"
+        usage = {"input_tokens": prompt_words, "output_tokens": len(answer.split())}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer, usage_metadata=usage))])
+
+
+def page_paragraphs(rng: random.Random, doc: int, page: int) -> List[str]:
+    """Three paragraphs of about 600 characters naming this document's components."""
+    paragraphs = []
+    for i in range(3):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(80, 110))]
+        words.insert(rng.randrange(len(words)), f"C-{doc:04d}-{page:03d}{i}")
+        paragraphs.append(" ".join(words).capitalize() + ".")
+    return paragraphs
+
+
+def make_txt(path: Path, rng: random.Random, doc: int, pages: int) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for page in range(pages):
+            f.write("\n\n".join(page_paragraphs(rng, doc, page)) + "\n\n")
+
+
+def make_docx(path: Path, rng: random.Random, doc: int, pages: int) -> None:
+    import docx
+
+    document = docx.Document()
+    for page in range(pages):
+        document.add_heading(f"Section {page + 1}", level=2)
+        for paragraph in page_paragraphs(rng, doc, page):
+            document.add_paragraph(paragraph)
+    document.save(str(path))
+
+
+def make_pdf(path: Path, rng: random.Random, doc: int, pages: int) -> None:
+    import pymupdf
+
+    document = pymupdf.open()
+    for page in range(pages):
+        pdf_page = document.new_page()
+        text = "\n\n".join(page_paragraphs(rng, doc, page))
+        pdf_page.insert_textbox(pdf_page.rect + (36, 36, -36, -36), text, fontsize=9)
+    document.save(str(path), no_new_id=True)
+
+
+GENERATORS = {"txt": make_txt, "docx": make_docx, "pdf": make_pdf}
+
+
+def make_corpus(directory: Path, fmt: str, docs: int, pages: int, seed: int) -> List[str]:
+    """Write one format's corpus and return the file paths."""
+    rng = random.Random(f"{seed}-{fmt}")
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for doc in range(docs):
+        path = directory / f"doc-{doc:04d}.{fmt}"
+        GENERATORS[fmt](path, rng, doc, pages)
+        paths.append(str(path))
+    return paths
+
+
+def make_queries(count: int, docs: int, pages: int, seed: int) -> List[str]:
+    rng = random.Random(f"{seed}-queries")
+    return [
+        f"What does the {rng.choice(WORDS)} {rng.choice(WORDS)} report say about "
+        f"C-{rng.randrange(docs):04d}-{rng.randrange(pages):03d}{rng.randrange(3)}?"
+        for _ in range(count)
+    ]
+
+
+def directory_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def make_resources(config: Dict[str, Any]) -> SharedResources:
+    return SharedResources(
+        embeddings_factory=lambda model, base_url: DeterministicFakeEmbedding(size=config["dim"]),
+        llm_factory=lambda model, temperature, base_url, callbacks: BenchChatModel(
+            latency=config["llm_latency_ms"] / 1000
+        ),
+    )
+
+
+def make_rag(config: Dict[str, Any], resources: SharedResources) -> RAGSystem:
+    return RAGSystem(
+        embed_cache_path=None,
+        answer_cache_size=0,
+        resources=resources,
+        ingest_workers=config["workers"],
+        dedup=config["dedup"],
+        vector_backend=config["vector_backend"],
+        splitter_engine=config["splitter"],
+    )
+
+
+def run_scenario(paths: List[str], queries: List[str], kb_path: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Ingest, save, load and query one corpus; runs in a fresh interpreter."""
+    rss_start = peak_rss_mb()
+    rag = make_rag(config, make_resources(config))
+
+    start = time.perf_counter()
+    rag.process_documents(paths)
+    ingest_s = time.perf_counter() - start
+    rss_peak = peak_rss_mb()
+    ingest_stats = rag.last_ingest_stats
+    stages = rag.telemetry.snapshot()["stages"]
+
+    # Every save goes to a fresh directory: saving again to the same one would
+    # only append an empty segment, not write the knowledge base
+    save_ms = []
+    save_paths = [kb_path] + [f"{kb_path}-{number}" for number in range(1, config["repeat"])]
+    for save_path in save_paths:
+        start = time.perf_counter()
+        rag.save_knowledge_base(save_path)
+        save_ms.append(1000 * (time.perf_counter() - start))
+    rag.close()
+    for save_path in save_paths[1:]:
+        shutil.rmtree(save_path, ignore_errors=True)
+
+    # Each load gets its own resource pool so nothing is served from the shared cache
+    load_ms = []
+    for _ in range(config["repeat"]):
+        rag = make_rag(config, make_resources(config))
+        start = time.perf_counter()
+        rag.load_knowledge_base(kb_path)
+        load_ms.append(1000 * (time.perf_counter() - start))
+        rag.close()
+
+    rag = make_rag(config, make_resources(config))
+    rag.load_knowledge_base(kb_path)
+    for question in queries[: config["warmup"]]:
+        rag.retriever.invoke(question)
+        rag.query(question)
+        rag.clear_memory()
+    retrieve_ms, query_ms = [], []
+    for question in queries:
+        start = time.perf_counter()
+        rag.retriever.invoke(question)
+        retrieve_ms.append(1000 * (time.perf_counter() - start))
+        start = time.perf_counter()
+        rag.query(question)
+        query_ms.append(1000 * (time.perf_counter() - start))
+        rag.clear_memory()
+    rag.close()
+
+    corpus_mb = sum(os.path.getsize(path) for path in paths) / 2**20
+    return {
+        "docs": len(paths),
+        "corpus_mb": corpus_mb,
+        "chunks": ingest_stats["chunks"],
+        "duplicate_chunks": ingest_stats.get("duplicate_chunks", 0),
+        "ingest_s": ingest_s,
+        "ingest_docs_per_s": len(paths) / ingest_s,
+        "ingest_mb_per_s": corpus_mb / ingest_s,
+        "peak_rss_mb": rss_peak,
+        "peak_rss_growth_mb": rss_peak - rss_start if rss_peak is not None else None,
+        "index_mb": directory_size(Path(kb_path)) / 2**20,
+        "kb_save_ms": statistics.median(save_ms),
+        "kb_load_ms": statistics.median(load_ms),
+        "retrieve_p50_ms": statistics.median(retrieve_ms),
+        "retrieve_p99_ms": percentile(retrieve_ms, 0.99),
+        "query_p50_ms": statistics.median(query_ms),
+        "query_p99_ms": percentile(query_ms, 0.99),
+        "stage_p50_ms": {stage: stages[stage]["p50_ms"] for stage in ("load", "split", "embed", "index_add") if stage in stages},
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """Interpreter, platform, package versions and git commit of this run."""
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "packages": versions,
+        "commit": commit,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Per-metric change against the baseline; worse by more than tolerance is a regression."""
+    rows = []
+    for scenario, row in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if not base or "error" in row or "error" in base:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            current, previous = row.get(metric), base.get(metric)
+            if current is None or not previous:
+                continue
+            change = current / previous - 1
+            worse = -change if higher_is_better else change
+            status = "regression" if worse > tolerance else "improvement" if worse < -tolerance else "ok"
+            rows.append(
+                {
+                    "scenario": scenario,
+                    "metric": metric,
+                    "baseline": previous,
+                    "current": current,
+                    "change_pct": 100 * change,
+                    "status": status,
+                }
+            )
+    return rows
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print(
+        f"{'scenario':<8} {'docs':>5} {'chunks':>7} {'docs/s':>8} {'MB/s':>6} {'peak RSS':>9} "
+        f"{'index MB':>9} {'save ms':>8} {'load ms':>8} {'ret p50':>8} {'ret p99':>8} "
+        f"{'q p50':>7} {'q p99':>7}"
+    )
+    for scenario, row in results["scenarios"].items():
+        if "error" in row:
+            print(f"{scenario:<8} failed: {row['error']}")
+            continue
+        rss = f"{row['peak_rss_mb']:.0f} MB" if row["peak_rss_mb"] is not None else "-"
+        print(
+            f"{scenario:<8} {row['docs']:>5} {row['chunks']:>7} {row['ingest_docs_per_s']:>8.1f} "
+            f"{row['ingest_mb_per_s']:>6.2f} {rss:>9} {row['index_mb']:>9.1f} {row['kb_save_ms']:>8.1f} "
+            f"{row['kb_load_ms']:>8.1f} {row['retrieve_p50_ms']:>8.2f} {row['retrieve_p99_ms']:>8.2f} "
+            f"{row['query_p50_ms']:>7.2f} {row['query_p99_ms']:>7.2f}"
+        )
+
+
+def print_comparison(rows: List[Dict[str, Any]], baseline: Dict[str, Any]) -> None:
+    commit = baseline.get("environment", {}).get("commit") or "unknown commit"
+    print(f"\nCompared with baseline from {commit}:")
+    for row in rows:
+        if row["status"] == "ok":
+            continue
+        print(
+            f"  {row['status']:<11} {row['scenario']:<6} {row['metric']:<18} "
+            f"{row['baseline']:>10.2f} -> {row['current']:>10.2f} ({row['change_pct']:+.1f}%)"
+        )
+    if all(row["status"] == "ok" for row in rows):
+        print("  all metrics within tolerance")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", choices=sorted(SIZES), default="small", help="corpus preset")
+    parser.add_argument("--docs", type=int, help="documents per format (overrides --size)")
+    parser.add_argument("--pages", type=int, help="pages per document (overrides --size)")
+    parser.add_argument("--formats", nargs="+", choices=sorted(GENERATORS), default=["txt", "docx", "pdf"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10, help="untimed queries before measuring")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each save and load")
+    parser.add_argument("--dim", type=int, default=768, help="fake embedding dimension")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="delay of each fake LLM call")
+    parser.add_argument("--workers", type=int, default=1, help="ingest_workers")
+    parser.add_argument("--dedup", default="exact", choices=["exact", "near", "off"])
+    parser.add_argument("--vector-backend", default="faiss", choices=["faiss", "numpy"])
+    parser.add_argument("--splitter", default="recursive", choices=["recursive", "fast"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=str(Path(__file__).parent / "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on regressions")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    docs, pages = SIZES[args.size]
+    config = {
+        "docs": args.docs or docs,
+        "pages": args.pages or pages,
+        "queries": args.queries,
+        "warmup": args.warmup,
+        "repeat": args.repeat,
+        "dim": args.dim,
+        "llm_latency_ms": args.llm_latency_ms,
+        "workers": args.workers,
+        "dedup": args.dedup,
+        "vector_backend": args.vector_backend,
+        "splitter": args.splitter,
+        "seed": args.seed,
+    }
+    queries = make_queries(config["queries"], config["docs"], config["pages"], config["seed"])
+
+    scenarios = {}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in args.formats:
+            try:
+                paths = make_corpus(Path(tmp) / fmt, fmt, config["docs"], config["pages"], config["seed"])
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    future = executor.submit(run_scenario, paths, queries, str(Path(tmp) / f"kb-{fmt}"), config)
+                    scenarios[fmt] = future.result()
+            except Exception as e:
+                scenarios[fmt] = {"error": f"{type(e).__name__}: {e}"}
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "config": config,
+        "scenarios": scenarios,
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        results["comparison"] = compare(results, baseline, args.tolerance)
+        if baseline.get("config") != config:
+            print("Warning: baseline was recorded with different settings", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+        if baseline is not None:
+            print_comparison(results["comparison"], baseline)
+        elif args.save_baseline:
+            print(f"\nSaved baseline to {args.baseline}")
+
+    regressions = [row for row in results.get("comparison", []) if row["status"] == "regression"]
+    failed = [name for name, row in scenarios.items() if "error" in row]
+    if args.fail_on_regression and (regressions or failed):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Latency, memory and recall of NumpyIndex against a FAISS flat index.
+
+Vectors are synthetic, clustered and unit length, like sentence
+embeddings; queries are perturbed copies of stored vectors. Each index is
+saved and loaded back through ``read_vector_index`` the way a knowledge
+base is opened (memory-mapped where possible), then queried one question
+at a time and in batches. Recall@k is measured against exact float32
+cosine search, which the FAISS flat index matches on unit vectors.
+
+Usage:
+    python benchmarks/vector_backend.py --sizes 5000 20000 50000 --dim 768
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Agent import NumpyIndex, read_vector_index  # noqa: E402
+
+
+def make_vectors(n: int, dim: int, queries: int, seed: int = 0):
+    """Return unit-length corpus and query vectors drawn around shared centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(max(1, n // 100), dim)).astype(np.float32)
+    corpus = centroids[rng.integers(len(centroids), size=n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    picks = rng.integers(n, size=queries)
+    query_vectors = corpus[picks] + 0.3 * rng.normal(size=(queries, dim)).astype(np.float32) / np.sqrt(dim)
+    return corpus, query_vectors.astype(np.float32)
+
+
+def build(backend: str, corpus: np.ndarray):
+    if backend == "faiss flat":
+        import faiss
+
+        index = faiss.IndexFlatL2(corpus.shape[1])
+    else:
+        index = NumpyIndex(corpus.shape[1], backend.split()[1])
+    for start in range(0, len(corpus), 64):
+        index.add(corpus[start : start + 64])
+    return index
+
+
+def save(index, path: str) -> None:
+    if isinstance(index, NumpyIndex):
+        index.save(path)
+    else:
+        import faiss
+
+        faiss.write_index(index, path)
+
+
+def in_memory_bytes(index) -> int:
+    if isinstance(index, NumpyIndex):
+        return index.memory_usage()
+    return index.ntotal * index.d * 4
+
+
+def measure(backend: str, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray, args, tmp: str) -> dict:
+    path = os.path.join(tmp, f"{backend.replace(' ', '-')}.index")
+    save(build(backend, corpus), path)
+
+    start = time.perf_counter()
+    index = read_vector_index(path)
+    load_ms = 1000 * (time.perf_counter() - start)
+
+    single = []
+    positions = []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], args.k)
+        single.append(time.perf_counter() - start)
+        positions.append(found[0])
+    batch_seconds = []
+    for start_row in range(0, len(queries), args.batch):
+        start = time.perf_counter()
+        index.search(queries[start_row : start_row + args.batch], args.k)
+        batch_seconds.append(time.perf_counter() - start)
+
+    recall = statistics.mean(len(set(found) & set(exact)) / args.k for found, exact in zip(positions, truth))
+    return {
+        "load_ms": load_ms,
+        "query_p50_ms": 1000 * statistics.median(single),
+        "query_p95_ms": 1000 * sorted(single)[int(0.95 * (len(single) - 1))],
+        "batched_ms_per_query": 1000 * sum(batch_seconds) / len(queries),
+        "file_mb": os.path.getsize(path) / 2**20,
+        "memory_mb": in_memory_bytes(index) / 2**20,
+        f"recall@{args.k}": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000, 50000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=32, help="queries per batched search")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    backends = ["faiss flat", "numpy float32", "numpy float16", "numpy int8"]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            corpus, queries = make_vectors(n, args.dim, args.queries)
+            truth = np.argsort(-(queries @ corpus.T), axis=1)[:, : args.k]
+            for backend in backends:
+                results[f"{n} / {backend}"] = measure(backend, corpus, queries, truth, args, tmp)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        f"{'vectors / backend':<22} {'load ms':>8} {'p50 ms':>7} {'p95 ms':>7} "
+        f"{'batched':>8} {'file MB':>8} {'mem MB':>7} {'recall':>7}"
+    )
+    for name, row in results.items():
+        print(
+            f"{name:<22} {row['load_ms']:>8.2f} {row['query_p50_ms']:>7.2f} {row['query_p95_ms']:>7.2f} "
+            f"{row['batched_ms_per_query']:>8.3f} {row['file_mb']:>8.1f} {row['memory_mb']:>7.1f} "
+            f"{row[f'recall@{args.k}']:>7.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,116 @@
 import streamlit as st
-import os
 from pathlib import Path
 import logging
-import shutil
+import time
 from datetime import datetime
-from Agent import rag_instance
+from Agent import IngestJobQueue, get_ingest_jobs, get_session_rag
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# FAISS index factory strings offered for new knowledge bases
+INDEX_TYPES = {
+    "Flat": "Exact search, best for small knowledge bases",
+    "HNSW32": "Graph index, fast and accurate, more memory",
+    "IVF1024,SQ8": "Clustered index with 8-bit vectors, 4x smaller",
+    "IVF4096,PQ64": "Clustered index with product quantization, for millions of chunks",
+}
+
+STATUS_ICONS = {
+    "queued": "⏳",
+    "running": "⚙️",
+    "completed": "✅",
+    "failed": "❌",
+    "cancelled": "⏹️",
+    "interrupted": "⚠️",
+}
+
 st.set_page_config(
     page_title="File Management - DocuBuddy", page_icon="📁", layout="wide"
 )
 
 
-def create_kb_directory(kb_name: str) -> Path:
-    """Create a new knowledge base directory with a unique name."""
-    kb_dir = Path("knowledge_bases") / kb_name
-    kb_dir.mkdir(parents=True, exist_ok=True)
-    return kb_dir
-
-
-def save_uploaded_file(uploaded_file, upload_dir: Path) -> Path:
-    """Save an uploaded file to the specified directory."""
-    file_path = upload_dir / uploaded_file.name
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getvalue())
-    return file_path
-
-
-def process_files(files, kb_name: str):
-    """Process uploaded files and create a knowledge base."""
+def process_files(files, kb_name: str, index_factory: str = "Flat"):
+    """Queue uploaded files for ingestion into a new knowledge base."""
+    rag = get_session_rag(st.session_state)
     try:
-        # Create directories
-        upload_dir = Path("uploads")
-        upload_dir.mkdir(exist_ok=True)
-        kb_dir = create_kb_directory(kb_name)
-
-        # Save and process files
-        file_paths = []
-        for file in files:
-            file_path = save_uploaded_file(file, upload_dir)
-            file_paths.append(file_path)
-
-        # Create knowledge base
-        rag_instance.process_documents(file_paths, kb_name=kb_name)
-
-        # Save knowledge base
-        rag_instance.save_knowledge_base(str(kb_dir))
-
-        # Clean up uploaded files
-        for file_path in file_paths:
-            file_path.unlink()
-
-        return True, "Knowledge base created successfully!"
+        # Ingest in the background so this session stays usable; the
+        # directory is created when the first batch is committed
+        kb_dir = Path("knowledge_bases") / kb_name
+        settings = {**rag.ingest_settings(), "index_factory": index_factory}
+        job_id = get_ingest_jobs().submit(str(kb_dir), files, settings)
+        st.session_state.setdefault("ingest_jobs", {})[job_id] = kb_name
+        return True, f"Queued {len(files)} files for processing (job {job_id})"
     except Exception as e:
         logger.error(f"Error processing files: {e}", exc_info=True)
         return False, f"Error: {str(e)}"
 
 
+def activate_finished_jobs(jobs):
+    """Make the knowledge base of a completed job this session submitted the active one."""
+    owned = st.session_state.get("ingest_jobs", {})
+    for job in jobs:
+        if job["id"] in owned and job["status"] == "completed" and job["chunks"]:
+            kb_name = owned.pop(job["id"])
+            try:
+                get_session_rag(st.session_state).load_knowledge_base(job["kb_path"])
+                st.session_state.current_kb = kb_name
+                st.session_state.kb_loaded = True
+            except Exception as e:
+                logger.error(f"Error loading knowledge base: {e}", exc_info=True)
+
+
+def display_jobs() -> bool:
+    """Show recent ingestion jobs; returns True while any of them is still active."""
+    queue = get_ingest_jobs()
+    jobs = queue.list_jobs(limit=10)
+    activate_finished_jobs(jobs)
+    if not jobs:
+        return False
+
+    st.header("Processing Jobs")
+    for job in jobs:
+        status = job["status"]
+        with st.container(border=True):
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.markdown(
+                    f"{STATUS_ICONS.get(status, '')} **{Path(job['kb_path']).name}** · {status} · "
+                    f"{job['files_finished']}/{job['files_total']} files · {job['chunks_read']} chunks read"
+                )
+                st.progress(job["progress"])
+                if job["error"]:
+                    st.error(job["error"])
+            with col2:
+                if status in IngestJobQueue.ACTIVE:
+                    if st.button("Cancel", key=f"cancel_{job['id']}"):
+                        queue.cancel(job["id"])
+                        st.rerun()
+                else:
+                    if status in IngestJobQueue.RESUMABLE and st.button("Resume", key=f"resume_{job['id']}"):
+                        queue.resume(job["id"])
+                        st.rerun()
+                    if st.button("Dismiss", key=f"dismiss_{job['id']}"):
+                        queue.discard(job["id"])
+                        st.rerun()
+            with st.expander("Files"):
+                st.dataframe(
+                    [
+                        {
+                            "File": f["name"],
+                            "Status": f["status"],
+                            "Chunks": f["chunks"],
+                            "Error": f["error"] or "",
+                        }
+                        for f in job["files"]
+                    ],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+    return any(job["status"] in IngestJobQueue.ACTIVE for job in jobs)
+
+
 def display_file_management():
     """Display the file management interface."""
     st.title("📁 File Management")
@@ -71,6 +122,12 @@ def display_file_management():
             value=f"kb_{datetime.now().strftime('%y%m%d_%H%M%S')}",
             help="Enter a name for the new knowledge base",
         )
+        index_factory = st.selectbox(
+            "Index Type",
+            options=list(INDEX_TYPES.keys()),
+            format_func=lambda x: f"{x} - {INDEX_TYPES[x]}",
+            help="Approximate indexes trade a little recall for faster search on large knowledge bases",
+        )
 
     # File upload section
     st.header("Upload Documents")
@@ -88,15 +145,13 @@ def display_file_management():
             st.text(f"• {file.name} ({file.type})")
 
         if st.button("Process Documents", type="primary"):
-            with st.spinner("Processing documents..."):
-                success, message = process_files(uploaded_files, kb_name)
-                if success:
-                    st.success(message)
-                    # Update session state
-                    st.session_state.current_kb = kb_name
-                    st.session_state.kb_loaded = True
-                else:
-                    st.error(message)
+            success, message = process_files(uploaded_files, kb_name, index_factory)
+            if success:
+                st.success(message)
+            else:
+                st.error(message)
+
+    active = display_jobs()
 
     # Display current status
     st.sidebar.divider()
@@ -106,6 +161,11 @@ def display_file_management():
     else:
         st.sidebar.info("No knowledge base loaded")
 
+    # Poll while jobs are running
+    if active and st.sidebar.checkbox("Auto-refresh progress", value=True):
+        time.sleep(2)
+        st.rerun()
+
 
 if __name__ == "__main__":
     display_file_management()
@@ -1,10 +1,10 @@
 import streamlit as st
-import os
 from pathlib import Path
 import logging
 import shutil
+import time
 from datetime import datetime
-from Agent import rag_instance
+from Agent import IngestJobQueue, get_ingest_jobs, get_session_rag, shared_resources
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,14 +22,6 @@ def create_kb_directory(kb_name: str) -> Path:
     return kb_dir
 
 
-def save_uploaded_file(uploaded_file, upload_dir: Path) -> Path:
-    """Save an uploaded file to the specified directory."""
-    file_path = upload_dir / uploaded_file.name
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getvalue())
-    return file_path
-
-
 def get_kb_size(kb_path: Path) -> str:
     """Calculate the total size of a knowledge base directory."""
     total_size = sum(f.stat().st_size for f in kb_path.rglob("*") if f.is_file())
@@ -42,30 +34,17 @@ def get_kb_size(kb_path: Path) -> str:
 
 
 def process_files(files, kb_name: str):
-    """Process uploaded files and create/update a knowledge base."""
+    """Queue uploaded files for ingestion into an existing knowledge base."""
+    rag = get_session_rag(st.session_state)
     try:
-        # Create directories
-        upload_dir = Path("uploads")
-        upload_dir.mkdir(exist_ok=True)
         kb_dir = create_kb_directory(kb_name)
 
-        # Save and process files
-        file_paths = []
-        for file in files:
-            file_path = save_uploaded_file(file, upload_dir)
-            file_paths.append(file_path)
-
-        # Create/update knowledge base
-        rag_instance.process_documents(file_paths, kb_name=kb_name)
-
-        # Save knowledge base
-        rag_instance.save_knowledge_base(str(kb_dir))
-
-        # Clean up uploaded files
-        for file_path in file_paths:
-            file_path.unlink()
-
-        return True, "Knowledge base updated successfully!"
+        # Ingest in the background; sessions pick up each committed batch
+        job_id = get_ingest_jobs().submit(str(kb_dir), files, rag.ingest_settings())
+        return True, (
+            f"Queued {len(files)} files for processing (job {job_id}). "
+            f"Progress is shown below and on the File Management page."
+        )
     except Exception as e:
         logger.error(f"Error processing files: {e}", exc_info=True)
         return False, f"Error: {str(e)}"
@@ -73,10 +52,11 @@ def process_files(files, kb_name: str):
 
 def load_knowledge_base(kb_name: str):
     """Load a knowledge base."""
+    rag = get_session_rag(st.session_state)
     try:
         kb_dir = Path("knowledge_bases") / kb_name
         if kb_dir.exists():
-            rag_instance.load_knowledge_base(str(kb_dir))
+            rag.load_knowledge_base(str(kb_dir))
             st.session_state.current_kb = kb_name
             st.session_state.kb_loaded = True
             return True, f"Loaded knowledge base: {kb_name}"
@@ -87,11 +67,36 @@ def load_knowledge_base(kb_name: str):
         return False, f"Error: {str(e)}"
 
 
+def has_active_jobs(kb_path: str) -> bool:
+    """True if a background job is queued or running for a knowledge base."""
+    return any(job["status"] in IngestJobQueue.ACTIVE for job in get_ingest_jobs().list_jobs(kb_path=kb_path))
+
+
+def delete_document(kb_name: str, doc_name: str):
+    """Remove a single document from the active knowledge base."""
+    rag = get_session_rag(st.session_state)
+    try:
+        kb_dir = Path("knowledge_bases") / kb_name
+        # A job saving into the same KB would race with this save
+        if has_active_jobs(str(kb_dir)):
+            return False, "Documents are being added to this knowledge base; try again when the job is done"
+        if rag.delete_document(doc_name):
+            rag.save_knowledge_base(str(kb_dir))
+            return True, f"Deleted document: {doc_name}"
+        else:
+            return False, f"Document not found: {doc_name}"
+    except Exception as e:
+        logger.error(f"Error deleting document: {e}", exc_info=True)
+        return False, f"Error: {str(e)}"
+
+
 def delete_knowledge_base(kb_name: str):
     """Delete a knowledge base."""
     try:
         kb_dir = Path("knowledge_bases") / kb_name
         if kb_dir.exists():
+            # Drop the cached copy so its memory-mapped index is not kept alive
+            shared_resources.invalidate_knowledge_base(str(kb_dir))
             shutil.rmtree(kb_dir)
 
             # Update session state if the deleted KB was active
@@ -109,12 +114,14 @@ def delete_knowledge_base(kb_name: str):
 
 def display_kb_management():
     """Display the knowledge base management interface."""
+    rag = get_session_rag(st.session_state)
     st.title("📚 Knowledge Base Management")
 
     # Get list of knowledge bases
     kb_dir = Path("knowledge_bases")
     kb_dir.mkdir(exist_ok=True)
-    knowledge_bases = [d.name for d in kb_dir.iterdir() if d.is_dir()]
+    # Dot-directories are snapshots being written or replaced by a save
+    knowledge_bases = [d.name for d in kb_dir.iterdir() if d.is_dir() and not d.name.startswith(".")]
 
     # Sidebar for KB selection and actions
     with st.sidebar:
@@ -181,16 +188,63 @@ def display_kb_management():
         # Only allow processing if a KB is selected
         if st.session_state.get("current_kb"):
             if st.button("Process Documents", type="primary"):
-                with st.spinner("Processing documents..."):
-                    success, message = process_files(
-                        uploaded_files, st.session_state.current_kb
+                success, message = process_files(
+                    uploaded_files, st.session_state.current_kb
+                )
+                if success:
+                    st.success(message)
+                else:
+                    st.error(message)
+        else:
+            st.warning("Please load a knowledge base first")
+
+    # Background jobs adding to the active KB
+    active_jobs = []
+    if st.session_state.get("current_kb"):
+        kb_path = str(Path("knowledge_bases") / st.session_state.current_kb)
+        active_jobs = [
+            job
+            for job in get_ingest_jobs().list_jobs(kb_path=kb_path, limit=5)
+            if job["status"] in IngestJobQueue.ACTIVE
+        ]
+        for job in active_jobs:
+            st.progress(
+                job["progress"],
+                text=(
+                    f"Job {job['id']} {job['status']}: {job['files_finished']}/{job['files_total']} "
+                    f"files, {job['chunks_read']} chunks read"
+                ),
+            )
+
+    # Documents in the active KB, including batches committed by background jobs
+    if st.session_state.get("kb_loaded"):
+        rag.refresh_knowledge_base()
+    documents = rag.list_documents() if st.session_state.get("kb_loaded") else {}
+    if documents:
+        st.divider()
+        st.header("Documents")
+
+        for doc_name, entry in sorted(documents.items()):
+            col1, col2, col3 = st.columns([3, 1, 1])
+            with col1:
+                st.text(f"📄 {doc_name}")
+            with col2:
+                st.text(f"{entry.get('chunks', 0)} chunks")
+            with col3:
+                if st.button(
+                    "Remove",
+                    key=f"remove_{doc_name}",
+                    disabled=bool(active_jobs),
+                    help="Unavailable while documents are being added" if active_jobs else None,
+                ):
+                    success, message = delete_document(
+                        st.session_state.current_kb, doc_name
                     )
                     if success:
                         st.success(message)
+                        st.rerun()
                     else:
                         st.error(message)
-        else:
-            st.warning("Please load a knowledge base first")
 
     # Display KB information
     if knowledge_bases:
@@ -222,5 +276,11 @@ def display_kb_management():
                     )
 
 
+    # Poll while jobs for the active KB are running
+    if active_jobs:
+        time.sleep(2)
+        st.rerun()
+
+
 if __name__ == "__main__":
     display_kb_management()
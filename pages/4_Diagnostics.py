@@ -0,0 +1,108 @@
+import streamlit as st
+import json
+import os
+from Agent import get_session_rag, shared_resources
+
+st.set_page_config(page_title="Diagnostics - DocuBuddy", page_icon="📈", layout="wide")
+
+# Pipeline stages in the order a document and then a question pass through them
+STAGES = {
+    "load": "Load document",
+    "split": "Split into chunks",
+    "embed": "Embed batch",
+    "index_add": "Add batch to index",
+    "checkpoint": "Checkpoint to write-ahead log",
+    "kb_save": "Save knowledge base",
+    "compact": "Compact segments",
+    "kb_load": "Load knowledge base",
+    "answer_cache": "Answer cache hit",
+    "condense": "Condense question",
+    "retrieve": "Retrieve chunks",
+    "retrieve_batch": "Retrieve (batch query)",
+    "llm_first_token": "LLM first token",
+    "llm_total": "LLM answer",
+}
+
+
+def stage_rows(stages: dict) -> list:
+    """Table rows for the recorded stages, known stages first."""
+    names = [name for name in STAGES if name in stages]
+    names += sorted(name for name in stages if name not in STAGES)
+    return [
+        {
+            "Stage": STAGES.get(name, name),
+            "Count": stages[name]["count"],
+            "p50 (ms)": round(stages[name]["p50_ms"], 1),
+            "p95 (ms)": round(stages[name]["p95_ms"], 1),
+            "Mean (ms)": round(stages[name]["mean_ms"], 1),
+            "Max (ms)": round(stages[name]["max_ms"], 1),
+        }
+        for name in names
+    ]
+
+
+def display_diagnostics():
+    """Display pipeline timings, counters and cache statistics."""
+    rag = get_session_rag(st.session_state)
+    telemetry = rag.telemetry
+    st.title("📈 Diagnostics")
+    st.caption(
+        "Timings from every session in this server process. Percentiles cover "
+        f"the last {telemetry.window} runs of each stage."
+    )
+
+    col1, col2 = st.columns([1, 5])
+    with col1:
+        st.button("🔄 Refresh")
+    with col2:
+        if st.button("🧹 Reset"):
+            telemetry.reset()
+
+    snapshot = telemetry.snapshot()
+    counters = snapshot["counters"]
+
+    metric_cols = st.columns(5)
+    metric_cols[0].metric("Questions", int(counters.get("queries", 0)))
+    metric_cols[1].metric("Query errors", int(counters.get("query_errors", 0)))
+    metric_cols[2].metric("Chunks indexed", int(counters.get("chunks_indexed", 0)))
+    metric_cols[3].metric("LLM input tokens", int(counters.get("llm_input_tokens", 0)))
+    metric_cols[4].metric("LLM output tokens", int(counters.get("llm_output_tokens", 0)))
+
+    st.header("Stage Latency")
+    if snapshot["stages"]:
+        st.dataframe(stage_rows(snapshot["stages"]), use_container_width=True, hide_index=True)
+    else:
+        st.info("No timings yet. Process documents or ask a question first.")
+
+    st.header("Caches")
+    cache_cols = st.columns(3)
+    with cache_cols[0]:
+        st.subheader("Embeddings")
+        st.json(rag.get_embedding_cache_stats() or {"enabled": False})
+    with cache_cols[1]:
+        st.subheader("Answers")
+        st.json(rag.get_answer_cache_stats() or {"enabled": False})
+    with cache_cols[2]:
+        st.subheader("Knowledge Bases")
+        st.json(shared_resources.stats())
+
+    with st.expander("All counters"):
+        st.json(counters)
+
+    with st.expander("Export"):
+        port = os.environ.get("DOCUBUDDY_METRICS_PORT")
+        if port:
+            st.write(f"Prometheus metrics are served on port {port} at `/metrics` and `/metrics.json`.")
+        else:
+            st.write("Set `DOCUBUDDY_METRICS_PORT` to serve these metrics for Prometheus.")
+        st.download_button(
+            "Download JSON",
+            data=json.dumps(snapshot, indent=2),
+            file_name="docubuddy-metrics.json",
+            mime="application/json",
+        )
+        st.code(telemetry.to_prometheus(), language="text")
+
+
+if __name__ == "__main__":
+    display_diagnostics()